@@ -1,175 +1,500 @@
+"""
+Dashboard app. `create_app` only builds the Dash app and registers its callbacks: the data
+is loaded the first time the layout is requested or, if APP_WARM_UP, in a background thread
+started by the first request of every process (e.g. its first health check). Importing the
+module has no side effects, so a worker is ready to serve requests right after it starts,
+and no thread is inherited by the workers forked from a preloading master.
+The modules that import pandas or plotly are imported once the data is needed.
+"""
+from logging import getLogger
+from os import getpid
+from threading import Lock, Thread
+from typing import Callable, Optional
 
-from dash import Dash, callback_context, dcc, html
-from dash.dependencies import Input, Output
+from dash import Dash, callback_context, dcc, html, no_update
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+from flask import request
 
-from nakamoto_explorer import input_data
-from nakamoto_explorer import renders
-from nakamoto_explorer.settings import DEBUG_MODE
+from nakamoto_explorer.catalog import SimulationCatalog, get_identifier_key
+from nakamoto_explorer.exceptions import NakamotoExplorerException, ValidationException
+from nakamoto_explorer.instrumentation import instrument_server, instrumentation, timed
+from nakamoto_explorer.settings import (APP_WARM_UP, DEBUG_MODE, INSTRUMENTATION_ENABLED, NAVIGATION_MODE,
+                                        NAVIGATION_PREFETCH_NEIGHBOURS)
 
+logger = getLogger(__name__)
 
-app = Dash(__name__)
-app.title = 'Trading Bot Dashboard'
-server = app.server
+HEALTH_PATH = '/health'
 
-data = input_data.load_data()
-
-app.layout = html.Div(
-    className='dashboard',
-    children=[
-        html.Div(
-            className='nakamoto-banner',
-            children=[
-                html.H2('Trading Bot Dashboard'),
-                html.A(
-                    id='banner-link',
-                    children=['View on GitHub'],
-                    href='https://github.com/carlospinto93p/NakamotoExplorer'
-                ),
-                html.Img(src=app.get_asset_url('github_logo.png')),
-            ],
-        ),
-        html.Div(
-            className='container',
-            children=[
-                html.Div(
-                    id='content',
-                    className='content',
-                    children=[
-                        html.Div(
-                            className='main-table',
-                            children=[
-                                renders.render_simulation_df(data[0]['simulation_df'])
-                            ],
-                        ),
-                        renders.render_simulation_line_graphs(data[0]['simulation_df']),
-                        renders.render_metrics(data[0]['metrics']),
-                    ]
-                ),
-                html.Div(
-                    className='left-panel',
-                    children=[
-                        html.Div(
-                            className='page-settings',
-                            children=[
-                                html.P(['Study Design']),
-                                html.Div(
-                                    className='settings-row',
-                                    children=[
-                                        html.Label(['Mock index']),
-                                        html.Div(id='mock-index', children=['0 / 75'])
-                                    ]
-                                ),
-                                html.Div(
-                                    className='settings-row',
-                                    children=[
-                                        html.Label(['Price list']),
-                                        html.Div([
-                                            dcc.Input(
-                                                id='price-list',
-                                                type='number',
-                                                value=1,
-                                                min=1,
-                                                max=input_data.get_max_price_list_idx(data),
-                                            )]
-                                        )]
-                                ),
-                                html.Div(
-                                    className='settings-row',
-                                    children=[
-                                        html.Label(['Rule Set']),
-                                        html.Div([
-                                            dcc.Input(
-                                                id='rule-set',
-                                                type='number',
-                                                value=1,
-                                                min=1,
-                                                max=input_data.get_max_rule_set_idx(data),
-                                            )]
-                                        )]
-                                ),
-                                html.Div(
-                                    className='settings-row',
-                                    children=[
-                                        html.Div([
-                                            html.Button(
-                                                id='prev-simulation',
-                                                children=['Prev'],
-                                            ),
-                                            html.Button(
-                                                id='next-simulation',
-                                                children=['Next'],
-                                            )]
-                                        )]
-                                ),
-                            ]
-                        ),
-                        html.Div(
-                            id='rule-sets',
-                            children=[
-                                html.Div(
-                                    className='rule-sets',
-                                    children=[
-                                        renders.render_rule_set(data[0]['rule_set_kwargs'])
-                                    ]
-                                )]
-                        )
-
-                    ]
-                ),
-                html.Div(
-                    className='clearing-div',
-                    children=[]
-                )
-            ],
-        )
-    ]
-)
-
-
-@app.callback(
-    Output('content', 'children'),
-    Output('mock-index', 'children'),
-    Output('price-list', 'value'),
-    Output('rule-set', 'value'),
-    Output('rule-sets', 'children'),
-    [Input('next-simulation', 'n_clicks'),
-     Input('prev-simulation', 'n_clicks'),
-     Input('price-list', 'value'),
-     Input('rule-set', 'value')])
-def update_interaction(next_n_clicks: int, prev_n_clicks: int,
-                       price_list_idx: int, rule_set_idx: int):
-    idx, context = 0, callback_context
-    if context.triggered:
-        idx = input_data.get_data_idx(data, price_list_idx=price_list_idx,
-                                      rule_set_idx=rule_set_idx)
-        last_trigger = context.triggered[0]['prop_id'].split('.')[0]
-        if last_trigger == 'next-simulation':
-            idx += 1
-        elif last_trigger == 'prev-simulation':
-            idx -= 1
-    idx = idx % len(data)
-    data_element = data[idx]
-    return (
-        [
+
+class DashboardData:
+    """
+    Data shown by the dashboard, the index of its metrics and the cache of its rendered
+    components, loaded the first time they are requested (or by `warm_up`).
+    :param load_function: function that loads the data (`input_data.load_input_data` by default).
+    """
+
+    def __init__(self, load_function: Optional[Callable[[], SimulationCatalog]] = None):
+        self.load_function = load_function
+        self._data = None
+        self._render_cache = None
+        self._metrics_index = None
+        self._lock = Lock()
+        self._warm_up_pid = None
+        self._warm_up_lock = Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._render_cache is not None
+
+    @property
+    def data(self) -> SimulationCatalog:
+        self.load()
+        return self._data
+
+    @property
+    def render_cache(self):
+        self.load()
+        return self._render_cache
+
+    @property
+    def metrics_index(self):
+        self.load()
+        return self._metrics_index
+
+    def load(self):
+        if self.is_loaded:
+            return
+        with self._lock:
+            if self.is_loaded:
+                return
+            from nakamoto_explorer import input_data
+            from nakamoto_explorer.input_data import LazySimulation
+            from nakamoto_explorer.metrics_index import MetricsIndex, load_metrics_index
+            from nakamoto_explorer.render_cache import RenderCache
+
+            if self.load_function is None:
+                data = input_data.load_input_data()
+                metrics_index = load_metrics_index(data)
+            else:
+                data = self.load_function()
+                metrics_index = MetricsIndex.from_data(data)
+            render_cache = RenderCache()
+            if instrumentation.enabled:
+                instrumentation.register_cache('rendered_components', render_cache.cache)
+                instrumentation.register_cache('downsampling_pyramids', render_cache.pyramids)
+                instrumentation.register_cache('table_positions', render_cache.table_positions)
+                if len(data) and isinstance(data[0], LazySimulation):
+                    instrumentation.register_cache('simulations', data[0].cache)
+            self._data, self._metrics_index, self._render_cache = data, metrics_index, render_cache
+
+    def warm_up(self) -> Thread:
+        """ Load the data and render the first simulation in a background thread. """
+        thread = Thread(target=self._warm_up, name='dashboard-warm-up', daemon=True)
+        thread.start()
+        return thread
+
+    def warm_up_once(self) -> Optional[Thread]:
+        """ Start `warm_up` if it has not been started by the current process yet. """
+        with self._warm_up_lock:
+            if self._warm_up_pid == getpid():
+                return None
+            self._warm_up_pid = getpid()
+        return self.warm_up()
+
+    def _warm_up(self):
+        try:
+            self.render_cache.get_components(self.data, 0)
+        except (Exception, NakamotoExplorerException) as error:
+            # The error is raised again by the first request that needs the data.
+            logger.warning(f'Dashboard data could not be warmed up: {error!r}')
+
+
+def create_app(load_function: Optional[Callable[[], SimulationCatalog]] = None,
+               warm_up: bool = APP_WARM_UP, navigation_mode: str = NAVIGATION_MODE) -> Dash:
+    """
+    Create the dashboard app.
+    :param load_function: function that loads the data (`input_data.load_input_data` by default).
+    :param warm_up: whether to load the data in a background thread when the process gets
+        its first request, instead of in the first request that needs the data.
+    :param navigation_mode: where the Prev / Next navigation runs (see NAVIGATION_MODE).
+    """
+    if navigation_mode not in ('server', 'client'):
+        raise ValidationException(f'Unknown {navigation_mode = }')
+
+    app = Dash(__name__)
+    app.title = 'Trading Bot Dashboard'
+    dashboard = DashboardData(load_function)
+    # Otherwise, Dash would render the layout (loading the data) to validate the callbacks.
+    app.validation_layout = render_validation_layout()
+    app.layout = lambda: render_layout(app, dashboard)
+
+    def warm_up_dashboard():
+        dashboard.warm_up_once()
+
+    def health():
+        if request.path == HEALTH_PATH:
+            return {'status': 'ok', 'data_loaded': dashboard.is_loaded}
+
+    # Dash renders the layout before the first request of the server, so the health checks
+    # are answered before that.
+    before_request_funcs = app.server.before_request_funcs.setdefault(None, [])
+    before_request_funcs.insert(0, health)
+    if warm_up:
+        # Started by the requests and not here, so it runs in every worker process.
+        before_request_funcs.insert(0, warm_up_dashboard)
+    if INSTRUMENTATION_ENABLED:
+        instrument_server(app.server)
+    register_callbacks(app, dashboard, navigation_mode)
+    return app
+
+
+def render_layout(app: Dash, dashboard: DashboardData) -> html.Div:
+    """ Render the layout of the app, showing the first simulation. """
+    from nakamoto_explorer import input_data, renders
+
+    data = dashboard.data
+    initial_components = dashboard.render_cache.get_components(data, 0)
+    return html.Div(
+        className='dashboard',
+        children=[
             html.Div(
-                className='main-table',
+                className='nakamoto-banner',
                 children=[
-                    renders.render_simulation_df(data_element['simulation_df'])
+                    html.H2('Trading Bot Dashboard'),
+                    html.A(
+                        id='banner-link',
+                        children=['View on GitHub'],
+                        href='https://github.com/carlospinto93p/NakamotoExplorer'
+                    ),
+                    html.Img(src=app.get_asset_url('github_logo.png')),
                 ],
             ),
-            renders.render_simulation_line_graphs(data_element['simulation_df']),
-            renders.render_metrics(data_element['metrics'])],
-        [f'{idx} / {len(data)}'],
-        data_element['identifier']['price_list'],
-        data_element['identifier']['rule_set'],
-        [
             html.Div(
-                className='rule-sets',
+                className='container',
                 children=[
-                    renders.render_rule_set(data_element['rule_set_kwargs'])
-                ])]
+                    html.Div(
+                        id='content',
+                        className='content',
+                        children=[*renders.render_content(initial_components),
+                                  renders.render_leaderboard(dashboard.metrics_index)]
+                    ),
+                    dcc.Store(id='simulation-idx', data=0),
+                    dcc.Store(id='simulation-index', data={
+                        'identifiers': [list(get_identifier_key(data_element)) for data_element in data],
+                        'prefetch_neighbours': NAVIGATION_PREFETCH_NEIGHBOURS}),
+                    dcc.Store(id='simulation-requests'),
+                    dcc.Store(id='simulation-prefetch'),
+                    dcc.Store(id='simulation-payloads', data={}),
+                    dcc.Store(id='rendered-simulation-idx', data=0),
+                    html.Div(
+                        className='left-panel',
+                        children=[
+                            html.Div(
+                                className='page-settings',
+                                children=[
+                                    html.P(['Study Design']),
+                                    html.Div(
+                                        className='settings-row',
+                                        children=[
+                                            html.Label(['Mock index']),
+                                            html.Div(id='mock-index', children=[f'0 / {len(data)}'])
+                                        ]
+                                    ),
+                                    html.Div(
+                                        className='settings-row',
+                                        children=[
+                                            html.Label(['Price list']),
+                                            html.Div([
+                                                dcc.Input(
+                                                    id='price-list',
+                                                    type='number',
+                                                    value=1,
+                                                    min=1,
+                                                    max=input_data.get_max_price_list_idx(data),
+                                                )]
+                                            )]
+                                    ),
+                                    html.Div(
+                                        className='settings-row',
+                                        children=[
+                                            html.Label(['Rule Set']),
+                                            html.Div([
+                                                dcc.Input(
+                                                    id='rule-set',
+                                                    type='number',
+                                                    value=1,
+                                                    min=1,
+                                                    max=input_data.get_max_rule_set_idx(data),
+                                                )]
+                                            )]
+                                    ),
+                                    html.Div(
+                                        className='settings-row',
+                                        children=[
+                                            html.Div([
+                                                html.Button(
+                                                    id='prev-simulation',
+                                                    children=['Prev'],
+                                                ),
+                                                html.Button(
+                                                    id='next-simulation',
+                                                    children=['Next'],
+                                                )]
+                                            )]
+                                    ),
+                                ]
+                            ),
+                            html.Div(
+                                id='rule-sets',
+                                children=initial_components['rule_sets']
+                            )
+
+                        ]
+                    ),
+                    html.Div(
+                        className='clearing-div',
+                        children=[]
+                    )
+                ],
+            )
+        ]
     )
 
 
+def render_validation_layout() -> html.Div:
+    """ Render the components that the callbacks use, without data, to validate them. """
+    from dash.dash_table import DataTable
+
+    return html.Div([
+        DataTable(id='simulation-table'),
+        DataTable(id='leaderboard-table'),
+        dcc.Graph(id='simulation-graph'),
+        html.Div(id='metrics'),
+        *[dcc.Store(id=store_id) for store_id in ('simulation-idx', 'simulation-index', 'simulation-requests',
+                                                  'simulation-prefetch', 'simulation-payloads',
+                                                  'rendered-simulation-idx')],
+        html.Div(id='mock-index'),
+        dcc.Input(id='price-list'),
+        dcc.Input(id='rule-set'),
+        html.Button(id='prev-simulation'),
+        html.Button(id='next-simulation'),
+        html.Div(id='rule-sets')])
+
+
+def register_callbacks(app: Dash, dashboard: DashboardData, navigation_mode: str = NAVIGATION_MODE):
+    """ Register the callbacks of the app, which get the data from `dashboard`. """
+    if navigation_mode == 'client':
+        app.clientside_callback(
+            ClientsideFunction(namespace='navigation', function_name='navigate'),
+            Output('simulation-idx', 'data'),
+            Output('mock-index', 'children'),
+            Output('price-list', 'value'),
+            Output('rule-set', 'value'),
+            [Input('next-simulation', 'n_clicks'),
+             Input('prev-simulation', 'n_clicks'),
+             Input('price-list', 'value'),
+             Input('rule-set', 'value')],
+            [State('simulation-idx', 'data'),
+             State('simulation-index', 'data')],
+            prevent_initial_call=True)
+        app.clientside_callback(
+            ClientsideFunction(namespace='navigation', function_name='requestSimulations'),
+            Output('simulation-requests', 'data'),
+            [Input('simulation-idx', 'data')],
+            [State('simulation-payloads', 'data'),
+             State('simulation-index', 'data')])
+        app.clientside_callback(
+            ClientsideFunction(namespace='navigation', function_name='mergeSimulations'),
+            Output('simulation-payloads', 'data'),
+            [Input('simulation-prefetch', 'data')],
+            [State('simulation-payloads', 'data'),
+             State('simulation-idx', 'data'),
+             State('simulation-index', 'data')],
+            prevent_initial_call=True)
+        app.clientside_callback(
+            ClientsideFunction(namespace='navigation', function_name='renderSimulation'),
+            Output('metrics', 'children'),
+            Output('rule-sets', 'children'),
+            Output('simulation-graph', 'figure', allow_duplicate=True),
+            Output('simulation-table', 'data', allow_duplicate=True),
+            Output('simulation-table', 'tooltip_data', allow_duplicate=True),
+            Output('simulation-table', 'page_count', allow_duplicate=True),
+            Output('simulation-table', 'page_current', allow_duplicate=True),
+            Output('rendered-simulation-idx', 'data'),
+            [Input('simulation-idx', 'data'),
+             Input('simulation-payloads', 'data')],
+            [State('rendered-simulation-idx', 'data'),
+             State('simulation-table', 'sort_by'),
+             State('simulation-table', 'filter_query'),
+             State('simulation-table', 'page_current')],
+            prevent_initial_call=True)
+
+        @app.callback(
+            Output('simulation-prefetch', 'data'),
+            [Input('simulation-requests', 'data')],
+            prevent_initial_call=True)
+        @timed()
+        def prefetch_simulations(idxs: list):
+            """ Send the rendered components of the simulations requested by the client navigation. """
+            from nakamoto_explorer import renders
+
+            data, render_cache = dashboard.data, dashboard.render_cache
+            return {str(idx): renders.get_simulation_payload(render_cache.load(data, idx)) for idx in idxs}
+
+    else:
+        @app.callback(
+            Output('simulation-idx', 'data'),
+            Output('mock-index', 'children'),
+            Output('price-list', 'value'),
+            Output('rule-set', 'value'),
+            [Input('next-simulation', 'n_clicks'),
+             Input('prev-simulation', 'n_clicks'),
+             Input('price-list', 'value'),
+             Input('rule-set', 'value')],
+            [State('simulation-idx', 'data')],
+            prevent_initial_call=True)
+        @timed()
+        def update_interaction(next_n_clicks: int, prev_n_clicks: int,
+                               price_list_idx: int, rule_set_idx: int, current_idx: int):
+            """ Select the simulation shown. The panels are only updated if it changes. """
+            from nakamoto_explorer import input_data
+
+            if price_list_idx is None or rule_set_idx is None:
+                # A cleared input: nothing is selected until it has a value again.
+                raise PreventUpdate
+            data = dashboard.data
+            idx = input_data.get_data_idx(data, price_list_idx=price_list_idx,
+                                          rule_set_idx=rule_set_idx)
+            last_trigger = callback_context.triggered[0]['prop_id'].split('.')[0]
+            if last_trigger == 'next-simulation':
+                idx = data.get_neighbour_idx(idx, 1)
+            elif last_trigger == 'prev-simulation':
+                idx = data.get_neighbour_idx(idx, -1)
+            data_element = data[idx]
+            return (
+                idx if idx != current_idx else no_update,
+                [f'{idx} / {len(data)}'],
+                data_element['identifier']['price_list'],
+                data_element['identifier']['rule_set']
+            )
+
+        @app.callback(
+            Output('metrics', 'children'),
+            [Input('simulation-idx', 'data')],
+            prevent_initial_call=True)
+        @timed()
+        def update_metrics(idx: int):
+            return [dashboard.render_cache.get_components(dashboard.data, idx)['metrics']]
+
+        @app.callback(
+            Output('rule-sets', 'children'),
+            [Input('simulation-idx', 'data')],
+            prevent_initial_call=True)
+        @timed()
+        def update_rule_sets(idx: int):
+            return dashboard.render_cache.get_components(dashboard.data, idx)['rule_sets']
+
+    # The changes of the price list and rule set inputs show the simulation (see `navigate`
+    # and `update_interaction`).
+    app.clientside_callback(
+        ClientsideFunction(namespace='navigation', function_name='selectLeaderboardSimulation'),
+        Output('price-list', 'value', allow_duplicate=True),
+        Output('rule-set', 'value', allow_duplicate=True),
+        [Input('leaderboard-table', 'active_cell')],
+        [State('leaderboard-table', 'data')],
+        prevent_initial_call=True)
+
+    @app.callback(
+        Output('leaderboard-table', 'data'),
+        Output('leaderboard-table', 'page_count'),
+        [Input('leaderboard-table', 'page_current'),
+         Input('leaderboard-table', 'page_size'),
+         Input('leaderboard-table', 'sort_by'),
+         Input('leaderboard-table', 'filter_query')],
+        prevent_initial_call=True)
+    @timed()
+    def update_leaderboard_page(page_current: int, page_size: int, sort_by: list, filter_query: str):
+        """ Send the rows of the visible page of the leaderboard. """
+        from nakamoto_explorer import renders
+        from nakamoto_explorer.table_queries import get_page_positions
+
+        metrics_index = dashboard.metrics_index
+        try:
+            positions = metrics_index.get_positions(filter_query, sort_by)
+        except ValidationException:
+            return [], 1
+        page_positions, page_count = get_page_positions(positions, page_current, page_size)
+        return renders.render_leaderboard_page(metrics_index, page_positions), page_count
+
+    # With the client navigation, the simulation changes are drawn by `renderSimulation`.
+    simulation_idx_dependency = Input if navigation_mode == 'server' else State
+
+    @app.callback(
+        Output('simulation-graph', 'figure'),
+        [Input('simulation-graph', 'relayoutData')],
+        [simulation_idx_dependency('simulation-idx', 'data')],
+        prevent_initial_call=True)
+    @timed()
+    def update_graph(relayout_data: dict, idx: int):
+        """
+        Draw the line graphs of the selected simulation, or redraw the ones of a long simulation
+        with the detail of the visible time window.
+        """
+        from nakamoto_explorer import renders
+        from nakamoto_explorer.downsampling import get_relayout_x_range
+
+        data, render_cache = dashboard.data, dashboard.render_cache
+        if callback_context.triggered[0]['prop_id'].split('.')[0] == 'simulation-idx':
+            return renders.get_figure_patch(render_cache.get_components(data, idx)['figure'])
+        x_range_changed, x_range = get_relayout_x_range(relayout_data)
+        if not x_range_changed:
+            raise PreventUpdate
+        pyramid = render_cache.get_pyramid(data, idx)
+        if pyramid is None:
+            raise PreventUpdate
+        positions = pyramid.get_positions(*x_range) if x_range is not None else pyramid.get_positions()
+        return renders.get_figure_patch(
+            renders.render_simulation_figure(data[idx]['simulation_df'], positions, x_range))
+
+    @app.callback(
+        Output('simulation-table', 'data'),
+        Output('simulation-table', 'tooltip_data'),
+        Output('simulation-table', 'page_count'),
+        Output('simulation-table', 'page_current'),
+        [Input('simulation-table', 'page_current'),
+         Input('simulation-table', 'page_size'),
+         Input('simulation-table', 'sort_by'),
+         Input('simulation-table', 'filter_query')],
+        [simulation_idx_dependency('simulation-idx', 'data')],
+        prevent_initial_call=True)
+    @timed()
+    def update_table_page(page_current: int, page_size: int, sort_by: list, filter_query: str, idx: int):
+        """
+        Send the rows of the visible page of the simulation DataTable. When the simulation
+        changes, its first page is shown, keeping the sorting and filtering.
+        """
+        from nakamoto_explorer import renders
+        from nakamoto_explorer.table_queries import get_page_positions
+
+        data, render_cache = dashboard.data, dashboard.render_cache
+        simulation_changed = callback_context.triggered[0]['prop_id'].split('.')[0] == 'simulation-idx'
+        if simulation_changed:
+            page_current = 0
+            table = render_cache.get_components(data, idx)['table']
+            if not sort_by and not filter_query and page_size == table.page_size:
+                return table.data, table.tooltip_data, table.page_count, page_current
+        try:
+            positions = render_cache.get_table_positions(data, idx, sort_by, filter_query)
+        except ValidationException:
+            return [], [], 1, no_update
+        page_positions, page_count = get_page_positions(positions, page_current, page_size)
+        records, tooltip_data = renders.render_simulation_table_page(data[idx]['simulation_df'], page_positions)
+        return records, tooltip_data, page_count, page_current if simulation_changed else no_update
+
+
+app = create_app()
+server = app.server
+
 if __name__ == '__main__':
     app.run_server(debug=DEBUG_MODE)
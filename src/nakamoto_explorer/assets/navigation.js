@@ -0,0 +1,97 @@
+/*
+ * Client-side navigation between simulations (NAVIGATION_MODE = 'client').
+ * The simulation selection runs in the browser, and the rendered simulations around
+ * the selected one are prefetched into the `simulation-payloads` Store, so Prev / Next
+ * do not wait for the server. `selectLeaderboardSimulation` is used by both navigation modes.
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    navigation: {
+        // Same as `SimulationCatalog.get_idx`: the exact simulation, or the closest
+        // rule set inside the closest price list.
+        getIdx: function (identifiers, priceList, ruleSet) {
+            const closest = (values, value) => values.reduce(
+                (best, candidate) => Math.abs(candidate - value) < Math.abs(best - value) ? candidate : best);
+            const priceLists = [...new Set(identifiers.map(identifier => identifier[0]))];
+            const closestPriceList = closest(priceLists, priceList);
+            const ruleSets = identifiers.filter(identifier => identifier[0] === closestPriceList)
+                .map(identifier => identifier[1]);
+            const closestRuleSet = closest(ruleSets, ruleSet);
+            return identifiers.findIndex(
+                identifier => identifier[0] === closestPriceList && identifier[1] === closestRuleSet);
+        },
+
+        getWindow: function (idx, nSimulations, neighbours) {
+            const idxs = [idx];
+            for (let distance = 1; distance <= neighbours; distance++) {
+                idxs.push((idx + distance) % nSimulations, (idx - distance + nSimulations) % nSimulations);
+            }
+            return [...new Set(idxs)];
+        },
+
+        navigate: function (nextClicks, prevClicks, priceList, ruleSet, currentIdx, index) {
+            const noUpdate = window.dash_clientside.no_update;
+            const identifiers = index.identifiers;
+            if (priceList === null || priceList === undefined || ruleSet === null || ruleSet === undefined) {
+                return [noUpdate, noUpdate, noUpdate, noUpdate];
+            }
+            let idx = window.dash_clientside.navigation.getIdx(identifiers, priceList, ruleSet);
+            const trigger = window.dash_clientside.callback_context.triggered[0].prop_id.split('.')[0];
+            if (trigger === 'next-simulation') {
+                idx = (idx + 1) % identifiers.length;
+            } else if (trigger === 'prev-simulation') {
+                idx = (idx - 1 + identifiers.length) % identifiers.length;
+            }
+            return [
+                idx !== currentIdx ? idx : noUpdate,
+                [`${idx} / ${identifiers.length}`],
+                identifiers[idx][0],
+                identifiers[idx][1]
+            ];
+        },
+
+        // Select the simulation of the clicked leaderboard row, which `navigate` shows.
+        selectLeaderboardSimulation: function (activeCell, rows) {
+            const noUpdate = window.dash_clientside.no_update;
+            if (!activeCell || !rows || !rows[activeCell.row]) {
+                return [noUpdate, noUpdate];
+            }
+            const row = rows[activeCell.row];
+            return [row.price_list, row.rule_set];
+        },
+
+        // Simulations around the selected one that are not prefetched yet.
+        requestSimulations: function (idx, payloads, index) {
+            const missing = window.dash_clientside.navigation
+                .getWindow(idx, index.identifiers.length, index.prefetch_neighbours)
+                .filter(windowIdx => !(String(windowIdx) in (payloads || {})));
+            return missing.length ? missing : window.dash_clientside.no_update;
+        },
+
+        // Add the prefetched simulations, dropping the ones far from the selected one.
+        mergeSimulations: function (prefetched, payloads, idx, index) {
+            const kept = window.dash_clientside.navigation
+                .getWindow(idx, index.identifiers.length, 2 * index.prefetch_neighbours).map(String);
+            const merged = {};
+            for (const [key, payload] of Object.entries(Object.assign({}, payloads, prefetched))) {
+                if (kept.includes(key)) {
+                    merged[key] = payload;
+                }
+            }
+            return merged;
+        },
+
+        // Show the selected simulation once its payload is available. A sorted, filtered
+        // or paged table is requested to the server instead, resetting its page.
+        renderSimulation: function (idx, payloads, renderedIdx, sortBy, filterQuery, pageCurrent) {
+            const noUpdate = window.dash_clientside.no_update;
+            const payload = (payloads || {})[String(idx)];
+            if (payload === undefined || idx === renderedIdx) {
+                return Array(8).fill(noUpdate);
+            }
+            const table = (sortBy && sortBy.length) || filterQuery || pageCurrent
+                ? [noUpdate, noUpdate, noUpdate, 0]
+                : [payload.table.data, payload.table.tooltip_data, payload.table.page_count, noUpdate];
+            return [payload.metrics, payload.rule_sets, payload.figure, ...table, idx];
+        }
+    }
+});
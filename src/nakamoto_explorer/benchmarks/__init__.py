@@ -0,0 +1,18 @@
+"""
+Benchmarks of the hot paths of the dashboard: loading the data (parsing its files, and
+through their YAML index and Parquet sidecars), checking the rules, simulating the
+operations, backtesting and rendering the components.
+
+Every stage is measured (wall time, peak memory and, for the renders, the bytes sent to the
+browser) over synthetic datasets of every combination of the given sizes, and the results
+are written as JSON. The run fails if a stage misses its target wall time (as the
+`backtest_long` one, of a 1M prices backtest) or, if a previous report is given as baseline,
+if any measure got slower or bigger than the tolerance:
+    python -m nakamoto_explorer.benchmarks --rows 1000 100000 --rule-sets 10 --price-lists 2 \\
+        --output benchmark.json --baseline baseline.json
+
+The startup of the dashboard app (import time and first layout) is measured apart, in a new
+interpreter (see `startup`):
+    python -m nakamoto_explorer.benchmarks.startup
+"""
+from nakamoto_explorer.benchmarks.runner import compare_results, measure, run_benchmarks
@@ -0,0 +1,45 @@
+from argparse import ArgumentParser
+from json import dumps
+from logging import INFO, basicConfig, getLogger
+from sys import exit
+
+from nakamoto_explorer.benchmarks.runner import compare_results, load_report, run_benchmarks, save_report
+from nakamoto_explorer.settings import BENCHMARK_DATA_FOLDER, BENCHMARK_REPEATS, BENCHMARK_TOLERANCE
+
+logger = getLogger(__name__)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the load, simulate and render stages.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000],
+                        help='rows per simulation')
+    parser.add_argument('--rule-sets', type=int, nargs='+', default=[4], help='rule sets per price list')
+    parser.add_argument('--price-lists', type=int, nargs='+', default=[2])
+    parser.add_argument('--stages', nargs='+', help='stages to run (all by default)')
+    parser.add_argument('--repeats', type=int, default=BENCHMARK_REPEATS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-path', default=BENCHMARK_DATA_FOLDER,
+                        help='folder where the synthetic datasets are written')
+    parser.add_argument('--output', help='JSON file where the report is written (stdout by default)')
+    parser.add_argument('--baseline', help='JSON report to compare with')
+    parser.add_argument('--tolerance', type=float, default=BENCHMARK_TOLERANCE,
+                        help='relative increase of a measure allowed by the comparison')
+    arguments = parser.parse_args()
+    basicConfig(level=INFO)
+
+    report = run_benchmarks(arguments.rows, arguments.rule_sets, arguments.price_lists,
+                            stages=arguments.stages, repeats=arguments.repeats,
+                            data_path=arguments.data_path, seed=arguments.seed)
+    if arguments.baseline:
+        report['comparisons'], report['regressions'] = compare_results(
+            report, load_report(arguments.baseline), arguments.tolerance)
+        for regression in report['regressions']:
+            logger.warning(f'Regression in {regression["stage"]} {regression["params"]}: '
+                           f'{regression["measure"]} x{regression["ratio"]:.2f} '
+                           f'({regression["baseline"]} -> {regression["value"]})')
+    if arguments.output:
+        save_report(report, arguments.output)
+    else:
+        print(dumps(report, indent=2))
+    missed_targets = [result for result in report['results'] if result.get('target_met') is False]
+    exit(1 if report.get('regressions') or missed_targets else 0)
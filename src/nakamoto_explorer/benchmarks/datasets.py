@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from nakamoto_explorer.files import save_yaml
+from nakamoto_explorer.settings import SWEEP_WORKERS
+from nakamoto_explorer.sweep import sweep
+from nakamoto_explorer.synthetic import get_random_walk_prices
+
+
+def get_benchmark_grid(n_price_lists: int, n_rule_sets: int, n_rows: int, seed: int = 0) -> dict:
+    """
+    Get a sweep grid (see `sweep`) with `n_price_lists` random walks of `n_rows` prices, and
+    `n_rule_sets` margin rule sets whose thresholds make them act every few hundred rows.
+    """
+    return {
+        'price_lists': [{'price_list': get_random_walk_prices(n_rows, seed + price_list_idx),
+                         'adjust_inversion': True}
+                        for price_list_idx in range(n_price_lists)],
+        'rule_sets': [[
+            {'rule_name': 'MarginSale',
+             'margin_threshold': [round(0.01 * (1 + rule_set_idx), 4) for rule_set_idx in range(n_rule_sets)],
+             'hold_percent': 0.5},
+            {'rule_name': 'MarginPurchase', 'margin_threshold': 0.01, 'hold_percent': 0.5}]]
+    }
+
+
+def write_benchmark_data(output_path: str, n_price_lists: int, n_rule_sets: int, n_rows: int,
+                         seed: int = 0, n_workers: int = SWEEP_WORKERS) -> str:
+    """
+    Write a data folder for the benchmarks, with the `input_data.load_data` layout. The
+    simulations already written (for the same parameters) are reused.
+    :return: the data folder.
+    """
+    data_folder = f'{output_path}/data_{n_price_lists}x{n_rule_sets}x{n_rows}_seed{seed}'
+    Path(data_folder).mkdir(parents=True, exist_ok=True)
+    grid_path = f'{data_folder}.grid.yml'
+    save_yaml(get_benchmark_grid(n_price_lists, n_rule_sets, n_rows, seed), grid_path)
+    sweep(grid_path, data_folder, n_workers=n_workers)
+    return data_folder
@@ -0,0 +1,136 @@
+import gc
+import platform
+import tracemalloc
+from datetime import datetime
+from itertools import product
+from json import dump, load
+from logging import getLogger
+from statistics import median
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from nakamoto_explorer.benchmarks.datasets import write_benchmark_data
+from nakamoto_explorer.benchmarks.stages import STAGES, BenchmarkCase, Stage
+from nakamoto_explorer.exceptions import ValidationException
+from nakamoto_explorer.settings import BENCHMARK_DATA_FOLDER, BENCHMARK_REPEATS, BENCHMARK_TOLERANCE
+
+logger = getLogger(__name__)
+
+# Measures compared with the baseline. The time is the median of the repeats.
+COMPARED_MEASURES = ['wall_time', 'peak_memory_bytes', 'payload_bytes']
+
+
+def measure(function: Callable[[], Any], repeats: int = BENCHMARK_REPEATS,
+            get_payload_bytes: Optional[Callable[[Any], int]] = None) -> Dict[str, Any]:
+    """
+    Measure a function: its wall time in seconds (the median of `repeats` runs), the peak
+    of the memory it allocates, and the bytes of its payload if `get_payload_bytes` is given.
+    The memory is traced in an extra run, since tracing it slows down the function.
+    """
+    wall_times = []
+    for _ in range(repeats):
+        gc.collect()
+        start = perf_counter()
+        function()
+        wall_times.append(perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function()
+        peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'wall_time': median(wall_times),
+            'wall_times': wall_times,
+            'peak_memory_bytes': peak_memory_bytes,
+            'payload_bytes': get_payload_bytes(result) if get_payload_bytes is not None else None}
+
+
+def run_benchmarks(n_rows: Sequence[int], n_rule_sets: Sequence[int], n_price_lists: Sequence[int],
+                   stages: Optional[Sequence[str]] = None, repeats: int = BENCHMARK_REPEATS,
+                   data_path: str = BENCHMARK_DATA_FOLDER, seed: int = 0) -> dict:
+    """
+    Benchmark the stages for every combination of the dataset sizes. The datasets are
+    written once in `data_path` and reused by later runs.
+    :param stages: names of the stages (see `stages.STAGES`), or None to run all of them.
+    :return: a report with the environment and a result per stage and dataset size. The
+        results of the stages with a target wall time tell whether it was met.
+    """
+    selected_stages = get_stages(stages)
+    results = []
+    for price_lists, rule_sets, rows in product(n_price_lists, n_rule_sets, n_rows):
+        data_folder = write_benchmark_data(data_path, price_lists, rule_sets, rows, seed=seed)
+        case = BenchmarkCase(price_lists, rule_sets, rows, data_folder)
+        for stage in selected_stages:
+            result = measure(stage.prepare(case), repeats, stage.get_payload_bytes)
+            logger.info(f'{stage.name} {case.params}: {result["wall_time"]:.4f} s, '
+                        f'{result["peak_memory_bytes"] / 2 ** 20:.1f} MiB')
+            if stage.target_wall_time is not None:
+                result['target_wall_time'] = stage.target_wall_time
+                result['target_met'] = result['wall_time'] <= stage.target_wall_time
+                if not result['target_met']:
+                    logger.warning(f'{stage.name} {case.params} missed its target of '
+                                   f'{stage.target_wall_time} s')
+            results.append({'stage': stage.name, 'params': case.params, **result})
+    return {'environment': get_environment(), 'repeats': repeats, 'seed': seed, 'results': results}
+
+
+def compare_results(report: dict, baseline: dict, tolerance: float = BENCHMARK_TOLERANCE
+                    ) -> Tuple[List[dict], List[dict]]:
+    """
+    Compare a benchmark report with a baseline one. Only the results of the same stage and
+    dataset size are compared.
+    :param tolerance: relative increase of a measure allowed before it is a regression.
+    :return: a tuple (comparisons, regressions), with the ratio of every measure to the baseline.
+    """
+    baseline_results = {get_result_key(result): result for result in baseline['results']}
+    comparisons, regressions = [], []
+    for result in report['results']:
+        baseline_result = baseline_results.get(get_result_key(result))
+        if baseline_result is None:
+            continue
+        for measure_name in COMPARED_MEASURES:
+            value, baseline_value = result.get(measure_name), baseline_result.get(measure_name)
+            if value is None or not baseline_value:
+                continue
+            comparison = {'stage': result['stage'], 'params': result['params'], 'measure': measure_name,
+                          'value': value, 'baseline': baseline_value, 'ratio': value / baseline_value}
+            comparisons.append(comparison)
+            if comparison['ratio'] > 1 + tolerance:
+                regressions.append(comparison)
+    return comparisons, regressions
+
+
+def get_environment() -> Dict[str, str]:
+    """ Get the versions that the benchmark results depend on. """
+    import dash
+    import numpy
+    import pandas
+    import plotly
+    return {'datetime': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'processor': platform.processor(), 'dash': dash.__version__,
+            'numpy': numpy.__version__, 'pandas': pandas.__version__, 'plotly': plotly.__version__}
+
+
+def get_result_key(result: dict) -> Tuple[str, Tuple[Tuple[str, int], ...]]:
+    return result['stage'], tuple(sorted(result['params'].items()))
+
+
+def get_stages(stage_names: Optional[Sequence[str]] = None) -> List[Stage]:
+    if stage_names is None:
+        return list(STAGES)
+    stages = {stage.name: stage for stage in STAGES}
+    unknown_names = [name for name in stage_names if name not in stages]
+    if unknown_names:
+        raise ValidationException(f'Unknown benchmark stages {unknown_names} (available: {list(stages)})')
+    return [stages[name] for name in stage_names]
+
+
+def load_report(report_path: str) -> dict:
+    with open(report_path) as file:
+        return load(file)
+
+
+def save_report(report: dict, report_path: str):
+    with open(report_path, 'w') as file:
+        dump(report, file, indent=2)
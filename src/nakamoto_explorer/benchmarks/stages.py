@@ -0,0 +1,135 @@
+from dataclasses import dataclass, field
+from json import dumps
+from typing import Any, Callable, Dict, List, Optional
+
+from plotly.utils import PlotlyJSONEncoder
+
+from nakamoto_explorer import renders
+from nakamoto_explorer.input_data import load_data
+from nakamoto_explorer.nakamoto.backtesting import backtest
+from nakamoto_explorer.nakamoto.rules import MarginPurchase, MarginSale
+from nakamoto_explorer.nakamoto.simulations import (simulate_purchase, simulate_purchases, simulate_sale,
+                                                    simulate_sales)
+from nakamoto_explorer.render_cache import get_pyramid
+from nakamoto_explorer.synthetic import get_random_walk_prices
+
+# Rows simulated one by one in the `simulate_row` stage, which is too slow for whole simulations.
+SIMULATE_ROW_SAMPLE = 1000
+# Prices of the `backtest_long` stage, whose rules act about 2400 times, and the wall time
+# in seconds it must take.
+LONG_BACKTEST_ROWS = 1_000_000
+LONG_BACKTEST_TARGET = 1.
+
+
+@dataclass
+class BenchmarkCase:
+    """
+    Dataset size of a benchmark run.
+    :param data_folder: data folder with `n_price_lists` x `n_rule_sets` simulations
+        of `n_rows` prices (see `datasets.write_benchmark_data`).
+    """
+    n_price_lists: int
+    n_rule_sets: int
+    n_rows: int
+    data_folder: str
+    _data: Optional[List[dict]] = field(default=None, repr=False)
+
+    @property
+    def params(self) -> Dict[str, int]:
+        return {'n_price_lists': self.n_price_lists, 'n_rule_sets': self.n_rule_sets, 'n_rows': self.n_rows}
+
+    @property
+    def data(self) -> List[dict]:
+        """ Loaded data, which the stages that do not benchmark the loading start from. """
+        if self._data is None:
+            self._data = load_data(self.data_folder, raise_exception=True)
+        return self._data
+
+    @property
+    def data_element(self) -> dict:
+        """ Simulation with the most actions, the worst case of most stages. """
+        return max(self.data, key=lambda data_element: data_element['simulation_df']['action'].notna().sum())
+
+
+@dataclass
+class Stage:
+    """
+    Benchmarked stage.
+    :param prepare: function that gets the function timed for a case.
+    :param get_payload_bytes: function that gets the bytes sent to the browser from the
+        result of the timed function, for the stages that render components.
+    :param target_wall_time: wall time in seconds that the stage must not exceed, if any.
+    """
+    name: str
+    prepare: Callable[[BenchmarkCase], Callable[[], Any]]
+    get_payload_bytes: Optional[Callable[[Any], int]] = None
+    target_wall_time: Optional[float] = None
+
+
+def get_json_bytes(components: Any) -> int:
+    """ Get the size of some components serialized as Dash sends them. """
+    return len(dumps(components, cls=PlotlyJSONEncoder).encode())
+
+
+def prepare_load(case: BenchmarkCase) -> Callable[[], Any]:
+    # Without the YAML index and the Parquet sidecars, so every repeat (and every run)
+    # parses the .yml and .csv files.
+    return lambda: load_data(case.data_folder, raise_exception=True, use_yaml_index=False,
+                             use_parquet_cache=False)
+
+
+def prepare_load_cached(case: BenchmarkCase) -> Callable[[], Any]:
+    # The YAML index and the Parquet sidecars are written first, so every repeat loads them.
+    load_data(case.data_folder, raise_exception=True)
+    return lambda: load_data(case.data_folder, raise_exception=True)
+
+
+def prepare_rule_check(case: BenchmarkCase) -> Callable[[], Any]:
+    df = case.data_element['simulation_df']
+    rules = [rule for rules in case.data_element['rule_set_kwargs'].values() for rule in rules]
+    return lambda: [rule.check(df) for rule in rules]
+
+
+def prepare_simulate(case: BenchmarkCase) -> Callable[[], Any]:
+    df = case.data_element['simulation_df']
+    return lambda: (simulate_sales(df, df['base_free'] / 2), simulate_purchases(df, df['base_free'] / 2))
+
+
+def prepare_simulate_row(case: BenchmarkCase) -> Callable[[], Any]:
+    rows = [row for _, row in case.data_element['simulation_df'].head(SIMULATE_ROW_SAMPLE).iterrows()]
+    return lambda: [(simulate_sale(row, row['base_free'] / 2, raise_exception=False),
+                     simulate_purchase(row, row['base_free'] / 2, raise_exception=False))
+                    for row in rows]
+
+
+def prepare_backtest(case: BenchmarkCase) -> Callable[[], Any]:
+    data_element = case.data_element
+    historial_kwargs = data_element['historial_kwargs']
+    return lambda: backtest(historial_kwargs['price_list'], data_element['rule_set_kwargs'],
+                            adjust_inversion=historial_kwargs.get('adjust_inversion', True))
+
+
+def prepare_backtest_long(case: BenchmarkCase) -> Callable[[], Any]:
+    # Independent of the case: a single backtest of a long price list, so the time per action
+    # is measured rather than the time per row.
+    price_list = get_random_walk_prices(LONG_BACKTEST_ROWS, volatility=0.001)
+    rule_set = {'rule_set': {MarginSale(0.02, 0.5), MarginPurchase(0.02, 0.5)}, 'stop_rules': set()}
+    return lambda: backtest(price_list, rule_set)
+
+
+def prepare_render(case: BenchmarkCase) -> Callable[[], Any]:
+    data_element = case.data_element
+    # As a render cache miss of the app, including the downsampling of long simulations.
+    return lambda: renders.render_simulation(data_element, get_pyramid(data_element['simulation_df']))
+
+
+STAGES = [
+    Stage('load', prepare_load),
+    Stage('load_cached', prepare_load_cached),
+    Stage('rule_check', prepare_rule_check),
+    Stage('simulate', prepare_simulate),
+    Stage('simulate_row', prepare_simulate_row),
+    Stage('backtest', prepare_backtest),
+    Stage('backtest_long', prepare_backtest_long, target_wall_time=LONG_BACKTEST_TARGET),
+    Stage('render', prepare_render, get_payload_bytes=get_json_bytes),
+]
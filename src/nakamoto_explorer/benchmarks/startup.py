@@ -0,0 +1,74 @@
+"""
+Startup report of the dashboard app: how long a new worker takes to import it (when it can
+already serve requests), and to render its first layout (when the data is loaded), with the
+modules that take the most time to import. It is measured in a new interpreter:
+    python -m nakamoto_explorer.benchmarks.startup [--top 20] [--output startup.json]
+"""
+import re
+import sys
+from argparse import ArgumentParser
+from json import dumps, loads
+from subprocess import run
+from typing import Dict, List
+
+from nakamoto_explorer.benchmarks.runner import get_environment, save_report
+from nakamoto_explorer.exceptions import NakamotoExplorerException
+
+# Run by the measured interpreter: it prints the times as its last stdout line. The warm-up
+# is disabled, so the imports of its thread are not mixed with the ones of the app, and the
+# data is loaded by the first layout request.
+STARTUP_SCRIPT = '''
+from json import dumps
+from time import perf_counter
+import nakamoto_explorer.settings as settings
+settings.APP_WARM_UP = False
+start = perf_counter()
+import nakamoto_explorer.app as app_module
+import_seconds = perf_counter() - start
+client = app_module.server.test_client()
+layout_status = client.get('/_dash-layout').status_code
+print(dumps({'import_seconds': import_seconds, 'first_layout_seconds': perf_counter() - start,
+             'first_layout_status': layout_status}))
+'''
+IMPORT_TIME_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def get_startup_report(top: int = 20) -> dict:
+    """
+    Measure the startup of the dashboard app in a new interpreter.
+    :param top: number of modules with the highest cumulative import time reported.
+    :return: a report with the environment, the 'import_seconds' and 'first_layout_seconds'
+        since the interpreter started importing the app, and the slowest 'imports'.
+    """
+    process = run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise NakamotoExplorerException(f'The app startup failed: {process.stderr[-2000:]}')
+    report = {'environment': get_environment(), **loads(process.stdout.strip().splitlines()[-1])}
+    report['imports'] = sorted(parse_import_times(process.stderr),
+                               key=lambda module: module['cumulative_seconds'], reverse=True)[:top]
+    return report
+
+
+def parse_import_times(importtime_output: str) -> List[Dict]:
+    """ Parse the `-X importtime` output into a list of {'module', 'depth', 'self_seconds', 'cumulative_seconds'}. """
+    modules = []
+    for line in importtime_output.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match is not None:
+            self_us, cumulative_us, indent, module = match.groups()
+            modules.append({'module': module, 'depth': (len(indent) - 1) // 2,
+                            'self_seconds': int(self_us) / 1e6, 'cumulative_seconds': int(cumulative_us) / 1e6})
+    return modules
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Measure the startup of the dashboard app.')
+    parser.add_argument('--top', type=int, default=20, help='number of slowest imports reported')
+    parser.add_argument('--output', help='JSON file where the report is written (stdout by default)')
+    arguments = parser.parse_args()
+
+    startup_report = get_startup_report(arguments.top)
+    if arguments.output:
+        save_report(startup_report, arguments.output)
+    else:
+        print(dumps(startup_report, indent=2))
@@ -0,0 +1,113 @@
+from collections import OrderedDict
+from threading import RLock
+from typing import Any, Callable, Hashable, List, Optional
+
+
+class LRUCache:
+    """
+    Thread-safe Least Recently Used cache with a bounded size.
+    Each stored value has a size given by `get_size` (1 by default, so `max_size` is
+    then a number of elements). Once the total size exceeds `max_size`, the least
+    recently used elements are evicted until it fits again.
+    :param max_size: maximum total size of the stored values.
+    :param get_size: function that returns the size of a value (e.g. its bytes).
+    :param on_evict: function called with (key, value) for every evicted element.
+    """
+
+    def __init__(self, max_size: int,
+                 get_size: Optional[Callable[[Any], int]] = None,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        if max_size <= 0:
+            raise ValueError(f'Non-positive {max_size = }')
+        self.max_size = max_size
+        self.get_size = get_size or (lambda value: 1)
+        self.on_evict = on_evict
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+        self._elements: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._sizes = {}
+        self._lock = RLock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._elements
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._elements)
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(elements={len(self)}, size={self.current_size}, '
+                f'max_size={self.max_size}, hits={self.hits}, misses={self.misses})')
+
+    def clear(self):
+        with self._lock:
+            self._elements.clear()
+            self._sizes.clear()
+            self.current_size = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._elements:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._elements.move_to_end(key)
+            return self._elements[key]
+
+    def get_or_load(self, key: Hashable, load_function: Callable[[], Any]) -> Any:
+        """
+        Get the value of `key`, loading and storing it with `load_function` if it is
+        not cached yet. The load is done outside the lock, so slow loads of different
+        keys do not block each other.
+        """
+        with self._lock:
+            if key in self._elements:
+                self.hits += 1
+                self._elements.move_to_end(key)
+                return self._elements[key]
+            self.misses += 1
+        value = load_function()
+        self.put(key, value)
+        return value
+
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.
+
+    def keys(self) -> List[Hashable]:
+        """ Get a snapshot of the cached keys, from the least to the most recently used. """
+        with self._lock:
+            return list(self._elements.keys())
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """ Get the value of `key` without counting a hit or miss, nor marking it as recently used. """
+        with self._lock:
+            return self._elements.get(key, default)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._elements:
+                return default
+            self.current_size -= self._sizes.pop(key)
+            return self._elements.pop(key)
+
+    def put(self, key: Hashable, value: Any):
+        size = self.get_size(value)
+        with self._lock:
+            if key in self._elements:
+                self.current_size -= self._sizes.pop(key)
+                del self._elements[key]
+            self._elements[key] = value
+            self._sizes[key] = size
+            self.current_size += size
+            self._evict()
+
+    def _evict(self):
+        # The newest element is always kept, even if it is bigger than `max_size`.
+        while self.current_size > self.max_size and len(self._elements) > 1:
+            key, value = self._elements.popitem(last=False)
+            self.current_size -= self._sizes.pop(key)
+            if self.on_evict is not None:
+                self.on_evict(key, value)
@@ -0,0 +1,86 @@
+from bisect import bisect_left
+from collections import abc
+from itertools import count
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+from nakamoto_explorer.exceptions import ValidationException
+
+
+class SimulationCatalog(abc.Sequence):
+    """
+    Sequence of data elements sorted by their (price_list, rule_set) identifier, with the
+    indexes needed to locate any of them in constant time.
+    The data elements can be the dictionaries returned by `input_data.load_data` or any
+    other mapping with the same keys (e.g. `input_data.LazySimulation`).
+    The price lists do not need to have all the same rule sets (sparse grids).
+    :param data_elements: data elements to index. They are sorted if they are not.
+    """
+    version_counter = count(1)
+
+    def __init__(self, data_elements: Sequence[Mapping]):
+        self.data_elements: List[Mapping] = sorted(data_elements, key=get_identifier_key)
+        # Identifies the loaded data, so objects derived from it can be cached.
+        self.version: int = next(self.version_counter)
+
+        self.positions: Dict[Tuple[int, int], int] = {}
+        self.rule_sets: Dict[int, List[int]] = {}
+        for position, data_element in enumerate(self.data_elements):
+            key = get_identifier_key(data_element)
+            if key in self.positions:
+                raise ValidationException(f'Duplicated simulation identifier {key}', data_element)
+            self.positions[key] = position
+            self.rule_sets.setdefault(key[0], []).append(key[1])
+        self.price_lists: List[int] = sorted(self.rule_sets)
+        self.max_price_list_idx = self.price_lists[-1] if self.price_lists else 0
+        self.max_rule_set_idx = max((rule_sets[-1] for rule_sets in self.rule_sets.values()),
+                                    default=0)
+
+    def __getitem__(self, idx):
+        return self.data_elements[idx]
+
+    def __len__(self) -> int:
+        return len(self.data_elements)
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(simulations={len(self)}, '
+                f'price_lists={len(self.price_lists)}, version={self.version})')
+
+    def get_idx(self, price_list_idx: int, rule_set_idx: int) -> int:
+        """
+        Get the position of the (price_list_idx, rule_set_idx) simulation. If it does not
+        exist, the position of the closest one is returned: the closest rule set inside
+        the closest price list.
+        """
+        if not self.data_elements:
+            raise ValidationException('The catalog is empty')
+        position = self.positions.get((price_list_idx, rule_set_idx))
+        if position is not None:
+            return position
+        price_list_idx = get_closest_value(self.price_lists, price_list_idx)
+        rule_set_idx = get_closest_value(self.rule_sets[price_list_idx], rule_set_idx)
+        return self.positions[(price_list_idx, rule_set_idx)]
+
+    def get_neighbour_idx(self, idx: int, step: int = 1) -> int:
+        """ Get the position `step` places after `idx` (before, if negative), wrapping around. """
+        return (idx + step) % len(self.data_elements)
+
+    def get_rule_set_bounds(self, price_list_idx: int) -> Tuple[int, int]:
+        """ Get the minimum and maximum rule set of a price list. """
+        rule_sets = self.rule_sets[price_list_idx]
+        return rule_sets[0], rule_sets[-1]
+
+
+def get_closest_value(sorted_values: List[int], value: int) -> int:
+    """ Get the closest value to `value` of a sorted list. Ties are resolved to the lower one. """
+    position = bisect_left(sorted_values, value)
+    if position == 0:
+        return sorted_values[0]
+    if position == len(sorted_values):
+        return sorted_values[-1]
+    lower, upper = sorted_values[position - 1], sorted_values[position]
+    return lower if value - lower <= upper - value else upper
+
+
+def get_identifier_key(data_element: Mapping) -> Tuple[int, int]:
+    """ Get the (price_list, rule_set) key of a data element, used to sort and index the data. """
+    return data_element['identifier']['price_list'], data_element['identifier']['rule_set']
@@ -0,0 +1,268 @@
+"""
+Partitioned columnar simulation store, to load the simulations without opening thousands
+of small files (which is slow on network storage, where every open is a round trip).
+
+The rows of all the simulation DataFrames are saved in a Parquet dataset partitioned by
+price list (`simulations/price_list=N/part-M.parquet`), with a `rule_set` column and a row
+group per simulation. The rest of the data is saved in two tables: `catalog.parquet`, with
+the metrics, rule set and column types of every simulation, and `price_lists.parquet`, with
+the historial kwargs of every price list. Loading a simulation only reads its row groups:
+the price list selects the partition folder and the rule set is pushed down to the row
+group statistics.
+
+The store is migrated by the first process that loads it, and migrated again when the
+files of the data folder change. Migrate a data folder (the `prices_N/rule_set_M` layout)
+to a store beforehand with:
+    python -m nakamoto_explorer.dataset_store [--input-path DATA_FOLDER] [--store-folder FOLDER]
+"""
+from argparse import ArgumentParser
+from functools import partial
+from json import dumps, loads
+from logging import INFO, basicConfig, getLogger
+from os import getpid
+from pathlib import Path
+from shutil import rmtree
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pandas import DataFrame
+
+from nakamoto_explorer.cache import LRUCache
+from nakamoto_explorer.exceptions import ValidationException
+from nakamoto_explorer.files import (ARROW_INDEX_COLUMN, build_store_if_outdated, get_folder_signature,
+                                     get_folders_inside_folder, is_json_compatible, replace_folder,
+                                     save_store_source, store_lock)
+from nakamoto_explorer.input_data import (LazySimulation, load_rule_set_list, rule_set_to_rule_set_list,
+                                          try_load_price_list_yaml, try_load_simulation)
+from nakamoto_explorer.settings import DATA_FOLDER, DATASET_STORE_FOLDER, SIMULATION_CACHE_SIZE
+
+logger = getLogger(__name__)
+
+SIMULATIONS_FOLDER = 'simulations'
+CATALOG_FILE = 'catalog.parquet'
+PRICE_LISTS_FILE = 'price_lists.parquet'
+RULE_SET_COLUMN = 'rule_set'
+
+
+class PartitionWriter:
+    """
+    Writer of the simulations of a price list in its partition folder. The simulations are
+    written in the same file while their columns are stored with the same types, and in
+    a new one otherwise.
+    :param partition_folder: folder of the price list partition.
+    """
+
+    def __init__(self, partition_folder: str):
+        self.partition_folder = partition_folder
+        self.n_files = 0
+        self._writer: Optional[pq.ParquetWriter] = None
+        Path(partition_folder).mkdir(parents=True, exist_ok=True)
+
+    def write(self, table: pa.Table):
+        if self._writer is not None and not self._writer.schema.equals(table.schema):
+            self.close()
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(f'{self.partition_folder}/part-{self.n_files}.parquet', table.schema)
+            self.n_files += 1
+        # Written as a single row group, so its statistics select the whole simulation.
+        self._writer.write_table(table, row_group_size=max(len(table), 1))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def build_dataset_store(data: Iterable[Mapping], store_folder: str = DATASET_STORE_FOLDER,
+                        source: Optional[dict] = None) -> int:
+    """
+    Build a store from data elements, keeping only one of them in memory at a time. The
+    store is written in a temporary folder that replaces `store_folder` once it is complete,
+    and that is removed if the build fails.
+    :param data: data elements, as the ones returned by `input_data.load_data` or
+        `iterate_data`.
+    :param store_folder: output folder.
+    :param source: signature of the data folder (see `files.get_folder_signature`).
+    :return: the number of simulations written.
+    """
+    temporary_folder = f'{store_folder}.{getpid()}.tmp'
+    Path(temporary_folder).mkdir(parents=True)
+    try:
+        n_simulations = write_dataset_store(data, temporary_folder)
+        save_store_source(temporary_folder, source)
+    except BaseException:
+        rmtree(temporary_folder, ignore_errors=True)
+        raise
+    replace_folder(temporary_folder, store_folder)
+    return n_simulations
+
+
+def write_dataset_store(data: Iterable[Mapping], store_folder: str) -> int:
+    """ Write the tables of a store in an empty folder (see `build_dataset_store`). """
+    writers: Dict[int, PartitionWriter] = {}
+    catalog, historial_kwargs = [], {}
+    try:
+        for data_element in data:
+            identifier = data_element['identifier']
+            simulation_df = data_element['simulation_df']
+            writer = writers.get(identifier['price_list'])
+            if writer is None:
+                writer = writers[identifier['price_list']] = PartitionWriter(
+                    f"{store_folder}/{SIMULATIONS_FOLDER}/price_list={identifier['price_list']}")
+            writer.write(get_simulation_table(simulation_df, identifier['rule_set']))
+            historial_kwargs.setdefault(identifier['price_list'], to_json(data_element['historial_kwargs']))
+            catalog.append({
+                'price_list': identifier['price_list'],
+                'rule_set': identifier['rule_set'],
+                'n_rows': len(simulation_df),
+                'metrics': to_json(data_element['metrics']),
+                'rule_set_list': to_json(rule_set_to_rule_set_list(data_element['rule_set_kwargs'])),
+                'dtypes': dumps({str(name): str(dtype) for name, dtype in simulation_df.dtypes.items()}),
+                'index_dtype': str(simulation_df.index.dtype),
+                'columns_name': simulation_df.columns.name})
+            if len(catalog) % 1000 == 0:
+                logger.info(f'{len(catalog)} simulations written')
+    finally:
+        for writer in writers.values():
+            writer.close()
+    pq.write_table(records_to_table([{'price_list': price_list_idx, 'historial_kwargs': kwargs}
+                                     for price_list_idx, kwargs in historial_kwargs.items()]),
+                   f'{store_folder}/{PRICE_LISTS_FILE}')
+    # Written last: the store is complete once it exists.
+    pq.write_table(records_to_table(catalog), f'{store_folder}/{CATALOG_FILE}')
+    return len(catalog)
+
+
+def records_to_table(records: List[dict]) -> pa.Table:
+    """ Convert a list of records with the same keys to a table. """
+    names = list(records[0]) if records else []
+    return pa.Table.from_pydict({name: [record[name] for record in records] for name in names})
+
+
+def table_to_records(table: pa.Table) -> List[dict]:
+    """ Convert a table to a list of records, one per row. """
+    columns = table.to_pydict()
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def get_simulation_table(simulation_df: DataFrame, rule_set_idx: int) -> pa.Table:
+    """
+    Convert a simulation DataFrame to the table written in its partition. The numeric
+    columns are stored as floats, so the simulations whose columns are integers in some
+    of them and floats in others share the same file. Their types are restored on load.
+    """
+    columns = {RULE_SET_COLUMN: pa.array(np.full(len(simulation_df), rule_set_idx, dtype=np.int32)),
+               ARROW_INDEX_COLUMN: pa.array(simulation_df.index)}
+    for name, column in simulation_df.items():
+        if column.dtype.kind in 'iuf':
+            columns[str(name)] = pa.array(column.to_numpy(dtype=np.float64), from_pandas=True)
+        elif column.dtype.kind == 'b':
+            columns[str(name)] = pa.array(column, type=pa.bool_(), from_pandas=True)
+        elif column.dtype.kind == 'O':
+            columns[str(name)] = pa.array(column, type=pa.string(), from_pandas=True)
+        else:
+            raise ValidationException(f'Column {name} of type {column.dtype} can not be stored')
+    return pa.Table.from_pydict(columns)
+
+
+def load_dataset_store(store_folder: str = DATASET_STORE_FOLDER, input_path: str = DATA_FOLDER,
+                       cache_size: int = SIMULATION_CACHE_SIZE) -> List[LazySimulation]:
+    """
+    Load a store, migrating `input_path` to it if it does not exist or the data changed
+    (see `files.build_store_if_outdated`).
+    :param store_folder: folder of the store.
+    :param input_path: data folder migrated to the store if it does not exist.
+    :param cache_size: maximum number of simulations kept loaded.
+    :return: a list of LazySimulation, sorted as the list returned by `input_data.load_data`.
+    """
+    build_store_if_outdated(store_folder, input_path, CATALOG_FILE,
+                            lambda source: migrate(input_path, store_folder, source))
+    dataset = ds.dataset(f'{store_folder}/{SIMULATIONS_FOLDER}', format='parquet', partitioning='hive')
+    historial_kwargs = {row['price_list']: loads(row['historial_kwargs'])
+                        for row in table_to_records(pq.read_table(f'{store_folder}/{PRICE_LISTS_FILE}'))}
+    cache = LRUCache(cache_size)
+    catalog = sorted(table_to_records(pq.read_table(f'{store_folder}/{CATALOG_FILE}')),
+                     key=lambda entry: (entry['price_list'], entry['rule_set']))
+    return [LazySimulation(
+        identifier={'price_list': entry['price_list'], 'rule_set': entry['rule_set']},
+        load_function=partial(load_dataset_simulation, dataset, entry, historial_kwargs[entry['price_list']]),
+        cache=cache,
+        metrics_function=partial(loads, entry['metrics'])) for entry in catalog]
+
+
+def load_dataset_simulation(dataset: ds.Dataset, entry: dict, historial_kwargs: dict) -> dict:
+    """ Load a data element of the store, reading only the rows of its simulation. """
+    return {'simulation_df': load_simulation_df(dataset, entry),
+            'metrics': loads(entry['metrics']),
+            'rule_set_kwargs': load_rule_set_list(loads(entry['rule_set_list'])),
+            'historial_kwargs': historial_kwargs,
+            'identifier': {'price_list': entry['price_list'], 'rule_set': entry['rule_set']}}
+
+
+def load_simulation_df(dataset: ds.Dataset, entry: dict) -> DataFrame:
+    """ Read the simulation DataFrame of a catalog entry, restoring its column types. """
+    dtypes = loads(entry['dtypes'])
+    table = dataset.to_table(
+        columns=[ARROW_INDEX_COLUMN, *dtypes],
+        filter=(ds.field('price_list') == entry['price_list']) & (ds.field(RULE_SET_COLUMN) == entry['rule_set']))
+    if table.num_rows != entry['n_rows']:
+        raise ValidationException(f"The store has {table.num_rows} rows of the simulation "
+                                  f"{entry['price_list']}-{entry['rule_set']} instead of {entry['n_rows']}")
+    df = table.to_pandas().set_index(ARROW_INDEX_COLUMN).astype(dtypes)
+    df.index = df.index.astype(entry['index_dtype'])
+    df.index.name = None
+    df.columns.name = entry['columns_name']
+    return df
+
+
+def iterate_data(input_path: str = DATA_FOLDER) -> Iterator[dict]:
+    """
+    Load the simulations of a data folder one by one. As in `input_data.load_data`, the
+    folders that can not be loaded are logged and skipped.
+    """
+    for price_list_folder in get_folders_inside_folder(input_path):
+        prices_folder = f'{input_path}/{price_list_folder}'
+        price_list_yaml, message = try_load_price_list_yaml(prices_folder)
+        if message is not None:
+            logger.warning(message)
+            continue
+        historial_kwargs, rule_sets_yaml = price_list_yaml
+        for rule_set_folder, rule_set_yaml in rule_sets_yaml.items():
+            data_element, message = try_load_simulation((prices_folder, rule_set_folder, historial_kwargs,
+                                                         *rule_set_yaml))
+            if message is not None:
+                logger.warning(message)
+            else:
+                yield data_element
+
+
+def migrate(input_path: str = DATA_FOLDER, store_folder: str = DATASET_STORE_FOLDER,
+            source: Optional[dict] = None) -> int:
+    """
+    Migrate a data folder with the `prices_N/rule_set_M` layout to a store, loading its
+    simulations one by one (see `iterate_data`).
+    :param source: signature of the data folder (see `files.get_folder_signature`).
+    :return: the number of simulations migrated.
+    """
+    n_simulations = build_dataset_store(iterate_data(input_path), store_folder, source)
+    logger.info(f'{n_simulations} simulations migrated from {input_path} to {store_folder}')
+    return n_simulations
+
+
+def to_json(value) -> str:
+    if not is_json_compatible(value):
+        raise ValidationException(f'Value that can not be stored as JSON: {value}')
+    return dumps(value)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Migrate a data folder to the partitioned dataset store.')
+    parser.add_argument('--input-path', default=DATA_FOLDER)
+    parser.add_argument('--store-folder', default=DATASET_STORE_FOLDER)
+    arguments = parser.parse_args()
+    basicConfig(level=INFO)
+    with store_lock(arguments.store_folder):
+        migrate(arguments.input_path, arguments.store_folder, get_folder_signature(arguments.input_path))
@@ -0,0 +1,113 @@
+"""
+Level of detail for long simulations: the line graphs only get the rows needed to draw
+the visible time window at screen resolution, so their payload and render time are
+bounded regardless of the simulation length.
+
+The rows are selected with min/max bucketing, which keeps the extremes of every bucket
+(unlike averaging, price spikes are never hidden). The rows with actions are always kept.
+"""
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from pandas import DataFrame, Timestamp
+
+from nakamoto_explorer.settings import DOWNSAMPLING_MAX_POINTS
+
+DOWNSAMPLED_COLUMNS = ['base-quote', 'quote_value']
+DISCARDED_ACTIONS = ['init', 'end', 'sale', 'purchase']
+
+
+class DownsamplingPyramid:
+    """
+    Precomputed downsampled versions (levels) of a simulation DataFrame, from the coarsest
+    one, with about `max_points` rows, doubling the resolution until the complete data.
+    :param df: simulation DataFrame, with a sorted index.
+    :param max_points: maximum number of rows returned for any time window (apart from
+        the rows with actions, which are always returned).
+    :param columns: columns whose extremes are kept.
+    """
+
+    def __init__(self, df: DataFrame, max_points: int = DOWNSAMPLING_MAX_POINTS,
+                 columns: Sequence[str] = DOWNSAMPLED_COLUMNS):
+        self.index: np.ndarray = df.index.to_numpy()
+        self.max_points = max_points
+        values = [df[column].to_numpy(dtype=float) for column in columns]
+        keep = np.flatnonzero(df['action'].notna().to_numpy() & ~df['action'].isin(DISCARDED_ACTIONS).to_numpy())
+        keep = np.union1d(keep, [0, len(df) - 1]) if len(df) else keep
+
+        # Every level keeps the min and max of each column in its buckets.
+        self.levels: List[np.ndarray] = []
+        n_points = max_points
+        while n_points < len(df):
+            n_buckets = max(1, n_points // (2 * len(values)))
+            positions = np.concatenate([minmax_positions(column_values, n_buckets)
+                                        for column_values in values])
+            self.levels.append(np.union1d(positions, keep))
+            n_points *= 2
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(rows={len(self)}, levels={[len(level) for level in self.levels]})'
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes + sum(level.nbytes for level in self.levels)
+
+    def get_positions(self, start: Optional[Union[str, np.datetime64]] = None,
+                      end: Optional[Union[str, np.datetime64]] = None) -> np.ndarray:
+        """
+        Get the positions of the rows to draw a time window, from the finest level with at
+        most `max_points` rows inside it. The closest rows outside the window are included
+        too, so the lines reach its borders.
+        :param start: first datetime of the window, or None to start from the beginning.
+        :param end: last datetime of the window, or None to get until the end.
+        """
+        first = 0 if start is None else int(np.searchsorted(self.index, to_datetime64(start), 'left'))
+        last = len(self) if end is None else int(np.searchsorted(self.index, to_datetime64(end), 'right'))
+        if last - first <= self.max_points:
+            return np.arange(max(first - 1, 0), min(last + 1, len(self)))
+        for level in reversed(self.levels):
+            level_first, level_last = np.searchsorted(level, [first, last])
+            if level_last - level_first <= self.max_points or level is self.levels[0]:
+                return level[max(level_first - 1, 0):level_last + 1]
+
+
+def get_relayout_x_range(relayout_data: Optional[dict]) -> Tuple[bool, Optional[Tuple[str, str]]]:
+    """
+    Get the time window of a Graph `relayoutData`.
+    :return: a tuple (whether the time window changed, time window or None if the whole
+        data is shown).
+    """
+    if not relayout_data:
+        return False, None
+    if relayout_data.get('xaxis.autorange'):
+        return True, None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return True, (relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]'])
+    if 'xaxis.range' in relayout_data:
+        return True, tuple(relayout_data['xaxis.range'])
+    return False, None
+
+
+def minmax_positions(values: np.ndarray, n_buckets: int) -> np.ndarray:
+    """
+    Get the positions of the minimum and the maximum of every bucket of consecutive values
+    (NaNs are ignored).
+    """
+    if len(values) == 0:
+        return np.array([], dtype=int)
+    bucket_size = -(-len(values) // n_buckets)
+    padded = np.full(bucket_size * -(-len(values) // bucket_size), np.nan)
+    padded[:len(values)] = values
+    buckets = padded.reshape(-1, bucket_size)
+    offsets = np.arange(buckets.shape[0]) * bucket_size
+    min_positions = offsets + np.argmin(np.where(np.isnan(buckets), np.inf, buckets), axis=1)
+    max_positions = offsets + np.argmax(np.where(np.isnan(buckets), -np.inf, buckets), axis=1)
+    return np.minimum(np.union1d(min_positions, max_positions), len(values) - 1)
+
+
+def to_datetime64(value: Union[str, np.datetime64]) -> np.datetime64:
+    """ Parse a datetime as sent by Plotly (e.g. `2022-01-01 10:30:00.5`). """
+    return Timestamp(value).to_datetime64()
@@ -18,3 +18,7 @@ class SimulationException(NakamotoExplorerException):
 
 class ValidationException(NakamotoExplorerException):
     pass
+
+
+class LoadingException(NakamotoExplorerException):
+    pass
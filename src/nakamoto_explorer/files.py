@@ -1,8 +1,29 @@
-from os import walk
-from typing import List, Union
+from contextlib import contextmanager
+from hashlib import sha256
+from json import JSONDecodeError, dump, dumps, load, loads
+from logging import getLogger
+from os import getpid, remove, rename, replace, scandir, stat, walk
+from os.path import abspath, dirname, exists, isdir, relpath, splitext
+from pathlib import Path
+from shutil import rmtree
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
 
+import yaml
 from pandas import DataFrame
-from yaml import safe_load
+
+logger = getLogger(__name__)
+
+PARQUET_SOURCE_METADATA_KEY = b'nakamoto_explorer.source'
+YAML_INDEX_FILE = 'yaml_index.json'
+YAML_INDEX_VERSION = 1
+# The loader compiled with libyaml is about 10 times faster, if PyYAML was built with it.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+ARROW_COLUMNS_NAME_METADATA_KEY = b'nakamoto_explorer.columns_name'
+ARROW_INDEX_COLUMN = '__index__'
+# Files of a data folder that the stores are built from, and file of a store with the
+# signature of the data folder it was built from.
+SOURCE_EXTENSIONS = ('.csv', '.yml', '.yaml')
+STORE_SOURCE_FILE = 'source.json'
 
 
 def ensure_folder_format(folder: str, use_backslashes: bool = False) -> str:
@@ -13,12 +34,80 @@ def ensure_folder_format(folder: str, use_backslashes: bool = False) -> str:
     return normalize_path(folder, use_backslashes=use_backslashes)
 
 
+def get_file_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """ Get the SHA-256 hex digest of a file content. """
+    file_hash = sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_file_signature(file_path: str) -> dict:
+    """ Get the modification time and size of a file, to cheaply detect changes on it. """
+    file_stat = stat(file_path)
+    return {'mtime_ns': file_stat.st_mtime_ns, 'size': file_stat.st_size}
+
+
+def get_folder_signature(folder: str, extensions=SOURCE_EXTENSIONS) -> Optional[dict]:
+    """
+    Get the signature of the source files inside a folder (recursively): the absolute path
+    of the folder and a hash of the relative paths, modification times and sizes of the
+    files with one of `extensions`, to cheaply detect changes in any of them.
+    :return: the signature, or None if the folder has no source files.
+    """
+    folder = ensure_folder_format(folder)
+    files_hash = sha256()
+    n_files = 0
+    for root, folders, file_names in walk(folder):
+        folders.sort()
+        for file_name in sorted(file_names):
+            if splitext(file_name)[1] in extensions:
+                file_path = f'{root}/{file_name}'
+                files_hash.update(dumps([normalize_path(relpath(file_path, folder)),
+                                         get_file_signature(file_path)]).encode())
+                n_files += 1
+    if n_files == 0:
+        return None
+    return {'path': normalize_path(abspath(folder)), 'n_files': n_files, 'sha256': files_hash.hexdigest()}
+
+
 def get_folders_inside_folder(folder: str) -> List[str]:
+    """ Get the names of the folders directly inside a folder (none if it does not exist). """
     folder = ensure_folder_format(folder)
-    folders_inside = [folders for root, folders, files in walk(folder)]
-    if len(folders_inside) > 0:
-        return folders_inside[0]
-    return []
+    if not isdir(folder):
+        return []
+    with scandir(folder) as entries:
+        return [entry.name for entry in entries if entry.is_dir()]
+
+
+def load_arrow(file_path: str, memory_map: bool = True) -> DataFrame:
+    """
+    Load a DataFrame saved with `save_arrow`. If `memory_map`, the numeric columns and
+    the index are read-only views of the memory-mapped file instead of copies, so every
+    process that loads the same file shares the same physical memory (the OS page cache).
+    """
+    from pandas import DatetimeIndex
+    from pyarrow import ipc, memory_map as arrow_memory_map, types
+
+    source = arrow_memory_map(file_path) if memory_map else open(file_path, 'rb')
+    with source:
+        table = ipc.open_file(source).read_all()
+    columns = {}
+    for name, column in zip(table.column_names, table.itercolumns()):
+        is_numeric = types.is_integer(column.type) or types.is_floating(column.type) or \
+            types.is_timestamp(column.type)
+        if is_numeric and column.null_count == 0 and column.num_chunks == 1:
+            columns[name] = column.chunk(0).to_numpy(zero_copy_only=True)
+        else:
+            columns[name] = column.to_pandas().array
+    index = columns.pop(ARROW_INDEX_COLUMN)
+    df = DataFrame(columns, index=DatetimeIndex(index) if types.is_timestamp(
+        table.schema.field(ARROW_INDEX_COLUMN).type) else index, copy=False)
+    metadata = table.schema.metadata or {}
+    if ARROW_COLUMNS_NAME_METADATA_KEY in metadata:
+        df.columns.name = metadata[ARROW_COLUMNS_NAME_METADATA_KEY].decode()
+    return df
 
 
 def load_csv(file_path: str) -> DataFrame:
@@ -26,9 +115,134 @@ def load_csv(file_path: str) -> DataFrame:
     return read_csv(file_path)
 
 
+def load_parquet(file_path: str) -> DataFrame:
+    from pyarrow.parquet import read_table
+    return read_table(file_path).to_pandas()
+
+
+def load_with_parquet_cache(source_path: str, load_function: Callable[[str], DataFrame],
+                            cache_path: Optional[str] = None) -> DataFrame:
+    """
+    Load a DataFrame from a source file (e.g. a .csv) through a Parquet sidecar file,
+    which keeps the dtypes, the index and the columns name of the loaded DataFrame.
+    The sidecar is written the first time, and it is rebuilt when the source file changes.
+    A change is detected when the source modification time or size differ from the ones
+    stored in the sidecar and, in that case, its content hash differs too.
+    If the sidecar can not be used (e.g. pyarrow is not installed or the folder is
+    read-only), the source file is loaded directly.
+    :param source_path: path of the source file.
+    :param load_function: function that loads the source file into a DataFrame.
+    :param cache_path: path of the sidecar file. By default, the source path with a
+        `.parquet` extension.
+    """
+    cache_path = cache_path or f'{splitext(source_path)[0]}.parquet'
+    source_signature = get_file_signature(source_path)
+    cached_source = read_parquet_source_metadata(cache_path)
+    if cached_source is not None:
+        if all(cached_source.get(key) == value for key, value in source_signature.items()):
+            return load_parquet(cache_path)
+        source_signature['sha256'] = get_file_hash(source_path)
+        if cached_source.get('sha256') == source_signature['sha256']:
+            # Same content with other modification time: refresh the stored signature.
+            df = load_parquet(cache_path)
+            save_parquet(df, cache_path, source_metadata=source_signature)
+            return df
+
+    df = load_function(source_path)
+    source_signature.setdefault('sha256', get_file_hash(source_path))
+    save_parquet(df, cache_path, source_metadata=source_signature)
+    return df
+
+
 def load_yaml(yaml_file: str) -> Union[dict, list]:
     with open(yaml_file, 'r') as file:
-        return safe_load(file)
+        return yaml.load(file, Loader=YAML_LOADER)
+
+
+@contextmanager
+def file_lock(lock_path: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock on a file while in the context, so the processes of a host that
+    use the same lock file run it one at a time. Without `fcntl` (e.g. on Windows), nothing
+    is locked.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+
+    Path(dirname(abspath(lock_path))).mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def store_lock(store_folder: str):
+    """ Lock held while a store is built (see `file_lock`), in a file next to its folder. """
+    return file_lock(f'{ensure_folder_format(store_folder)}.lock')
+
+
+def build_store_if_outdated(store_folder: str, input_path: str, store_file: str,
+                            build_function: Callable[[Optional[dict]], Any]) -> bool:
+    """
+    Build a store from a data folder if it does not exist, or if it was built from other
+    source files (see `get_folder_signature`). A store is kept if the data folder has no
+    source files (e.g. only the store was copied to the host).
+    The processes that load the store at the same time (e.g. the workers of a server) build
+    it one at a time, holding a lock file next to it, so only the first one builds it and
+    the rest use it.
+    :param store_folder: folder of the store.
+    :param input_path: data folder.
+    :param store_file: file of the store that only exists once it is complete (its catalog).
+    :param build_function: function that builds the store given the signature of the data
+        folder, which it saves with `save_store_source`.
+    :return: whether the store was built.
+    """
+    source = get_folder_signature(input_path)
+    if is_store_up_to_date(store_folder, store_file, source):
+        return False
+    with store_lock(store_folder):
+        if is_store_up_to_date(store_folder, store_file, source):
+            return False
+        build_function(source)
+    return True
+
+
+def is_store_up_to_date(store_folder: str, store_file: str, source: Optional[dict]) -> bool:
+    if not exists(f'{store_folder}/{store_file}'):
+        return False
+    return source is None or read_store_source(store_folder) == source
+
+
+def read_store_source(store_folder: str) -> Optional[dict]:
+    """ Read the signature of the data folder a store was built from (None if it is unknown). """
+    try:
+        with open(f'{store_folder}/{STORE_SOURCE_FILE}') as file:
+            return load(file)
+    except (OSError, JSONDecodeError):
+        return None
+
+
+def save_store_source(store_folder: str, source: Optional[dict]):
+    """ Save the signature of the data folder a store is built from (see `get_folder_signature`). """
+    if source is not None:
+        with open(f'{store_folder}/{STORE_SOURCE_FILE}', 'w') as file:
+            dump(source, file)
+
+
+def is_json_compatible(value: Any) -> bool:
+    """ Whether a value is loaded back the same after being saved as JSON (e.g. no integer keys). """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return True
+    if isinstance(value, list):
+        return all(map(is_json_compatible, value))
+    if isinstance(value, dict):
+        return all(isinstance(key, str) and is_json_compatible(item) for key, item in value.items())
+    return False
 
 
 def normalize_path(path: str, use_backslashes: bool = False) -> str:
@@ -37,3 +251,185 @@ def normalize_path(path: str, use_backslashes: bool = False) -> str:
     else:
         path = path.replace('\\', '/')
     return path
+
+
+def read_parquet_source_metadata(file_path: str) -> Optional[dict]:
+    """
+    Read the source metadata stored by `save_parquet`, only reading the Parquet footer.
+    :return: the source metadata, or None if the file does not exist or can not be read.
+    """
+    if not exists(file_path):
+        return None
+    try:
+        from pyarrow.parquet import read_schema
+        metadata = read_schema(file_path).metadata or {}
+    except Exception as exception:
+        logger.debug(f'Parquet file {file_path} can not be read: {exception!r}')
+        return None
+    if PARQUET_SOURCE_METADATA_KEY not in metadata:
+        return None
+    return loads(metadata[PARQUET_SOURCE_METADATA_KEY])
+
+
+def replace_folder(new_folder: str, folder: str):
+    """
+    Replace a folder (if it exists) with a new one, e.g. a store written in a temporary
+    folder once it is complete, so readers never see a partial store. The processes that
+    still use files of the previous folder keep their open files and memory maps after it
+    is deleted.
+    """
+    previous_folder = f'{folder}.{getpid()}.old'
+    if exists(folder):
+        rename(folder, previous_folder)
+    rename(new_folder, folder)
+    if exists(previous_folder):
+        rmtree(previous_folder)
+
+
+def save_arrow(df: DataFrame, file_path: str):
+    """
+    Save a DataFrame as an uncompressed Arrow IPC file, that can be memory-mapped with
+    `load_arrow`. Float NaNs are kept as values (not as nulls), so the float columns can
+    be loaded without copies.
+    """
+    from pyarrow import Table, array, ipc
+
+    columns = {ARROW_INDEX_COLUMN: array(df.index.to_numpy(), from_pandas=False)}
+    for name, column in df.items():
+        values = column.to_numpy()
+        if values.dtype.kind in 'iuf':
+            columns[name] = array(values, from_pandas=False)
+        else:
+            columns[name] = array(column, from_pandas=True)
+    table = Table.from_pydict(columns)
+    if df.columns.name is not None:
+        table = table.replace_schema_metadata(
+            {ARROW_COLUMNS_NAME_METADATA_KEY: str(df.columns.name).encode()})
+    temporary_path = f'{file_path}.{getpid()}.tmp'
+    with ipc.new_file(temporary_path, table.schema) as writer:
+        writer.write_table(table)
+    replace(temporary_path, file_path)
+
+
+def save_parquet(df: DataFrame, file_path: str, source_metadata: Optional[dict] = None) -> bool:
+    """
+    Save a DataFrame as a Parquet file, atomically replacing any previous file.
+    :param df: DataFrame to save.
+    :param file_path: output path.
+    :param source_metadata: metadata of the file the DataFrame was loaded from, stored
+        in the Parquet schema metadata.
+    :return: whether the file could be written.
+    """
+    temporary_path = f'{file_path}.{getpid()}.tmp'
+    try:
+        from pyarrow import Table
+        from pyarrow.parquet import write_table
+        table = Table.from_pandas(df)
+        if source_metadata is not None:
+            table = table.replace_schema_metadata({
+                **(table.schema.metadata or {}),
+                PARQUET_SOURCE_METADATA_KEY: dumps(source_metadata).encode()})
+        write_table(table, temporary_path)
+        replace(temporary_path, file_path)
+        return True
+    except Exception as exception:
+        logger.debug(f'Parquet file {file_path} can not be written: {exception!r}')
+        if exists(temporary_path):
+            remove(temporary_path)
+        return False
+
+
+def save_yaml(data: Union[dict, list], yaml_file: str):
+    """ Save data as a YAML file, atomically replacing any previous file. """
+    temporary_path = f'{yaml_file}.{getpid()}.tmp'
+    with open(temporary_path, 'w') as file:
+        yaml.safe_dump(data, file, sort_keys=False)
+    replace(temporary_path, yaml_file)
+
+
+def parse_yaml_entry(file_path: str) -> dict:
+    """ Parse a YAML file into an entry of a `YamlIndex`: {'signature': dict, 'content': Any}. """
+    signature = get_file_signature(file_path)
+    return {'signature': signature, 'content': load_yaml(file_path)}
+
+
+class YamlIndex:
+    """
+    JSON file with the parsed content of the YAML files of a folder, which is much faster to
+    load than parsing them again. The content of a file is only parsed again when its
+    modification time or size differ from the ones stored in the index, and the index is
+    rewritten by `save` if any file was parsed.
+    If the index can not be read (e.g. it is missing or corrupted), it is rebuilt. If it can
+    not be written (e.g. the folder is read-only), the files are parsed every time.
+    :param folder: folder of the indexed files, where the index is written.
+    :param index_file: name of the index file.
+    """
+
+    def __init__(self, folder: str, index_file: str = YAML_INDEX_FILE):
+        self.folder = ensure_folder_format(folder)
+        self.index_path = f'{self.folder}/{index_file}'
+        self.entries: Dict[str, dict] = self._read()
+        self.changed = False
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.index_path!r}, entries={len(self.entries)})'
+
+    def load(self, relative_path: str) -> Union[dict, list]:
+        """ Load a YAML file, given its path relative to the index folder. """
+        entry = self.get(relative_path)
+        if entry is not None:
+            return entry['content']
+        entry = parse_yaml_entry(f'{self.folder}/{relative_path}')
+        self.update(relative_path, entry)
+        return entry['content']
+
+    def get(self, relative_path: str) -> Optional[dict]:
+        """ Get the entry of a file if it is up to date, without parsing the file otherwise. """
+        entry = self.entries.get(relative_path)
+        try:
+            if entry is not None and entry['signature'] == get_file_signature(f'{self.folder}/{relative_path}'):
+                return entry
+        except OSError:
+            pass
+        return None
+
+    def update(self, relative_path: str, entry: dict):
+        """ Add the entry of a file parsed elsewhere (see `parse_yaml_entry`). """
+        if is_json_compatible(entry['content']):
+            self.entries[relative_path] = entry
+            self.changed = True
+
+    def save(self) -> bool:
+        """
+        Write the index if any file was parsed, removing the entries of deleted files.
+        :return: whether the index is up to date in the disk.
+        """
+        if not self.changed:
+            return True
+        self.entries = {relative_path: entry for relative_path, entry in self.entries.items()
+                        if exists(f'{self.folder}/{relative_path}')}
+        temporary_path = f'{self.index_path}.{getpid()}.tmp'
+        try:
+            with open(temporary_path, 'w') as file:
+                dump({'version': YAML_INDEX_VERSION, 'entries': self.entries}, file)
+            replace(temporary_path, self.index_path)
+        except OSError as exception:
+            logger.debug(f'YAML index {self.index_path} can not be written: {exception!r}')
+            if exists(temporary_path):
+                remove(temporary_path)
+            return False
+        self.changed = False
+        return True
+
+    def _read(self) -> Dict[str, dict]:
+        if not exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path) as file:
+                index = load(file)
+        except (OSError, JSONDecodeError) as exception:
+            logger.debug(f'YAML index {self.index_path} can not be read: {exception!r}')
+            return {}
+        if not isinstance(index, dict) or index.get('version') != YAML_INDEX_VERSION:
+            return {}
+        return index['entries']
@@ -1,27 +1,176 @@
-from typing import Dict, List, Set, Tuple
+from collections.abc import Mapping
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from logging import getLogger
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 from pandas import DataFrame, to_datetime
 
 from nakamoto_explorer.nakamoto import Rule, rules, stop_rules
-from nakamoto_explorer.files import get_folders_inside_folder, load_csv, load_yaml
+from nakamoto_explorer.cache import LRUCache
+from nakamoto_explorer.catalog import SimulationCatalog, get_identifier_key
+from nakamoto_explorer.files import (YamlIndex, get_folders_inside_folder, load_csv, load_with_parquet_cache,
+                                     load_yaml, parse_yaml_entry)
 
-from nakamoto_explorer.exceptions import ValidationException
-from nakamoto_explorer.settings import DATA_FOLDER
+from nakamoto_explorer.exceptions import (LoadingException, NakamotoExplorerException,
+                                          ValidationException)
+from nakamoto_explorer.instrumentation import timed
+from nakamoto_explorer.settings import (DATA_FOLDER, DATA_LOADING_MODE, LOADING_BACKEND,
+                                        LOADING_WORKERS, SIMULATION_CACHE_BY_MEMORY,
+                                        SIMULATION_CACHE_SIZE, SIMULATION_PARQUET_CACHE, YAML_INDEX)
 
+logger = getLogger(__name__)
 
-def get_data_idx(data: List[dict], price_list_idx: int, rule_set_idx: int):
-    idx, _ = [(idx, elem) for idx, elem in enumerate(data)
-              if (elem['identifier']['price_list'] == price_list_idx
-                  and elem['identifier']['rule_set'] == rule_set_idx)][0]
-    return idx
+# YAML files of a simulation folder, in the order they are given to `load_simulation`.
+SIMULATION_YAML_FILES = ('metrics.yml', 'rule_set.yml')
 
 
-def get_max_price_list_idx(data: List[dict]):
-    return max(x['identifier']['price_list'] for x in data)
+class SequentialExecutor(Executor):
+    """ Executor that runs every call in the current thread, when no pool is needed. """
 
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        return map(fn, *iterables)
 
-def get_max_rule_set_idx(data: List[dict]):
-    return max(x['identifier']['rule_set'] for x in data)
+
+class LazySimulation(Mapping):
+    """
+    Data element of a simulation whose content is loaded the first time it is requested.
+    It can be used as the dictionaries returned by `load_data`, but only its `identifier`
+    is kept in memory: the loaded content lives in a (shared) LRU cache, so it is loaded
+    again if it has been evicted.
+    :param identifier: dictionary {'price_list': int, 'rule_set': int}.
+    :param load_function: function that loads the complete data element.
+    :param cache: LRU cache where the loaded data elements are stored.
+    :param metrics_function: function that loads only the metrics, so they can be read
+        without loading the simulation DataFrame. They are taken from the loaded content
+        if it is cached.
+    """
+    data_keys = ('simulation_df', 'metrics', 'rule_set_kwargs', 'historial_kwargs', 'identifier')
+
+    def __init__(self, identifier: Dict[str, int], load_function: Callable[[], dict],
+                 cache: LRUCache, metrics_function: Optional[Callable[[], dict]] = None):
+        self.identifier = identifier
+        self.load_function = load_function
+        self.cache = cache
+        self.metrics_function = metrics_function
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'identifier':
+            return self.identifier
+        if key == 'metrics' and self.metrics_function is not None:
+            loaded = self.cache.peek(get_identifier_key(self))
+            return loaded['metrics'] if loaded is not None else self.metrics_function()
+        if key not in self.data_keys:
+            raise KeyError(key)
+        return self.load()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data_keys)
+
+    def __len__(self) -> int:
+        return len(self.data_keys)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.identifier})'
+
+    def load(self) -> dict:
+        return self.cache.get_or_load(get_identifier_key(self), self.load_function)
+
+
+def as_catalog(data: Sequence[Mapping]) -> SimulationCatalog:
+    """ Get the data as a SimulationCatalog, indexing it if it is not one already. """
+    if isinstance(data, SimulationCatalog):
+        return data
+    return SimulationCatalog(data)
+
+
+@timed('index_lookup')
+def get_data_idx(data: Sequence[Mapping], price_list_idx: int, rule_set_idx: int) -> int:
+    """
+    Get the position of a simulation in the data. If the simulation does not exist,
+    the position of the closest one (see `SimulationCatalog.get_idx`).
+    Pass a SimulationCatalog to avoid indexing the data on every call.
+    """
+    return as_catalog(data).get_idx(price_list_idx, rule_set_idx)
+
+
+def get_executor(n_workers: int = LOADING_WORKERS, backend: str = LOADING_BACKEND) -> Executor:
+    """ Get the pool used to load data. A single worker runs everything in the current thread. """
+    if n_workers <= 1:
+        return SequentialExecutor()
+    if backend == 'thread':
+        return ThreadPoolExecutor(max_workers=n_workers)
+    if backend == 'process':
+        return ProcessPoolExecutor(max_workers=n_workers)
+    raise ValidationException(f'Unknown loading {backend = }')
+
+
+def get_folder_idx(folder: str) -> int:
+    """ Get the index of a `prices_N` or `rule_set_M` folder. """
+    return int(folder.split('_')[-1])
+
+
+def get_max_price_list_idx(data: Sequence[Mapping]) -> int:
+    return as_catalog(data).max_price_list_idx
+
+
+def get_max_rule_set_idx(data: Sequence[Mapping]) -> int:
+    return as_catalog(data).max_rule_set_idx
+
+
+def get_simulation_size(data_element: dict) -> int:
+    """ Get the memory used by the simulation DataFrame of a data element, in bytes. """
+    return int(data_element['simulation_df'].memory_usage(deep=True).sum())
+
+
+def load_catalog(input_path: str = DATA_FOLDER, cache_size: int = SIMULATION_CACHE_SIZE,
+                 cache_by_memory: bool = SIMULATION_CACHE_BY_MEMORY) -> List[LazySimulation]:
+    """
+    Load the data as a catalog: only the folder names are scanned, and every simulation
+    is loaded the first time it is requested.
+    :param input_path: data folder, with the same structure used in `load_data`.
+    :param cache_size: maximum number of simulations kept in memory, or maximum
+        number of bytes if `cache_by_memory`.
+    :param cache_by_memory: whether to bound the cache by the memory used by the
+        simulation DataFrames instead of by the number of simulations.
+    :return: a list of LazySimulation, sorted as the list returned by `load_data`.
+    """
+    cache = LRUCache(cache_size, get_size=get_simulation_size if cache_by_memory else None)
+    catalog = []
+    for price_list_folder in get_folders_inside_folder(input_path):
+        prices_folder = f'{input_path}/{price_list_folder}'
+        for rule_set_folder in get_folders_inside_folder(prices_folder):
+            identifier = {'price_list': get_folder_idx(price_list_folder),
+                          'rule_set': get_folder_idx(rule_set_folder)}
+            load_function = partial(load_simulation, prices_folder, rule_set_folder)
+            metrics_function = partial(load_yaml, f'{prices_folder}/{rule_set_folder}/metrics.yml')
+            catalog.append(LazySimulation(identifier, load_function, cache, metrics_function))
+    catalog.sort(key=get_identifier_key)
+    return catalog
+
+
+def load_input_data(mode: str = DATA_LOADING_MODE,
+                    input_path: str = DATA_FOLDER) -> SimulationCatalog:
+    """
+    Load the data into a SimulationCatalog using one of the loading modes:
+    - 'eager': load every simulation at once (see `load_data`).
+    - 'lazy': load every simulation on demand (see `load_catalog`).
+    - 'shared': load every simulation on demand from a memory-mapped store, shared by
+      every process of the host (see `shared_store.load_shared_store`).
+    - 'dataset': load every simulation on demand from a partitioned Parquet dataset (see
+      `dataset_store.load_dataset_store`).
+    """
+    if mode == 'eager':
+        return SimulationCatalog(load_data(input_path))
+    if mode == 'lazy':
+        return SimulationCatalog(load_catalog(input_path))
+    if mode == 'shared':
+        from nakamoto_explorer.shared_store import load_shared_store
+        return SimulationCatalog(load_shared_store(input_path=input_path))
+    if mode == 'dataset':
+        from nakamoto_explorer.dataset_store import load_dataset_store
+        return SimulationCatalog(load_dataset_store(input_path=input_path))
+    raise ValidationException(f'Unknown data loading {mode = }')
 
 
 def load_rule_set_list(rule_set_list: List[dict]) -> Dict[str, Set[Rule]]:
@@ -40,7 +189,20 @@ def load_rule_set_list(rule_set_list: List[dict]) -> Dict[str, Set[Rule]]:
             'stop_rules': set(clean_stop_rules)}
 
 
-def load_simulation_csv(path: str) -> DataFrame:
+def load_simulation_csv(path: str, use_cache: bool = SIMULATION_PARQUET_CACHE) -> DataFrame:
+    """
+    Load a `simulation_df.csv` file.
+    :param path: path of the .csv file.
+    :param use_cache: whether to load it through a Parquet sidecar (`simulation_df.parquet`),
+        which is only rebuilt when the .csv file changes.
+    """
+    if use_cache:
+        return load_with_parquet_cache(path, read_simulation_csv)
+    return read_simulation_csv(path)
+
+
+def read_simulation_csv(path: str) -> DataFrame:
+    """ Parse a `simulation_df.csv` file, restoring the properties lost in the .csv format. """
     # With the use of .csv as intermediate format some properties are lost.
     df = load_csv(path)
     loaded_index = 'Unnamed: 0'
@@ -51,29 +213,209 @@ def load_simulation_csv(path: str) -> DataFrame:
     return df
 
 
-def load_data(input_path: str = DATA_FOLDER) -> List[dict]:
-    data = []
-    for price_list_folder in get_folders_inside_folder(input_path):
-        prices_folder = f'{input_path}/{price_list_folder}'
-        price_list_idx = int(price_list_folder.split('_')[-1])
-        historial_kwargs = load_yaml(f'{prices_folder}/historial_kwargs.yml')
-        for rule_set_folder in get_folders_inside_folder(prices_folder):
-            data_path = f'{prices_folder}/{rule_set_folder}/'
-            rule_set = load_yaml(data_path + 'rule_set.yml')
-            rule_set = load_rule_set_list(rule_set)
-            rule_set_idx = int(rule_set_folder.split('_')[-1])
-            rule_simulation_mock = \
-                {'simulation_df': load_simulation_csv(data_path + 'simulation_df.csv'),
-                 'metrics': load_yaml(data_path + 'metrics.yml'),
-                 'rule_set_kwargs': rule_set,
-                 'historial_kwargs': historial_kwargs,
-                 'identifier': {'price_list': price_list_idx,
-                                'rule_set': rule_set_idx}}
-            data.append(rule_simulation_mock)
-    data.sort(key=lambda x: (x['identifier']['price_list'], x['identifier']['rule_set']))
+def load_data(input_path: str = DATA_FOLDER, n_workers: int = LOADING_WORKERS,
+              backend: str = LOADING_BACKEND, raise_exception: bool = False,
+              use_yaml_index: bool = YAML_INDEX, use_parquet_cache: bool = SIMULATION_PARQUET_CACHE
+              ) -> List[dict]:
+    """
+    Load every simulation of the data folder.
+    :param input_path: data folder, with `prices_N/rule_set_M` simulation folders.
+    :param n_workers: number of workers used to parse the folders. If it is 1, they
+        are parsed sequentially in the current process.
+    :param backend: pool used if there is more than one worker: 'thread' or 'process'.
+    :param raise_exception: whether to raise a LoadingException once everything has been
+        tried to load if any folder failed. Failures are logged anyway, and the
+        folders that failed are not included in the output.
+    :param use_yaml_index: whether to load the YAML files of every price list through its
+        index (see `load_price_list_yaml`). The files that are not up to date in it are
+        parsed along with their simulation, and added to it once everything is loaded.
+    :param use_parquet_cache: whether to load the simulation DataFrames through their
+        Parquet sidecars (see `load_simulation_csv`).
+    :return: the list of data elements, sorted by (price_list, rule_set).
+    """
+    prices_folders = [f'{input_path}/{price_list_folder}'
+                      for price_list_folder in get_folders_inside_folder(input_path)]
+    with get_executor(n_workers, backend) as executor:
+        loaded_price_lists = list(executor.map(partial(try_load_price_list_yaml, use_yaml_index=use_yaml_index,
+                                                       refresh=False),
+                                               prices_folders))
+        simulation_folders = []
+        for prices_folder, (price_list_yaml, message) in zip(prices_folders, loaded_price_lists):
+            if message is None:
+                historial_kwargs, rule_sets_yaml = price_list_yaml
+                simulation_folders += [(prices_folder, rule_set_folder, historial_kwargs, *rule_set_yaml)
+                                       for rule_set_folder, rule_set_yaml in rule_sets_yaml.items()]
+        chunk_size = max(1, len(simulation_folders) // (4 * max(n_workers, 1)))
+        loaded_simulations = list(executor.map(partial(try_load_indexed_simulation,
+                                                       use_parquet_cache=use_parquet_cache),
+                                               simulation_folders, chunksize=chunk_size))
+    loaded = [result for result, _ in loaded_simulations]
+    if use_yaml_index:
+        update_yaml_indexes(simulation_folders, [entries for _, entries in loaded_simulations])
+
+    data = [data_element for data_element, _ in loaded if data_element is not None]
+    failures = [message for _, message in loaded_price_lists + loaded if message is not None]
+    for failure in failures:
+        logger.warning(failure)
+    if failures and raise_exception:
+        raise LoadingException(f'{len(failures)} folders could not be loaded', failures)
+    data.sort(key=get_identifier_key)
     return data
 
 
+def load_price_list_yaml(prices_folder: str, use_yaml_index: bool = YAML_INDEX, refresh: bool = True
+                         ) -> Tuple[dict, Dict[str, Tuple[Optional[dict], Optional[List[dict]]]]]:
+    """
+    Load the YAML files of a `prices_N` folder: its `historial_kwargs.yml` and the
+    `metrics.yml` and `rule_set.yml` of every simulation.
+    If `use_yaml_index`, they are loaded through the index of the folder (see
+    `files.YamlIndex`), so only the files that changed since the last load are parsed.
+    Otherwise, only the `historial_kwargs.yml` is loaded, and the other files are left to
+    `load_simulation`, so they are parsed in parallel.
+    :param refresh: whether to parse the files that are not up to date in the index, and
+        save it. If not, they are left to the caller, as if the index was not used.
+    :return: a tuple (historial_kwargs, {rule_set_folder: (metrics, rule_set_list)}). The
+        files that can not be loaded are None, so `load_simulation` reports their error.
+    """
+    rule_set_folders = get_folders_inside_folder(prices_folder)
+    if not use_yaml_index:
+        return load_yaml(f'{prices_folder}/historial_kwargs.yml'), \
+            {rule_set_folder: (None, None) for rule_set_folder in rule_set_folders}
+    yaml_index = YamlIndex(prices_folder)
+    historial_kwargs = yaml_index.load('historial_kwargs.yml')
+    rule_sets_yaml = {}
+    for rule_set_folder in rule_set_folders:
+        rule_sets_yaml[rule_set_folder] = tuple(
+            try_load_indexed_yaml(yaml_index, f'{rule_set_folder}/{file_name}', refresh)
+            for file_name in SIMULATION_YAML_FILES)
+    yaml_index.save()
+    return historial_kwargs, rule_sets_yaml
+
+
+@timed()
+def load_simulation(prices_folder: str, rule_set_folder: str,
+                    historial_kwargs: Optional[dict] = None, metrics: Optional[dict] = None,
+                    rule_set_list: Optional[List[dict]] = None,
+                    use_parquet_cache: bool = SIMULATION_PARQUET_CACHE) -> dict:
+    """
+    Load a simulation folder (`prices_N/rule_set_M`) into a data element.
+    :param prices_folder: path of the `prices_N` folder.
+    :param rule_set_folder: name of the `rule_set_M` folder inside `prices_folder`.
+    :param historial_kwargs: already loaded `historial_kwargs.yml` of the `prices_folder`.
+        It is loaded if not given.
+    :param metrics: already loaded `metrics.yml`. It is loaded if not given.
+    :param rule_set_list: already loaded `rule_set.yml`. It is loaded if not given.
+    :param use_parquet_cache: whether to load the simulation DataFrame through its Parquet
+        sidecar (see `load_simulation_csv`).
+    """
+    if historial_kwargs is None:
+        historial_kwargs = load_yaml(f'{prices_folder}/historial_kwargs.yml')
+    data_path = f'{prices_folder}/{rule_set_folder}/'
+    if rule_set_list is None:
+        rule_set_list = load_yaml(data_path + 'rule_set.yml')
+    rule_set = load_rule_set_list(rule_set_list)
+    return {'simulation_df': load_simulation_csv(data_path + 'simulation_df.csv', use_parquet_cache),
+            'metrics': metrics if metrics is not None else load_yaml(data_path + 'metrics.yml'),
+            'rule_set_kwargs': rule_set,
+            'historial_kwargs': historial_kwargs,
+            'identifier': {'price_list': get_folder_idx(prices_folder),
+                           'rule_set': get_folder_idx(rule_set_folder)}}
+
+
+def rule_set_to_rule_set_list(rule_set: Dict[str, Set[Rule]]) -> List[dict]:
+    """ Encode a rule set into a raw list of dicts, as it is stored in a `rule_set.yml`. """
+    return [rule_to_rule_dict(rule)
+            for rule in [*rule_set['rule_set'], *rule_set['stop_rules']]]
+
+
+def rule_to_rule_dict(rule: Rule) -> dict:
+    """ Encode a Rule into a dictionary (the inverse of `rule_dict_to_rule`). """
+    return {'rule_name': rule.name, **rule.parameters}
+
+
+def try_load_indexed_yaml(yaml_index: YamlIndex, relative_path: str, refresh: bool = True
+                          ) -> Optional[Union[dict, list]]:
+    """
+    Load a YAML file through an index, or get None if it can not be loaded. If not
+    `refresh`, None is also returned if the file is not up to date in the index.
+    """
+    if not refresh:
+        entry = yaml_index.get(relative_path)
+        return None if entry is None else entry['content']
+    try:
+        return yaml_index.load(relative_path)
+    except (Exception, NakamotoExplorerException):
+        return None
+
+
+def try_load_price_list_yaml(prices_folder: str, use_yaml_index: bool = YAML_INDEX, refresh: bool = True
+                             ) -> Tuple[Optional[tuple], Optional[str]]:
+    """
+    Load the YAML files of a `prices_N` folder (see `load_price_list_yaml`) without raising exceptions.
+    :return: a tuple (loaded YAML files, None) or (None, message describing the failure).
+    """
+    try:
+        return load_price_list_yaml(prices_folder, use_yaml_index, refresh), None
+    except (Exception, NakamotoExplorerException) as exception:
+        return None, f'{prices_folder}: {exception!r}'
+
+
+def try_load_simulation(simulation_folder: Tuple[str, str, dict, Optional[dict], Optional[List[dict]]],
+                        use_parquet_cache: bool = SIMULATION_PARQUET_CACHE
+                        ) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Load a simulation folder without raising exceptions.
+    :param simulation_folder: tuple (prices_folder, rule_set_folder, historial_kwargs,
+        metrics, rule_set_list), where the last two are None if they are not loaded yet.
+    :param use_parquet_cache: see `load_simulation`.
+    :return: a tuple (data_element, None) or (None, message describing the failure).
+    """
+    prices_folder, rule_set_folder = simulation_folder[:2]
+    try:
+        return load_simulation(*simulation_folder, use_parquet_cache=use_parquet_cache), None
+    except (Exception, NakamotoExplorerException) as exception:
+        return None, f'{prices_folder}/{rule_set_folder}: {exception!r}'
+
+
+def try_load_indexed_simulation(simulation_folder: Tuple[str, str, dict, Optional[dict], Optional[List[dict]]],
+                                use_parquet_cache: bool = SIMULATION_PARQUET_CACHE
+                                ) -> Tuple[Tuple[Optional[dict], Optional[str]], Dict[str, dict]]:
+    """
+    Load a simulation folder without raising exceptions (see `try_load_simulation`), parsing
+    first its YAML files that are not loaded yet, so they can be added to the YAML index.
+    :return: a tuple ((data_element, message), entries), where entries are the parsed files
+        as `files.YamlIndex` entries, by their path relative to the `prices_N` folder.
+    """
+    prices_folder, rule_set_folder, historial_kwargs, *yaml_files = simulation_folder
+    entries = {}
+    for position, file_name in enumerate(SIMULATION_YAML_FILES):
+        if yaml_files[position] is None:
+            relative_path = f'{rule_set_folder}/{file_name}'
+            try:
+                entries[relative_path] = parse_yaml_entry(f'{prices_folder}/{relative_path}')
+                yaml_files[position] = entries[relative_path]['content']
+            except (Exception, NakamotoExplorerException):
+                pass  # It is parsed again by `load_simulation`, which reports the error.
+    return try_load_simulation((prices_folder, rule_set_folder, historial_kwargs, *yaml_files),
+                               use_parquet_cache), entries
+
+
+def update_yaml_indexes(simulation_folders: List[tuple], simulation_entries: List[Dict[str, dict]]):
+    """
+    Add the YAML files parsed by `try_load_indexed_simulation` to the index of their
+    `prices_N` folder, saving only the indexes that changed.
+    """
+    entries_by_folder = {}
+    for simulation_folder, entries in zip(simulation_folders, simulation_entries):
+        if entries:
+            entries_by_folder.setdefault(simulation_folder[0], {}).update(entries)
+    for prices_folder, entries in entries_by_folder.items():
+        yaml_index = YamlIndex(prices_folder)
+        for relative_path, entry in entries.items():
+            yaml_index.update(relative_path, entry)
+        yaml_index.save()
+
+
 def rule_dict_to_rule(rule_dict: dict) -> Tuple[Rule, bool]:
     """
     Decode a dictionary into a Rule.
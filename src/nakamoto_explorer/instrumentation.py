@@ -0,0 +1,212 @@
+"""
+Opt-in latency instrumentation of the dashboard server (see INSTRUMENTATION_ENABLED).
+
+The functions decorated with `timed` (the renders and the callbacks) record their duration
+in a histogram per stage, and the Dash callback requests record their total duration
+(including the serialization of their response) and their response size. The histograms
+and the hit rates of the registered caches are exposed at the `/metrics` route of the server
+in the Prometheus text format. The callback requests slower than SLOW_CALLBACK_SECONDS are
+logged with the duration of each of their stages.
+
+While the instrumentation is disabled, `timed` functions only check a flag.
+"""
+from bisect import bisect_left
+from functools import wraps
+from logging import getLogger
+from threading import Lock, local
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from nakamoto_explorer.cache import LRUCache
+from nakamoto_explorer.settings import (INSTRUMENTATION_BYTES_BUCKETS, INSTRUMENTATION_SECONDS_BUCKETS,
+                                        SLOW_CALLBACK_SECONDS)
+
+logger = getLogger(__name__)
+
+CALLBACK_PATH = '/_dash-update-component'
+METRICS_PATH = '/metrics'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """
+    Thread-safe cumulative histogram, as the Prometheus ones.
+    :param buckets: sorted upper bounds of the buckets (the +Inf one is implicit).
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def get_cumulative_counts(self) -> List[Tuple[str, int]]:
+        """ Get the (upper bound, number of values lower or equal than it) of every bucket. """
+        with self._lock:
+            counts = list(self.counts)
+        cumulative_counts, total = [], 0
+        for upper_bound, count in zip([*map(repr, self.buckets), '+Inf'], counts):
+            total += count
+            cumulative_counts.append((upper_bound, total))
+        return cumulative_counts
+
+
+class Instrumentation:
+    """ Registry of the histograms and the caches exposed at the metrics route. """
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms: Dict[Tuple[str, str, str], Histogram] = {}
+        self.descriptions: Dict[str, str] = {}
+        self.caches: Dict[str, LRUCache] = {}
+        self._lock = Lock()
+        self._request = local()
+
+    def observe(self, name: str, label: Tuple[str, str], value: float, buckets: Sequence[float],
+                description: str = ''):
+        key = (name, *label)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+                self.descriptions.setdefault(name, description)
+        histogram.observe(value)
+
+    def observe_stage(self, stage: str, seconds: float):
+        """ Record the duration of a stage, and add it to the breakdown of the current request. """
+        self.observe('nakamoto_stage_seconds', ('stage', stage), seconds, INSTRUMENTATION_SECONDS_BUCKETS,
+                     'Duration of the instrumented functions.')
+        stages = getattr(self._request, 'stages', None)
+        if stages is not None:
+            stages.append((stage, perf_counter() - seconds, seconds))
+
+    def start_request(self):
+        self._request.stages = []
+        self._request.start = perf_counter()
+
+    def end_request(self, callback: str, response_bytes: int):
+        """ Record the duration and the response size of the current callback request. """
+        if getattr(self._request, 'stages', None) is None:
+            return
+        seconds = perf_counter() - self._request.start
+        stages, self._request.stages = self._request.stages, None
+        self.observe('nakamoto_callback_seconds', ('callback', callback), seconds,
+                     INSTRUMENTATION_SECONDS_BUCKETS,
+                     'Duration of the Dash callback requests, including their serialization.')
+        self.observe('nakamoto_callback_response_bytes', ('callback', callback), response_bytes,
+                     INSTRUMENTATION_BYTES_BUCKETS, 'Size of the Dash callback responses.')
+        if SLOW_CALLBACK_SECONDS is not None and seconds > SLOW_CALLBACK_SECONDS:
+            logger.warning(f'Slow callback {callback}: {seconds:.3f} s, {response_bytes} bytes '
+                           f'({get_stages_breakdown(stages, seconds)})')
+
+    def register_cache(self, name: str, cache: LRUCache):
+        """ Expose the hits, misses and size of a cache. """
+        self.caches[name] = cache
+
+    def render(self) -> str:
+        """ Render the metrics in the Prometheus text format. """
+        lines = []
+        for name in sorted(self.descriptions):
+            lines += [f'# HELP {name} {self.descriptions[name]}', f'# TYPE {name} histogram']
+            for (histogram_name, label_name, label_value), histogram in sorted(self.histograms.items()):
+                if histogram_name != name:
+                    continue
+                label = f'{label_name}="{escape_label_value(label_value)}"'
+                lines += [f'{name}_bucket{{{label},le="{upper_bound}"}} {count}'
+                          for upper_bound, count in histogram.get_cumulative_counts()]
+                lines += [f'{name}_sum{{{label}}} {histogram.sum!r}', f'{name}_count{{{label}}} {histogram.count}']
+        for name, description, metric_type, get_value in [
+                ('nakamoto_cache_hits_total', 'Hits of the caches.', 'counter', lambda cache: cache.hits),
+                ('nakamoto_cache_misses_total', 'Misses of the caches.', 'counter', lambda cache: cache.misses),
+                ('nakamoto_cache_size', 'Size of the caches, in their size units.', 'gauge',
+                 lambda cache: cache.current_size),
+                ('nakamoto_cache_elements', 'Elements of the caches.', 'gauge', len)]:
+            if self.caches:
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}']
+                lines += [f'{name}{{cache="{escape_label_value(cache_name)}"}} {get_value(cache)}'
+                          for cache_name, cache in sorted(self.caches.items())]
+        return '\n'.join(lines) + '\n'
+
+
+instrumentation = Instrumentation()
+
+
+def timed(stage: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """ Decorator that records the duration of a function as a stage (its name by default). """
+    def decorator(function: Callable) -> Callable:
+        stage_name = stage or function.__name__
+
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            if not instrumentation.enabled:
+                return function(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                instrumentation.observe_stage(stage_name, perf_counter() - start)
+        return timed_function
+    return decorator
+
+
+def instrument_server(server, caches: Optional[Dict[str, LRUCache]] = None):
+    """
+    Enable the instrumentation, timing the Dash callback requests of a Flask server and
+    adding its metrics route.
+    :param server: Flask server of the Dash app.
+    :param caches: caches whose hit rates are exposed, by name.
+    """
+    from flask import Response, request
+
+    instrumentation.enabled = True
+    for name, cache in (caches or {}).items():
+        instrumentation.register_cache(name, cache)
+
+    @server.before_request
+    def start_callback_request():
+        if request.path == CALLBACK_PATH:
+            instrumentation.start_request()
+
+    @server.after_request
+    def end_callback_request(response):
+        if request.path == CALLBACK_PATH:
+            output = (request.get_json(silent=True) or {}).get('output', 'unknown')
+            instrumentation.end_request(get_callback_name(output), response.calculate_content_length() or 0)
+        return response
+
+    @server.route(METRICS_PATH)
+    def metrics():
+        return Response(instrumentation.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def get_callback_name(output: str) -> str:
+    """ Get the name of a callback from its output ('..id.property...id.property..' if there are several). """
+    return output[2:-2].replace('...', ',') if output.startswith('..') else output
+
+
+def get_stages_breakdown(stages: List[Tuple[str, float, float]], total_seconds: float) -> str:
+    """
+    Describe the stages (name, start, seconds) of a request, in the order they started.
+    The nested stages are included in the ones that call them (e.g. the renders in the
+    callback), so only the outermost ones are subtracted from the total to get the time
+    spent out of them (mostly the serialization of the response).
+    """
+    descriptions, outermost_seconds, outermost_end = [], 0., float('-inf')
+    for stage, start, seconds in sorted(stages, key=lambda stage: (stage[1], -stage[2])):
+        descriptions.append(f'{stage}={seconds:.3f} s')
+        if start >= outermost_end:
+            outermost_seconds += seconds
+            outermost_end = start + seconds
+    descriptions.append(f'other={max(total_seconds - outermost_seconds, 0.):.3f} s')
+    return ', '.join(descriptions)
@@ -0,0 +1,265 @@
+"""
+Columnar index of the metrics of all the simulations, to rank and filter them without
+loading their DataFrames.
+
+Every `metrics.yml` is flattened into a row of a single typed table: a column per main,
+stats and strategy metric, named by its path in the file (e.g.
+`improvement_metrics.absolute_diffs.main.performance`), and the simulation identifiers
+(`price_list`, `rule_set`) as its index. The queries are vectorized over the columns, so
+they take milliseconds even with hundreds of thousands of simulations.
+
+The index is built from the loaded data elements (`MetricsIndex.from_data`) or, for the
+'lazy' loading mode, from the YAML files of the data folder (`MetricsIndex.from_folder`),
+so its startup does not parse the metrics files one by one.
+
+The filters and sorting are the ones of a DataTable (see `table_queries`), e.g.:
+    metrics_index.query('{simulation_metrics.main.profit} > 0', top_k=10,
+                        sort_by=[{'column_id': PERFORMANCE_IMPROVEMENT, 'direction': 'desc'}])
+"""
+from functools import partial
+from logging import getLogger
+from typing import Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+from pandas import DataFrame, MultiIndex
+
+from nakamoto_explorer.catalog import get_identifier_key
+from nakamoto_explorer.exceptions import NakamotoExplorerException, ValidationException
+from nakamoto_explorer.instrumentation import timed
+from nakamoto_explorer.settings import DATA_FOLDER, DATA_LOADING_MODE, LOADING_BACKEND, LOADING_WORKERS, YAML_INDEX
+from nakamoto_explorer.table_queries import get_filter_mask, split_filter_query
+
+logger = getLogger(__name__)
+
+IDENTIFIER_COLUMNS = ['price_list', 'rule_set']
+# Sections of a metrics file that are indexed. The `rules` ones are counts of every rule,
+# which differ between rule sets.
+METRIC_SECTIONS = ('main', 'stats', 'strategy', 'strategy_diffs')
+PERFORMANCE_IMPROVEMENT = 'improvement_metrics.absolute_diffs.main.performance'
+PROFIT_IMPROVEMENT = 'improvement_metrics.absolute_diffs.main.profit'
+# Metric columns shown in the leaderboard of the dashboard.
+LEADERBOARD_COLUMNS = [
+    'simulation_metrics.main.performance',
+    'simulation_metrics.main.profit',
+    PERFORMANCE_IMPROVEMENT,
+    PROFIT_IMPROVEMENT,
+    'improvement_metrics.percent_diffs.main.performance',
+    'improvement_metrics.percent_diffs.main.profit',
+    'simulation_metrics.main.accumulated_commission',
+    'improvement_metrics.strategy_diffs.both_shares_improves',
+]
+
+
+class MetricsIndex:
+    """
+    Table of the metrics of a set of simulations (see `flatten_metrics`).
+    :param df: DataFrame with a column per metric, indexed by (price_list, rule_set).
+    """
+
+    def __init__(self, df: DataFrame):
+        if list(df.index.names) != IDENTIFIER_COLUMNS:
+            raise ValidationException(f'The metrics index is indexed by {df.index.names} '
+                                      f'instead of {IDENTIFIER_COLUMNS}')
+        self.df = df
+        self.identifiers = df.index.to_frame(index=False)
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(simulations={len(self.df)}, metrics={len(self.df.columns)})'
+
+    @classmethod
+    @timed('build_metrics_index')
+    def from_data(cls, data: Iterable[Mapping]) -> 'MetricsIndex':
+        """
+        Build the index of some data elements. Only their identifier and metrics are read,
+        so the simulations of a LazySimulation catalog are not loaded.
+        """
+        identifiers, records = [], []
+        for data_element in data:
+            identifiers.append(get_identifier_key(data_element))
+            records.append(flatten_metrics(data_element['metrics']))
+        return cls.from_records(identifiers, records)
+
+    @classmethod
+    @timed('build_metrics_index')
+    def from_folder(cls, input_path: str = DATA_FOLDER, n_workers: int = LOADING_WORKERS,
+                    backend: str = LOADING_BACKEND, use_yaml_index: bool = YAML_INDEX) -> 'MetricsIndex':
+        """
+        Build the index of the simulations of a data folder, loading the metrics files of
+        its price lists in parallel (see `load_price_list_records`). The simulations whose
+        metrics can not be loaded are logged and left out.
+        :param input_path: data folder, with `prices_N/rule_set_M` simulation folders.
+        :param n_workers: number of workers (see `input_data.get_executor`).
+        :param backend: pool used if there is more than one worker: 'thread' or 'process'.
+        :param use_yaml_index: whether to load the metrics files through the YAML index of
+            every price list (see `input_data.load_price_list_yaml`).
+        """
+        from nakamoto_explorer.files import get_folders_inside_folder
+        from nakamoto_explorer.input_data import get_executor
+
+        prices_folders = [f'{input_path}/{price_list_folder}'
+                          for price_list_folder in get_folders_inside_folder(input_path)]
+        identifiers, records = [], []
+        with get_executor(n_workers, backend) as executor:
+            for price_list_identifiers, price_list_records, failures in executor.map(
+                    partial(load_price_list_records, use_yaml_index=use_yaml_index), prices_folders):
+                identifiers += price_list_identifiers
+                records += price_list_records
+                for failure in failures:
+                    logger.warning(failure)
+        return cls.from_records(identifiers, records)
+
+    @classmethod
+    def from_records(cls, identifiers: List[Tuple[int, int]], records: List[dict]) -> 'MetricsIndex':
+        """ Build the index from the identifier keys and the flattened metrics of some simulations. """
+        index = MultiIndex.from_tuples(identifiers, names=IDENTIFIER_COLUMNS) if identifiers \
+            else MultiIndex.from_arrays([[], []], names=IDENTIFIER_COLUMNS)
+        df = DataFrame.from_records(records, index=index) if records else DataFrame(index=index)
+        return cls(get_typed_metrics_df(df).sort_index())
+
+    @property
+    def columns(self) -> List[str]:
+        """ Columns that can be filtered and sorted: the identifiers and the metrics. """
+        return IDENTIFIER_COLUMNS + list(self.df.columns)
+
+    def query(self, filter_query: Optional[str] = None, sort_by: Optional[List[dict]] = None,
+              top_k: Optional[int] = None, columns: Optional[List[str]] = None) -> DataFrame:
+        """
+        Get the metrics of the simulations that match a query.
+        :param filter_query: DataTable `filter_query`, e.g. `{simulation_metrics.main.profit} > 0`.
+        :param sort_by: DataTable `sort_by`, a list of {'column_id', 'direction'}.
+        :param top_k: maximum number of simulations returned.
+        :param columns: metric columns returned (all of them by default).
+        """
+        positions = self.get_positions(filter_query, sort_by, top_k)
+        df = self.df.iloc[positions]
+        return df if columns is None else df[columns]
+
+    def top(self, column: str = PERFORMANCE_IMPROVEMENT, k: int = 10, ascending: bool = False,
+            filter_query: Optional[str] = None, columns: Optional[List[str]] = None) -> DataFrame:
+        """ Get the metrics of the `k` simulations with the highest (or lowest) value of a column. """
+        return self.query(filter_query, [{'column_id': column, 'direction': 'asc' if ascending else 'desc'}],
+                          k, columns)
+
+    @timed('metrics_query')
+    def get_positions(self, filter_query: Optional[str] = None, sort_by: Optional[List[dict]] = None,
+                      top_k: Optional[int] = None) -> np.ndarray:
+        """
+        Get the positions in `df` of the simulations that match a query, in order (see
+        `query`). The missing values are sorted last, and the ties keep the identifiers order.
+        """
+        mask = np.ones(len(self.df), dtype=bool)
+        for column, operator, value in split_filter_query(filter_query):
+            mask &= get_filter_mask(self.get_table(column), column, operator, value)
+        positions = np.flatnonzero(mask)
+        if not sort_by:
+            return positions[:top_k]
+        keys = [self.get_sort_key(sort_column['column_id'], sort_column['direction'] == 'asc')[positions]
+                for sort_column in sort_by]
+        if top_k is not None and len(keys) == 1:
+            return positions[get_smallest_positions(keys[0], top_k)]
+        # The last key of lexsort is the primary one.
+        return positions[np.lexsort(keys[::-1])][:top_k]
+
+    def get_table(self, column: str) -> DataFrame:
+        """ Get the table that has a column: the identifiers or the metrics. """
+        return self.identifiers if column in IDENTIFIER_COLUMNS else self.df
+
+    def get_sort_key(self, column: str, ascending: bool = True) -> np.ndarray:
+        """ Get the values of a column as floats, negated to sort it in descending order. """
+        if column not in IDENTIFIER_COLUMNS and column not in self.df.columns:
+            raise ValidationException(f'Unknown sort column {column}')
+        try:
+            key = self.get_table(column)[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        except (TypeError, ValueError) as error:
+            raise ValidationException(f'Column {column} can not be sorted') from error
+        return key if ascending else -key
+
+
+def load_metrics_index(data: Iterable[Mapping], mode: str = DATA_LOADING_MODE,
+                       input_path: str = DATA_FOLDER) -> MetricsIndex:
+    """
+    Build the index of the data loaded by `input_data.load_input_data`. In the 'lazy' mode,
+    the metrics are only in their files, so it is built from the data folder.
+    """
+    if mode == 'lazy':
+        return MetricsIndex.from_folder(input_path)
+    return MetricsIndex.from_data(data)
+
+
+def load_price_list_records(prices_folder: str, use_yaml_index: bool = YAML_INDEX
+                            ) -> Tuple[List[Tuple[int, int]], List[dict], List[str]]:
+    """
+    Load the metrics of the simulations of a `prices_N` folder, flattened (see `flatten_metrics`).
+    :return: a tuple (identifier keys, flattened metrics, messages describing the failures).
+    """
+    from nakamoto_explorer.files import load_yaml
+    from nakamoto_explorer.input_data import get_folder_idx, load_price_list_yaml
+
+    identifiers, records, failures = [], [], []
+    try:
+        _, rule_sets_yaml = load_price_list_yaml(prices_folder, use_yaml_index)
+    except (Exception, NakamotoExplorerException) as exception:
+        return identifiers, records, [f'{prices_folder}: {exception!r}']
+    price_list_idx = get_folder_idx(prices_folder)
+    for rule_set_folder, (metrics, _) in rule_sets_yaml.items():
+        try:
+            if metrics is None:
+                # Not indexed, or it failed: it is parsed again to get its error.
+                metrics = load_yaml(f'{prices_folder}/{rule_set_folder}/metrics.yml')
+            records.append(flatten_metrics(metrics))
+            identifiers.append((price_list_idx, get_folder_idx(rule_set_folder)))
+        except (Exception, NakamotoExplorerException) as exception:
+            failures.append(f'{prices_folder}/{rule_set_folder}: {exception!r}')
+    return identifiers, records, failures
+
+
+def flatten_metrics(metrics: Mapping, sections=METRIC_SECTIONS) -> dict:
+    """
+    Flatten the indexed metrics of a metrics file (the ones inside one of its `sections`)
+    into a dictionary {path: value}, with the keys of the path joined by dots.
+    """
+    flat_metrics = {}
+    add_section_metrics(flat_metrics, metrics, sections, '', False)
+    return flat_metrics
+
+
+def add_section_metrics(flat_metrics: dict, metrics: Mapping, sections, prefix: str, in_section: bool):
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            add_section_metrics(flat_metrics, value, sections, f'{prefix}{key}.', in_section or key in sections)
+        elif in_section:
+            flat_metrics[f'{prefix}{key}'] = value
+
+
+def get_typed_metrics_df(df: DataFrame) -> DataFrame:
+    """
+    Type the columns of a metrics DataFrame: the numbers as floats (the integer metrics
+    may be floats in other files) and the flags as booleans, nullable if a file lacks them.
+    """
+    typed_columns = {}
+    for column, values in df.items():
+        non_null_values = values.dropna()
+        if len(non_null_values) and all(isinstance(value, (bool, np.bool_)) for value in non_null_values):
+            typed_columns[column] = values.astype(bool if len(non_null_values) == len(values) else 'boolean')
+        elif values.dtype.kind in 'iufb' or len(non_null_values) == 0:
+            typed_columns[column] = values.astype(np.float64)
+        else:
+            typed_columns[column] = values
+    return DataFrame(typed_columns, index=df.index)
+
+
+def get_smallest_positions(key: np.ndarray, k: int) -> np.ndarray:
+    """
+    Get the positions of the `k` smallest values of a key in order, without sorting the
+    whole key. The missing values are the last ones, and the ties keep their order.
+    """
+    is_missing = np.isnan(key)
+    present = np.flatnonzero(~is_missing)
+    if k < len(present):
+        threshold = np.partition(key[present], k - 1)[k - 1]
+        present = present[key[present] <= threshold]
+    present = present[np.argsort(key[present], kind='stable')]
+    return np.concatenate([present, np.flatnonzero(is_missing)])[:k]
@@ -5,10 +5,13 @@ from dataclasses import dataclass, field
 from datetime import datetime as dt
 from enum import Enum
 from itertools import count
-from typing import Callable, Dict, List, Union
+from typing import Callable, Dict, Hashable, List, Optional, Union
 
 from pandas import DataFrame, Series, isna
 
+from nakamoto_explorer.cache import LRUCache
+from nakamoto_explorer.nakamoto import settings
+
 
 class RuleAction(Enum):
     """ Enum class to struct rule action types. """
@@ -48,14 +51,20 @@ class Rule(ABC):
     Other rules must inherit from this class.
     :param action: Rule action. Can only be 'sale' or 'purchase'.
     :param parameters: Rule specific parameters, as a dictionary.
+    Rules implement `apply_row`. The rules written before it, which implement `apply`
+    instead, are still supported: their `apply_at` calls their `apply`.
     """
     rule_class_id: int = 0
+    implements_apply: bool = False
     rule_class_id_counter = count(1)
     rule_actions_dict: Dict[RuleAction, str] = {RuleAction.SALE: 'sale',
                                                 RuleAction.PURCHASE: 'purchase'}
     parameters: dict = {}
 
     def __init__(self, rule_action: RuleAction, **parameters):
+        if not self.implements_apply:
+            raise TypeError(f"Can't instantiate rule {self.__class__.__name__}: "
+                            "it must implement apply_row (or apply)")
         self.rule_action: RuleAction = rule_action
         self.action: str = self.rule_actions_dict[rule_action]
         self.name: str = self.__class__.__name__
@@ -64,9 +73,14 @@ class Rule(ABC):
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
         cls.rule_class_id = next(cls.rule_class_id_counter)
+        overrides_apply = cls.apply is not Rule.apply
+        overrides_apply_row = cls.apply_row is not Rule.apply_row
+        cls.implements_apply = overrides_apply or overrides_apply_row
+        if overrides_apply and not overrides_apply_row and 'apply_at' not in cls.__dict__:
+            cls.apply_at = Rule.apply_at_index
 
-    def __call__(self, df: DataFrame = None) -> RuleData:
-        return self.check(df)
+    def __call__(self, df: DataFrame = None, fingerprint: Optional[Hashable] = None) -> RuleData:
+        return self.check(df, fingerprint=fingerprint)
 
     def __eq__(self, other):
         return self.data == other.data
@@ -84,35 +98,48 @@ class Rule(ABC):
     def as_dict(self) -> dict:
         return self.data.as_dict()
 
-    def check(self, df: DataFrame) -> RuleData:
-        mask = self.mask(df)
+    def check(self, df: DataFrame, fingerprint: Optional[Hashable] = None) -> RuleData:
+        mask = self.mask(df, fingerprint=fingerprint)
         return RuleData(action=self.action,
                         name=self.name,
                         parameters=self.parameters,
                         mask=mask,
                         apply=self.apply,
-                        first_feasible_index=mask.loc[mask].index[0] if sum(mask) > 0 else dt.max)
+                        first_feasible_index=mask.idxmax() if mask.any() else dt.max)
 
     def get_sorted_parameters(self) -> List[float]:
         return [self.parameters[parameter] for parameter in sorted(self.parameters.keys())]
 
-    def mask(self, df: DataFrame) -> Series:
+    def mask(self, df: DataFrame, fingerprint: Optional[Hashable] = None) -> Series:
         """
         Apply the defined mask to get the DataFrame rows where the rule can be applied.
         This function is common for all rules, and it includes base conditions that are
         not defined every time in the `define_mask` function.
         :param df: historical DataFrame.
+        :param fingerprint: value that identifies the content of `df` apart from its
+            `action` column. If given, the `define_mask` result is taken from the
+            `mask_cache`, so it is only computed once for equal rules on equal DataFrames.
         :return: a boolean pandas Series indicating in which row the rule can be applied.
         """
+        # The `action` dependent part is always computed: it changes every time a rule is tried.
         base_mask = isna(df['action'])
-        specific_mask = self.define_mask(df)
-        mask = specific_mask & base_mask
+        mask = self.specific_mask(df, fingerprint=fingerprint) & base_mask
         # Rule tries does NOT comes here. That will be done inside the main simulation
         # function (backtesting).
         # Take for instance the StablePurchase function. It can not be applied to the raw df.
         return mask
 
-    @abstractmethod
+    def specific_mask(self, df: DataFrame, fingerprint: Optional[Hashable] = None) -> Series:
+        """
+        Get the `define_mask` result, without the base conditions of `mask`. Enough for the
+        DataFrames without any action, as the backtesting windows.
+        :param df: historical DataFrame.
+        :param fingerprint: see `mask`.
+        """
+        if fingerprint is None:
+            return self.define_mask(df)
+        return mask_cache.get_mask(self, df, fingerprint)
+
     def apply(self, row_index: str, df: DataFrame) -> Union[Series, None]:
         """
         Function to apply the rule. The row_index must be one that fulfill the mask condition.
@@ -120,7 +147,29 @@ class Rule(ABC):
         :param df: historical DataFrame.
         :return: a pandas Series that will be a row containing the result of the applied rule.
         """
-        pass
+        return self.apply_row(select_input_row(row_index, df))
+
+    def apply_at(self, position: int, df: DataFrame) -> Union[Series, None]:
+        """
+        Apply the rule in the row of an integer position of the DataFrame. Faster than
+        `apply`, as the row does not need to be looked up by its index.
+        :param position: integer position of the row, which must fulfill the mask condition.
+        :param df: historical DataFrame.
+        :return: a pandas Series that will be a row containing the result of the applied rule.
+        """
+        return self.apply_row(df.iloc[position])
+
+    def apply_at_index(self, position: int, df: DataFrame) -> Union[Series, None]:
+        """ `apply_at` of the rules that only implement `apply`: the row is looked up by its index. """
+        return self.apply(df.index[position], df)
+
+    def apply_row(self, input_row: Series) -> Union[Series, None]:
+        """
+        Apply the rule to an already selected row.
+        :param input_row: row of the historical DataFrame that fulfills the mask condition.
+        :return: a pandas Series that will be a row containing the result of the applied rule.
+        """
+        raise NotImplementedError(f'{self.name} must implement apply_row (or apply)')
 
     @abstractmethod
     def define_mask(self, df: DataFrame) -> Series:
@@ -132,10 +181,48 @@ class Rule(ABC):
         pass
 
 
+class MaskCache:
+    """
+    Cache of rule specific masks (the `Rule.define_mask` results), keyed by
+    (DataFrame fingerprint, rule). Rules are identified by their class and parameters,
+    so equal rules of different rule sets share their masks.
+    :param max_size: maximum number of mask elements (rows) kept in the cache.
+    """
+
+    def __init__(self, max_size: int = settings.MASK_CACHE_SIZE):
+        self.cache = LRUCache(max_size, get_size=len)
+
+    def get_mask(self, rule: Rule, df: DataFrame, fingerprint: Hashable) -> Series:
+        return self.cache.get_or_load((fingerprint, rule), lambda: rule.define_mask(df))
+
+    def invalidate(self, fingerprint: Optional[Hashable] = None):
+        """
+        Remove the masks of a fingerprint (e.g. of a backtesting window, see
+        `SimulationState.get_window_fingerprint`), or every mask if it is None.
+        """
+        if fingerprint is None:
+            self.cache.clear()
+            return
+        for key in self.cache.keys():
+            if key[0] == fingerprint:
+                self.cache.pop(key)
+
+
+mask_cache = MaskCache()
+
+
 def select_input_row(row_index: str, df: DataFrame) -> Series:
     """
     Select the `row_index` of the input DataFrame, getting the first DataFrame row
     where its index is equal to row_index.
+    If the index is sorted (as the simulation DataFrames are), the row is found with a
+    binary search instead of comparing the whole index.
     """
+    if df.index.is_monotonic_increasing:
+        position = df.index.searchsorted(row_index, side='left')
+        # Compared as the full index would be (e.g. parsing string datetimes).
+        if not (df.index[position:position + 1] == row_index).any():
+            raise IndexError(f'{row_index = } not in the DataFrame index')
+        return df.iloc[position]
     input_row = df[df.index == row_index].iloc[0]
     return input_row
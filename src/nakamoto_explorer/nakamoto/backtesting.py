@@ -0,0 +1,353 @@
+from hashlib import sha1
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+from pandas import DataFrame, DatetimeIndex, Series, concat
+
+from nakamoto_explorer.nakamoto import Rule, settings
+from nakamoto_explorer.nakamoto.stop_rules import StopRule
+
+SIMULATION_COLUMNS = ['base_free', 'base-quote', 'base-quote_free', 'quote_free', 'base-commission',
+                      'commission_free', 'quote_value', 'price_change_pct', 'price_acc_pct_change',
+                      'base_free_change', 'quote_free_change', 'action', 'commission']
+OPERATION_TIME_DELTA = np.timedelta64(1, 'ms')
+
+
+class SimulationState:
+    """
+    State of an incremental simulation (streaming backtesting): new prices can be appended
+    at any time with `update`, which only simulates the new rows. The state keeps what the
+    new rows depend on: the last price, the balances, the accumulated price change since the
+    last action and whether a stop rule has ended the trading. The rules are stateless, so
+    they do not keep any state of their own.
+    The simulation jumps from one action to the next: the rule masks are evaluated on a
+    window of rows after the last action, and the first feasible row is applied. If no
+    rule is feasible, the window is doubled. When a rule is applied, the balances and the
+    accumulated price change are updated from the next row on. When several rules are
+    feasible in the same row, only the first one by priority (see `sort_rules_by_priority`)
+    is tried. If it can not be applied, the row is marked as `<rule name> failed`.
+    Once a stop rule is applied, no more rules are applied.
+    :param rule_set: dictionary {'rule_set': Set[Rule], 'stop_rules': Set[Rule]}.
+    :param adjust_inversion: whether to start with the same value in both assets, setting
+        the initial `quote_free` to `base_free` times the first price.
+    :param base_free: initial base asset.
+    :param quote_free: initial quote asset. Ignored if `adjust_inversion`.
+    :param commission_free: initial commission asset.
+    :param commission_price: base-commission price.
+    :param start: datetime of the first price.
+    :param time_step_seconds: seconds between prices.
+    :param name: name of the simulation, set as the columns name.
+    :param window_size: initial number of rows where the rule masks are evaluated.
+    :param use_mask_cache: whether to take the rule masks from the `nakamoto.mask_cache`.
+        Every window is identified by its prices and the values it is built from, so the
+        rule sets that run over the same price list share the masks of their common
+        windows (e.g. all of them until their first action). Hashing the windows is only
+        worth it if other rule sets run over the same price list in the same process.
+    """
+
+    def __init__(self, rule_set: Dict[str, Set[Rule]],
+                 adjust_inversion: bool = True,
+                 base_free: float = settings.INITIAL_BASE_FREE,
+                 quote_free: float = settings.INITIAL_QUOTE_FREE,
+                 commission_free: float = settings.INITIAL_COMMISSION_FREE,
+                 commission_price: float = settings.COMMISSION_PRICE,
+                 start: str = settings.SIMULATION_START,
+                 time_step_seconds: int = settings.SIMULATION_TIME_STEP_SECONDS,
+                 name: str = settings.SIMULATION_NAME,
+                 window_size: int = settings.BACKTESTING_WINDOW_SIZE,
+                 use_mask_cache: bool = settings.BACKTESTING_MASK_CACHE):
+        self.rules: List[Rule] = sort_rules_by_priority([*rule_set['rule_set'], *rule_set['stop_rules']])
+        self.adjust_inversion = adjust_inversion
+        self.base_free = base_free
+        self.quote_free = quote_free
+        self.commission_free = commission_free
+        self.commission_price = commission_price
+        self.start = np.datetime64(start, 'ns')
+        self.time_step = np.timedelta64(time_step_seconds, 's')
+        self.name = name
+        self.window_size = window_size
+        self.use_mask_cache = use_mask_cache
+
+        self.n_rows = 0
+        self.last_price = np.nan
+        # Accumulated price change since the last action, until the last row.
+        self.segment_acc = 0.
+        self.ended = False
+        self._chunks: List[DataFrame] = []
+
+    def __len__(self) -> int:
+        """ Number of prices simulated (the operation rows are not counted). """
+        return self.n_rows
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(rows={self.n_rows}, base_free={self.base_free}, '
+                f'quote_free={self.quote_free}, commission_free={self.commission_free}, '
+                f'ended={self.ended})')
+
+    @property
+    def simulation_df(self) -> DataFrame:
+        """ The complete simulation DataFrame, with the same format as the `simulation_df.csv` files. """
+        if not self._chunks:
+            return DataFrame(columns=SIMULATION_COLUMNS, index=DatetimeIndex([]))
+        if len(self._chunks) > 1:
+            df = concat(self._chunks)
+            df.columns.name = self.name
+            self._chunks = [df]
+        return self._chunks[0]
+
+    def update(self, prices: Union[Sequence[float], float]) -> DataFrame:
+        """
+        Simulate new prices, appending their rows to the simulation.
+        :param prices: one new price, or a sequence of them.
+        :return: the new rows of the simulation DataFrame.
+        """
+        prices = np.atleast_1d(np.asarray(prices, dtype=float))
+        n_rows = len(prices)
+        if n_rows == 0:
+            return self.simulation_df.iloc[:0]
+        index = self.start + np.arange(self.n_rows, self.n_rows + n_rows) * self.time_step
+        price_change_pct = get_price_change_pct(np.concatenate([[self.last_price], prices]))[1:]
+        acc_pct_change = np.full(n_rows, np.nan)
+        actions = np.full(n_rows, np.nan, dtype=object)
+        position = 0
+        if self.n_rows == 0:
+            if self.adjust_inversion:
+                self.quote_free = self.base_free * prices[0]
+            actions[0] = 'init'
+            position = 1
+        balance_changes = [(0, self.base_free, self.quote_free, self.commission_free)]
+        new_rows: List[Series] = []
+
+        window_frame = WindowFrame(index, prices, price_change_pct, self.commission_price) \
+            if self.rules else None
+        size = self.window_size
+        while position < n_rows and not self.ended:
+            end = min(n_rows, position + size)
+            window_acc, next_segment_acc = nan_cumsum(price_change_pct[position:end], self.segment_acc)
+            if self.rules:
+                window_df = window_frame.get_window(position, end, window_acc, self.base_free,
+                                                    self.quote_free, self.commission_free)
+                fingerprint = self.get_window_fingerprint(prices, position, end, index[position]) \
+                    if self.use_mask_cache else None
+                # The windows have no actions, so only the rule specific masks are needed.
+                masks = np.array([rule.specific_mask(window_df, fingerprint).to_numpy(dtype=bool)
+                                  for rule in self.rules])
+            else:
+                masks = np.zeros((0, end - position), dtype=bool)
+
+            applied = None
+            for row in np.flatnonzero(masks.any(axis=0)):
+                rule = self.rules[np.flatnonzero(masks[:, row])[0]]
+                new_row = rule.apply_at(row, window_df)
+                if new_row is None:
+                    actions[position + row] = f'{rule.name} failed'
+                    continue
+                applied = row, rule, new_row
+                break
+
+            if applied is None:
+                acc_pct_change[position:end] = window_acc
+                position, self.segment_acc, size = end, next_segment_acc, size * 2
+                continue
+
+            row, rule, new_row = applied
+            acc_pct_change[position:position + row + 1] = window_acc[:row + 1]
+            position += row
+            actions[position] = rule.name
+            self.base_free, self.quote_free, self.commission_free = \
+                new_row['base_free'], new_row['quote_free'], new_row['commission_free']
+            self.ended = isinstance(rule, StopRule)
+            new_rows.append(new_row)
+            balance_changes.append((position + 1, self.base_free, self.quote_free, self.commission_free))
+            position, self.segment_acc, size = position + 1, 0., self.window_size
+
+        window_frame = None  # Freed before the simulation DataFrame is built.
+        if position < n_rows:
+            acc_pct_change[position:], self.segment_acc = \
+                nan_cumsum(price_change_pct[position:], self.segment_acc)
+
+        operation_df = get_operation_df(new_rows, end_simulation=self.ended) if new_rows else None
+        df = get_simulation_df(index, prices, price_change_pct, acc_pct_change, actions,
+                               balance_changes, self.commission_price, operation_df)
+        df.columns.name = self.name
+        self.n_rows += n_rows
+        self.last_price = prices[-1]
+        self._chunks.append(df)
+        return df
+
+    def get_window_fingerprint(self, prices: np.ndarray, position: int, end: int,
+                               first_index: np.datetime64) -> tuple:
+        """
+        Get a value that identifies the content of a window DataFrame apart from its `action`
+        column, to cache the rule masks evaluated on it.
+        """
+        previous_price = prices[position - 1] if position > 0 else self.last_price
+        prices_hash = sha1(np.concatenate([[previous_price], prices[position:end]]).tobytes()).hexdigest()
+        return (prices_hash, first_index, self.time_step, self.base_free, self.quote_free,
+                self.commission_free, self.segment_acc, self.commission_price)
+
+
+class WindowFrame:
+    """
+    Simulation rows of the prices of an update, where the rule masks are evaluated. The
+    DataFrame is built once, and every window is an iloc view of it: its balances and
+    accumulated price change are written in place before it is returned, so no DataFrame
+    is built per window. A window is only valid until the next one is taken.
+    :param index: datetimes of the prices.
+    :param prices: base-quote prices.
+    :param price_change_pct: percent change of every price with respect to the previous one.
+    :param commission_price: base-commission price.
+    """
+    # The other columns (`base-commission` and `action`) are the same in every window, and
+    # keep their own dtype.
+    float_columns = ['base_free', 'base-quote', 'base-quote_free', 'quote_free', 'commission_free',
+                     'quote_value', 'price_change_pct', 'price_acc_pct_change', 'base_free_change',
+                     'quote_free_change', 'commission']
+
+    def __init__(self, index: np.ndarray, prices: np.ndarray, price_change_pct: np.ndarray,
+                 commission_price: float):
+        self.column_idx = {column: idx for idx, column in enumerate(self.float_columns)}
+        self.prices = prices
+        # Its DataFrame shares the memory of this array (one row per column, as pandas stores
+        # them). The balances and the accumulated price change are written by `get_window`.
+        self.values = np.empty((len(self.float_columns), len(prices)))
+        self.values[self.column_idx['base-quote']] = prices
+        self.values[self.column_idx['price_change_pct']] = price_change_pct
+        self.values[self.column_idx['base_free_change']] = 0.
+        self.values[self.column_idx['quote_free_change']] = 0.
+        self.values[self.column_idx['commission']] = np.nan
+        self.df = DataFrame(self.values.T, index=DatetimeIndex(index), columns=self.float_columns, copy=False)
+        self.df.insert(SIMULATION_COLUMNS.index('base-commission'), 'base-commission',
+                       np.full(len(prices), commission_price))
+        self.df.insert(SIMULATION_COLUMNS.index('action'), 'action', np.full(len(prices), np.nan, dtype=object))
+
+    def get_window(self, position: int, end: int, acc_pct_change: np.ndarray, base_free: float,
+                   quote_free: float, commission_free: float) -> DataFrame:
+        """ Get the rows from `position` to `end`, where the balances do not change. """
+        values = self.values[:, position:end]
+        base_quote_free = base_free * self.prices[position:end]
+        values[self.column_idx['base_free']] = base_free
+        values[self.column_idx['base-quote_free']] = base_quote_free
+        values[self.column_idx['quote_free']] = quote_free
+        values[self.column_idx['commission_free']] = commission_free
+        values[self.column_idx['quote_value']] = base_quote_free + quote_free
+        values[self.column_idx['price_acc_pct_change']] = acc_pct_change
+        return self.df.iloc[position:end]
+
+
+def backtest(price_list: Sequence[float], rule_set: Dict[str, Set[Rule]], **state_kwargs) -> DataFrame:
+    """
+    Simulate a rule set over a price list (backtesting).
+    :param price_list: base-quote prices, as in `historial_kwargs.yml`.
+    :param rule_set: dictionary {'rule_set': Set[Rule], 'stop_rules': Set[Rule]}.
+    :param state_kwargs: parameters of the SimulationState (initial conditions, etc.).
+    :return: the simulation DataFrame, with the same format as the `simulation_df.csv` files.
+    """
+    state = SimulationState(rule_set, **state_kwargs)
+    state.update(price_list)
+    return state.simulation_df
+
+
+def get_operation_df(new_rows: List[Series], end_simulation: bool = False) -> DataFrame:
+    """
+    Get the rows added to a simulation after the rules have been applied.
+    :param new_rows: rows returned by the applied rules, with the index of the rows where
+        they were applied.
+    :param end_simulation: whether to add an `end` row after the last operation row.
+    """
+    new_df = DataFrame(new_rows)
+    operation_df = new_df.copy()
+    operation_df.index = new_df.index + OPERATION_TIME_DELTA
+    operation_df['base-quote_free'] = operation_df['base_free'] * operation_df['base-quote']
+    operation_df['quote_value'] = operation_df['base-quote_free'] + operation_df['quote_free']
+    operation_df[['price_change_pct', 'price_acc_pct_change']] = np.nan
+    if not end_simulation:
+        return operation_df
+
+    end_df = new_df.iloc[-1:].copy()
+    end_df.index = end_df.index + 2 * OPERATION_TIME_DELTA
+    end_df[['price_change_pct', 'price_acc_pct_change', 'base_free_change', 'quote_free_change',
+            'commission']] = np.nan
+    end_df['action'] = 'end'
+    return concat([operation_df, end_df])
+
+
+def get_price_change_pct(prices: np.ndarray) -> np.ndarray:
+    """ Get the percent change of every price with respect to the previous one. """
+    price_change_pct = np.full(len(prices), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price_change_pct[1:] = prices[1:] / prices[:-1] - 1
+    return price_change_pct
+
+
+def get_simulation_df(index: np.ndarray, prices: np.ndarray, price_change_pct: np.ndarray,
+                      acc_pct_change: np.ndarray, actions: np.ndarray,
+                      balance_changes: List[Tuple[int, float, float, float]],
+                      commission_price: float, operation_df: Optional[DataFrame] = None) -> DataFrame:
+    """
+    Build the simulation DataFrame rows of the price list.
+    :param balance_changes: list of (first row, base_free, quote_free, commission_free),
+        with the balances from each row on.
+    :param operation_df: rows added after the applied rules (see `get_operation_df`), which
+        are inserted after the rows where they were applied.
+    """
+    first_rows, base_free, quote_free, commission_free = (np.array(values) for values
+                                                           in zip(*balance_changes))
+    balance_idx = np.searchsorted(first_rows, np.arange(len(prices)), side='right') - 1
+    base_free, quote_free = base_free[balance_idx], quote_free[balance_idx]
+    base_quote_free = base_free * prices
+    columns = {
+        'base_free': base_free,
+        'base-quote': prices,
+        'base-quote_free': base_quote_free,
+        'quote_free': quote_free,
+        'base-commission': commission_price,
+        'commission_free': commission_free[balance_idx],
+        'quote_value': base_quote_free + quote_free,
+        'price_change_pct': price_change_pct,
+        'price_acc_pct_change': acc_pct_change,
+        'base_free_change': 0.,
+        'quote_free_change': 0.,
+        'action': actions,
+        'commission': np.nan,
+    }
+    if operation_df is None:
+        return DataFrame(columns, index=DatetimeIndex(index))
+    # Inserted in the arrays, which is much faster than sorting the concatenated DataFrames.
+    positions = np.searchsorted(index, operation_df.index.to_numpy(), side='left')
+    columns = {name: insert_values(np.broadcast_to(values, len(prices)), positions, operation_df[name].to_numpy())
+               for name, values in columns.items()}
+    # The inserted arrays are new, so they are not copied again.
+    return DataFrame(columns, index=DatetimeIndex(np.insert(index, positions, operation_df.index.to_numpy())),
+                     copy=False)
+
+
+def insert_values(values: np.ndarray, positions: np.ndarray, inserted: np.ndarray) -> np.ndarray:
+    """ Insert values before the given positions (as `np.insert`), upcasting to fit both arrays. """
+    dtype = np.result_type(values.dtype, inserted.dtype)
+    return np.insert(values.astype(dtype, copy=False), positions, inserted.astype(dtype, copy=False))
+
+
+def nan_cumsum(values: np.ndarray, initial: float = 0.) -> Tuple[np.ndarray, float]:
+    """
+    Cumulative sum skipping NaNs, which are kept as NaN (as pandas `cumsum` does).
+    :param values: values to sum.
+    :param initial: value the sum starts from, to continue a previous cumulative sum.
+    :return: a tuple (cumulative sum, final value of the sum ignoring NaNs).
+    """
+    cumsum = np.nancumsum(np.concatenate([[initial], values]))
+    final_value = cumsum[-1]
+    cumsum = cumsum[1:]
+    cumsum[np.isnan(values)] = np.nan
+    return cumsum, final_value
+
+
+def sort_rules_by_priority(rules: List[Rule]) -> List[Rule]:
+    """
+    Sort the rules by the priority used when several of them are feasible in the same row:
+    stop rules first, and then the ones with the highest parameters (e.g. the highest
+    `hold_percent`, which makes the most conservative operation).
+    """
+    return sorted(rules, key=lambda rule: (not isinstance(rule, StopRule),
+                                           [-parameter for parameter in rule.get_sorted_parameters()],
+                                           rule.name))
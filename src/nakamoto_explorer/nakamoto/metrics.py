@@ -0,0 +1,168 @@
+from typing import Dict, List, Sequence, Union
+
+import numpy as np
+from pandas import DataFrame, concat
+
+from nakamoto_explorer.exceptions import ValidationException
+from nakamoto_explorer.nakamoto.backtesting import backtest
+
+# Actions of the operation rows added after a rule is applied. The other actions
+# (including failed rules and `end`) are counted as rules applied.
+OPERATION_ACTIONS = ['sale', 'purchase']
+NON_RULE_ACTIONS = ['init', *OPERATION_ACTIONS]
+MAIN_METRICS = ['performance', 'base_shares_performance', 'quote_shares_performance', 'profit',
+                'base_shares_profit', 'quote_shares_profit', 'accumulated_commission',
+                'all_commissions']
+STATS_METRICS = ['base-quote_var', 'base-commission_var', 'base_max', 'base_min', 'base_var',
+                 'quote_max', 'quote_min', 'quote_var']
+
+
+def get_metrics(simulation_df: DataFrame, no_rules_df: DataFrame) -> dict:
+    """
+    Get the metrics of a simulation, with the same format as the `metrics.yml` files.
+    :param simulation_df: simulation DataFrame.
+    :param no_rules_df: simulation DataFrame of the same price list without rules (see
+        `get_no_rules_df`), which the simulation is compared with.
+    """
+    return get_metrics_batch([simulation_df], [no_rules_df])[0]
+
+
+def get_metrics_batch(simulation_dfs: Sequence[DataFrame],
+                      no_rules_dfs: Union[Sequence[DataFrame], DataFrame]) -> List[dict]:
+    """
+    Get the metrics of several simulations at once. All of them are reduced together in
+    a single columnar table, so it is much faster than calling `get_metrics` on each one.
+    :param simulation_dfs: simulation DataFrames.
+    :param no_rules_dfs: simulation DataFrame without rules of every simulation, or a
+        single one if all the simulations share the same price list.
+    :return: the metrics of every simulation, in the same order.
+    """
+    if isinstance(no_rules_dfs, DataFrame):
+        no_rules_dfs = [no_rules_dfs] * len(simulation_dfs)
+    if len(no_rules_dfs) != len(simulation_dfs):
+        raise ValidationException(f'{len(simulation_dfs)} simulations but {len(no_rules_dfs)} '
+                                  f'no rules simulations')
+    if not simulation_dfs:
+        return []
+
+    simulation_metrics = get_simulation_metrics_table(simulation_dfs)
+    # The no rules simulations are usually the same object, so they are only reduced once.
+    unique_no_rules = {id(df): df for df in no_rules_dfs}
+    unique_no_rules_metrics = get_simulation_metrics_table(list(unique_no_rules.values()))
+    unique_no_rules_metrics.index = list(unique_no_rules.keys())
+    no_rules_metrics = unique_no_rules_metrics.loc[[id(df) for df in no_rules_dfs]]
+    no_rules_metrics.index = simulation_metrics.index
+
+    numeric_metrics = MAIN_METRICS + STATS_METRICS
+    absolute_diffs = simulation_metrics[numeric_metrics] - no_rules_metrics[numeric_metrics]
+    percent_diffs = get_percent_diffs(absolute_diffs, no_rules_metrics[numeric_metrics])
+    both_shares_improves_diffs = simulation_metrics['both_shares_improves'] & \
+        ~no_rules_metrics['both_shares_improves']
+
+    metrics_list = []
+    for no_rules_row, simulation_row, absolute_diffs_row, percent_diffs_row, both_shares_improves \
+            in zip(no_rules_metrics.to_dict('records'), simulation_metrics.to_dict('records'),
+                   absolute_diffs.to_dict('records'), percent_diffs.to_dict('records'),
+                   both_shares_improves_diffs.tolist()):
+        metrics_list.append({
+            'no_rules_metrics': table_row_to_metrics(no_rules_row),
+            'simulation_metrics': table_row_to_metrics(simulation_row),
+            'improvement_metrics': {
+                'absolute_diffs': table_row_to_metrics(absolute_diffs_row, numeric_only=True),
+                'percent_diffs': table_row_to_metrics(percent_diffs_row, numeric_only=True),
+                'strategy_diffs': {'both_shares_improves': bool(both_shares_improves)}}})
+    return metrics_list
+
+
+def get_no_rules_df(historial_kwargs: dict) -> DataFrame:
+    """ Get the simulation DataFrame without rules of a price list, as in `historial_kwargs.yml`. """
+    return backtest(historial_kwargs['price_list'], {'rule_set': set(), 'stop_rules': set()},
+                    adjust_inversion=historial_kwargs.get('adjust_inversion', True))
+
+
+def get_percent_diffs(absolute_diffs: DataFrame, reference: DataFrame) -> DataFrame:
+    """
+    Get the relative differences with respect to a reference. When the reference is zero,
+    the difference is +-inf, or 0 if there is no difference.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent_diffs = absolute_diffs / reference
+    zero_reference = reference == 0
+    percent_diffs[zero_reference] = np.sign(absolute_diffs[zero_reference]) * np.inf
+    percent_diffs[zero_reference & (absolute_diffs == 0)] = 0
+    return percent_diffs
+
+
+def get_rules_metrics(df: DataFrame) -> List[dict]:
+    """
+    Get the rules metrics of several simulations from their `action` column.
+    :param df: concatenated simulation DataFrames, with the simulation as first index level.
+    :return: the rules metrics of every simulation, in order of appearance.
+    """
+    # As `value_counts` of every simulation: by descending count, and ties by appearance.
+    counts = df.groupby([df.index.get_level_values('simulation'), df['action']], sort=False).size()
+    counts = counts.rename('count').reset_index() \
+        .sort_values(['simulation', 'count'], ascending=[True, False], kind='mergesort')
+
+    rules_metrics = {simulation: {'n_distinct_rules_applied': 0, 'n_rules_applied': 0, 'n_sales': 0,
+                                  'n_purchases': 0, 'rules_count': {}}
+                     for simulation in df.index.get_level_values('simulation').unique()}
+    for simulation, action, count in zip(counts['simulation'].tolist(), counts['action'].tolist(),
+                                         counts['count'].tolist()):
+        simulation_rules_metrics = rules_metrics[simulation]
+        simulation_rules_metrics['rules_count'][action] = count
+        if action == 'sale':
+            simulation_rules_metrics['n_sales'] = count
+        elif action == 'purchase':
+            simulation_rules_metrics['n_purchases'] = count
+        if action not in NON_RULE_ACTIONS:
+            simulation_rules_metrics['n_distinct_rules_applied'] += 1
+            simulation_rules_metrics['n_rules_applied'] += count
+    return list(rules_metrics.values())
+
+
+def get_simulation_metrics_table(simulation_dfs: Sequence[DataFrame]) -> DataFrame:
+    """
+    Get the metrics of several simulations (without comparing them with anything), as a
+    table with one row per simulation and one column per metric. The `rules` metrics are
+    stored as dictionaries in the `rules` column.
+    """
+    df = concat(simulation_dfs, keys=range(len(simulation_dfs)), names=['simulation', None])
+    simulations = df.groupby(level='simulation', sort=False)
+    balance_columns = ['base_free', 'quote_free', 'commission_free', 'quote_value']
+    initial, final = simulations[balance_columns].first(), simulations[balance_columns].last()
+    # The variances skip the operation rows, the extremes take every row.
+    price_rows = df[~df['action'].isin(OPERATION_ACTIONS)].groupby(level='simulation', sort=False)
+    variances = price_rows[['base-quote_free', 'base-commission', 'base_free', 'quote_free']].var()
+
+    table = DataFrame(index=initial.index)
+    table['profit'] = final['quote_value'] - initial['quote_value']
+    table['performance'] = table['profit'] / initial['quote_value']
+    table['base_shares_profit'] = final['base_free'] - initial['base_free']
+    table['base_shares_performance'] = table['base_shares_profit'] / initial['base_free']
+    table['quote_shares_profit'] = final['quote_free'] - initial['quote_free']
+    table['quote_shares_performance'] = table['quote_shares_profit'] / initial['quote_free']
+    table['accumulated_commission'] = final['commission_free'] - initial['commission_free']
+    table['all_commissions'] = simulations['commission'].sum()
+    table['base-quote_var'] = variances['base-quote_free']
+    table['base-commission_var'] = variances['base-commission']
+    table['base_max'] = simulations['base_free'].max()
+    table['base_min'] = simulations['base_free'].min()
+    table['base_var'] = variances['base_free']
+    table['quote_max'] = simulations['quote_free'].max()
+    table['quote_min'] = simulations['quote_free'].min()
+    table['quote_var'] = variances['quote_free']
+    table['both_shares_improves'] = (table['base_shares_profit'] > 0) & (table['quote_shares_profit'] > 0)
+    table['rules'] = get_rules_metrics(df)
+    return table
+
+
+def table_row_to_metrics(row: dict, numeric_only: bool = False) -> Dict[str, dict]:
+    """ Get a metrics table row with the `metrics.yml` structure, with built-in Python types (to dump it to YAML). """
+    metrics = {'main': {metric: float(row[metric]) for metric in MAIN_METRICS},
+               'stats': {metric: float(row[metric]) for metric in STATS_METRICS}}
+    if numeric_only:
+        return metrics
+    metrics['rules'] = row['rules']
+    metrics['strategy'] = {'both_shares_improves': bool(row['both_shares_improves'])}
+    return metrics
@@ -2,7 +2,7 @@ from typing import Union
 
 import pandas as pd
 
-from nakamoto_explorer.nakamoto import Rule, RuleAction, select_input_row, settings
+from nakamoto_explorer.nakamoto import Rule, RuleAction, settings
 from nakamoto_explorer.nakamoto.simulations import simulate_sale, simulate_purchase
 
 
@@ -19,8 +19,7 @@ class MarginSale(Rule):
                          margin_threshold=margin_threshold,
                          hold_percent=hold_percent)
 
-    def apply(self, row_index: str, df: pd.DataFrame) -> Union[pd.Series, None]:
-        input_row = select_input_row(row_index, df)
+    def apply_row(self, input_row: pd.Series) -> Union[pd.Series, None]:
         base_to_sell = input_row['base_free'] * input_row['price_acc_pct_change'] * \
             (1 - self.parameters['hold_percent'])
         return simulate_sale(input_row, base_to_sell, raise_exception=False)
@@ -43,8 +42,7 @@ class MarginPurchase(Rule):
                          margin_threshold=margin_threshold,
                          hold_percent=hold_percent)
 
-    def apply(self, row_index: str, df: pd.DataFrame) -> Union[pd.Series, None]:
-        input_row = select_input_row(row_index, df)
+    def apply_row(self, input_row: pd.Series) -> Union[pd.Series, None]:
         base_to_purchase = input_row['base_free'] * (- input_row['price_acc_pct_change']) * \
             (1 - self.parameters['hold_percent'])
         return simulate_purchase(input_row, base_to_purchase, raise_exception=False)
@@ -8,3 +8,21 @@ DEFAULT_DYNAMIC_STOP_LOSS = True
 DEFAULT_DYNAMIC_TAKE_PROFIT = False
 DEFAULT_PERCENT_STOP_LOST = .3
 DEFAULT_PERCENT_TAKE_PROFIT = 3
+
+# Backtesting initial conditions
+INITIAL_BASE_FREE = 1
+INITIAL_QUOTE_FREE = 1
+INITIAL_COMMISSION_FREE = 100
+COMMISSION_PRICE = 1
+SIMULATION_START = '2022-01-01 00:00:00'
+SIMULATION_TIME_STEP_SECONDS = 3600
+SIMULATION_NAME = 'base_test-quote_test|commission_test'
+# First number of rows where the rule masks are evaluated after an action. It is doubled
+# every time no action is found, until the end of the price list.
+BACKTESTING_WINDOW_SIZE = 1024
+# Whether the backtests take the rule masks from the `mask_cache`. Hashing every window only
+# pays off when several rule sets run over the same price list (e.g. in a sweep), so the
+# ones that do enable it.
+BACKTESTING_MASK_CACHE = False
+# Maximum number of mask elements (rows) kept in the rule masks cache.
+MASK_CACHE_SIZE = 10_000_000
@@ -1,12 +1,33 @@
+from dataclasses import dataclass
 from operator import itemgetter
-from typing import Dict, Optional
+from typing import Dict, List, Mapping, Optional, Sequence, Union
 
+import numpy as np
 from pandas import Series
 
 from nakamoto_explorer.exceptions import SimulationException, ValidationException
 from nakamoto_explorer.nakamoto import settings
 
 
+OPERATION_INPUT_COLUMNS = ['base_free', 'quote_free', 'commission_free', 'base-quote', 'base-commission']
+
+
+@dataclass
+class OperationBatch:
+    """
+    Result of simulating several operations at once. Every attribute has one element
+    per operation. The balances of the invalid operations are not meaningful.
+    """
+    base_free: np.ndarray
+    quote_free: np.ndarray
+    commission_free: np.ndarray
+    commission: np.ndarray
+    valid: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.valid)
+
+
 def simulate_purchase(input_row: Series, base_to_purchase: float,
                       commission_percent: float = settings.COMMISSION,
                       raise_exception: bool = True) -> Optional[Series]:
@@ -68,6 +89,69 @@ def simulate_sale(input_row: Series, base_to_sell: float,
     return new_row
 
 
+def simulate_purchases(input_rows: Mapping[str, Sequence[float]],
+                       base_to_purchase: Union[Sequence[float], float],
+                       commission_percent: float = settings.COMMISSION) -> OperationBatch:
+    """
+    Simulate several purchase operations at once (vectorized `simulate_purchase`).
+    :param input_rows: rows where the purchases are applied, as a DataFrame or any mapping
+        of the `OPERATION_INPUT_COLUMNS` to arrays.
+    :param base_to_purchase: base to be purchased in every row.
+    :param commission_percent: commission percent that will be applied once the operations are done.
+    :return: the new balances and commissions, and the mask of the operations that can be done.
+    """
+    base_free, quote_free, commission_free, base_quote, base_commission = get_operation_inputs(input_rows)
+    base_to_purchase = np.broadcast_to(np.asarray(base_to_purchase, dtype=float), base_free.shape)
+    commission = base_to_purchase * commission_percent * base_commission
+    return get_operation_batch(base_to_purchase,
+                               base_free=base_free + base_to_purchase,
+                               quote_free=quote_free - base_to_purchase * base_quote,
+                               commission_free=commission_free - commission,
+                               commission=commission)
+
+
+def simulate_sales(input_rows: Mapping[str, Sequence[float]],
+                   base_to_sell: Union[Sequence[float], float],
+                   commission_percent: float = settings.COMMISSION) -> OperationBatch:
+    """
+    Simulate several sale operations at once (vectorized `simulate_sale`).
+    :param input_rows: rows where the sales are applied, as a DataFrame or any mapping
+        of the `OPERATION_INPUT_COLUMNS` to arrays.
+    :param base_to_sell: base to be sold in every row.
+    :param commission_percent: commission percent that will be applied once the operations are done.
+    :return: the new balances and commissions, and the mask of the operations that can be done.
+    """
+    base_free, quote_free, commission_free, base_quote, base_commission = get_operation_inputs(input_rows)
+    base_to_sell = np.broadcast_to(np.asarray(base_to_sell, dtype=float), base_free.shape)
+    commission = base_to_sell * commission_percent * base_commission
+    return get_operation_batch(base_to_sell,
+                               base_free=base_free - base_to_sell,
+                               quote_free=quote_free + base_to_sell * base_quote,
+                               commission_free=commission_free - commission,
+                               commission=commission)
+
+
+def get_operation_batch(amount: np.ndarray, base_free: np.ndarray, quote_free: np.ndarray,
+                        commission_free: np.ndarray, commission: np.ndarray) -> OperationBatch:
+    """
+    Build the OperationBatch of some operations, checking them as `update_operation_row`
+    does: the amount must be positive and the new balances non-negative.
+    """
+    # Written as negated failure conditions to behave as the single row checks with NaNs.
+    valid = ~(amount <= 0) & ~(base_free < 0) & ~(quote_free < 0) & ~(commission_free < 0)
+    return OperationBatch(base_free=base_free, quote_free=quote_free,
+                          commission_free=commission_free, commission=commission, valid=valid)
+
+
+def get_operation_inputs(input_rows: Mapping[str, Sequence[float]]) -> List[np.ndarray]:
+    """ Get the `OPERATION_INPUT_COLUMNS` of some rows as float arrays. """
+    try:
+        return [np.asarray(input_rows[column], dtype=float) for column in OPERATION_INPUT_COLUMNS]
+    except KeyError as error:
+        raise ValidationException(f'Missing operation input column {error} '
+                                  f'(required: {OPERATION_INPUT_COLUMNS})')
+
+
 def update_operation_row(operation_row: Series, operation_dict: Dict[str, float],
                          action: str, simulation_params: Dict[str, float],
                          # ensure_input_row: bool = True,
@@ -2,15 +2,14 @@ from typing import Union
 
 from pandas import DataFrame, Series
 
-from nakamoto_explorer.nakamoto import Rule, RuleAction, select_input_row
+from nakamoto_explorer.nakamoto import Rule, RuleAction
 from nakamoto_explorer.nakamoto.simulations import simulate_sale
 from nakamoto_explorer.exceptions import ValidationException
 
 
 class StopRule(Rule):
 
-    def apply(self, row_index: str, df: DataFrame) -> Union[Series, None]:
-        input_row = select_input_row(row_index, df)
+    def apply_row(self, input_row: Series) -> Union[Series, None]:
         # TODO 2022.01.28 Add handling actions if there is not enough commission asset to do this.
         base_to_sell = input_row['base_free']
         return simulate_sale(input_row, base_to_sell, raise_exception=False)
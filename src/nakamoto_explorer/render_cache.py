@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps
+from logging import getLogger
+from threading import Lock
+from typing import Hashable, List, Mapping, Optional, Set, Tuple
+
+import numpy as np
+from pandas import DataFrame
+
+from nakamoto_explorer import renders
+from nakamoto_explorer.cache import LRUCache
+from nakamoto_explorer.catalog import SimulationCatalog, get_identifier_key
+from nakamoto_explorer.downsampling import DownsamplingPyramid
+from nakamoto_explorer.exceptions import NakamotoExplorerException
+from nakamoto_explorer.input_data import get_simulation_size
+from nakamoto_explorer.instrumentation import timed
+from nakamoto_explorer.settings import (DOWNSAMPLING_MAX_POINTS, RENDER_CACHE_SIZE,
+                                        RENDER_CACHE_WARM_NEIGHBOURS)
+from nakamoto_explorer.table_queries import query_positions
+
+logger = getLogger(__name__)
+
+
+class RenderCache:
+    """
+    Cache of the rendered components of the simulations, so going back to an already
+    seen simulation does not render it again.
+    The components are keyed by the simulation identifier and the catalog version, so
+    they are not reused if the data is reloaded. Their size is approximated by the memory
+    of the simulation DataFrame they are rendered from, which they are proportional to.
+    The downsampling pyramids of the long simulations are cached too, to draw their
+    line graphs at any zoom level, and the rows of their last DataTable queries, to
+    change between their pages.
+    :param max_size: maximum total size of the cached components, in bytes.
+    :param warm_neighbours: number of simulations before and after the requested one
+        that are rendered in a background thread (0 to disable it), so they are already
+        cached when the Prev / Next buttons are used.
+    """
+
+    def __init__(self, max_size: int = RENDER_CACHE_SIZE,
+                 warm_neighbours: int = RENDER_CACHE_WARM_NEIGHBOURS):
+        self.cache = LRUCache(max_size, get_size=lambda components_and_size: components_and_size[1])
+        self.pyramids = LRUCache(max_size, get_size=lambda pyramid: pyramid.nbytes if pyramid else 1)
+        self.table_positions = LRUCache(max_size, get_size=lambda positions: positions.nbytes)
+        self.warm_neighbours = warm_neighbours
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='render-cache') \
+            if warm_neighbours > 0 else None
+        self._pending: Set[Hashable] = set()
+        self._pending_lock = Lock()
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.cache})'
+
+    def get_components(self, data: SimulationCatalog, idx: int) -> dict:
+        """
+        Get the rendered components of a simulation (see `renders.render_simulation`),
+        and warm the cache with its neighbours.
+        :param data: loaded data.
+        :param idx: position of the simulation in the data.
+        """
+        components = self.load(data, idx)
+        self.warm(data, idx)
+        return components
+
+    def get_pyramid(self, data: SimulationCatalog, idx: int) -> Optional[DownsamplingPyramid]:
+        """ Get the downsampling pyramid of a simulation, or None if it is not long enough to need it. """
+        data_element = data[idx]
+        return self.pyramids.get_or_load(get_render_key(data, data_element),
+                                         lambda: get_pyramid(data_element['simulation_df']))
+
+    def get_table_positions(self, data: SimulationCatalog, idx: int, sort_by: Optional[List[dict]] = None,
+                            filter_query: Optional[str] = None) -> np.ndarray:
+        """ Get the rows of a simulation that match a DataTable query (see `table_queries.query_positions`). """
+        data_element = data[idx]
+        query_key = (dumps(sort_by or [], sort_keys=True), filter_query or '')
+        return self.table_positions.get_or_load(
+            (*get_render_key(data, data_element), query_key),
+            lambda: query_positions(data_element['simulation_df'], sort_by, filter_query))
+
+    def load(self, data: SimulationCatalog, idx: int) -> dict:
+        data_element = data[idx]
+        return self.cache.get_or_load(
+            get_render_key(data, data_element),
+            lambda: render_with_size(data_element, self.get_pyramid(data, idx)))[0]
+
+    def warm(self, data: SimulationCatalog, idx: int):
+        """ Render the neighbours of a simulation in the background, if they are not cached. """
+        if self._executor is None or len(data) <= 1:
+            return
+        for distance in range(1, self.warm_neighbours + 1):
+            for step in (distance, -distance):
+                neighbour_idx = data.get_neighbour_idx(idx, step)
+                key = get_render_key(data, data[neighbour_idx])
+                with self._pending_lock:
+                    if key in self.cache or key in self._pending:
+                        continue
+                    self._pending.add(key)
+                self._executor.submit(self._warm_one, data, neighbour_idx, key)
+
+    def _warm_one(self, data: SimulationCatalog, idx: int, key: Hashable):
+        try:
+            self.load(data, idx)
+        except (Exception, NakamotoExplorerException) as error:
+            logger.warning(f'Simulation {key} could not be rendered in the background: {error!r}')
+        finally:
+            with self._pending_lock:
+                self._pending.discard(key)
+
+
+def get_render_key(data: SimulationCatalog, data_element: Mapping) -> Tuple[int, Tuple[int, int]]:
+    return data.version, get_identifier_key(data_element)
+
+
+@timed('build_pyramid')
+def get_pyramid(simulation_df: DataFrame, max_points: int = DOWNSAMPLING_MAX_POINTS
+                ) -> Optional[DownsamplingPyramid]:
+    """ Get the downsampling pyramid of a simulation, if it has more than `max_points` rows. """
+    if len(simulation_df) <= max_points:
+        return None
+    return DownsamplingPyramid(simulation_df, max_points)
+
+
+def render_with_size(data_element: Mapping, pyramid: Optional[DownsamplingPyramid] = None
+                     ) -> Tuple[dict, int]:
+    """ Render a simulation, returning also the size used for it in the cache. """
+    return renders.render_simulation(data_element, pyramid), get_simulation_size(data_element)
@@ -1,17 +1,28 @@
 
 from json import dumps
 from operator import itemgetter
-from typing import Dict, List, Set
+from typing import Dict, List, Mapping, Optional, Set, Tuple
 
 from dash.dash_table import DataTable
 from dash.dcc import Graph, Tabs, Tab
-from dash import html
+from dash import Patch, html
+import numpy as np
 from pandas import DataFrame
 import plotly.graph_objects as go
 
 from nakamoto_explorer.nakamoto import Rule
 
 from nakamoto_explorer import styles, utils
+from nakamoto_explorer.downsampling import DownsamplingPyramid
+from nakamoto_explorer.exceptions import ValidationException
+from nakamoto_explorer.instrumentation import timed
+from nakamoto_explorer.metrics_index import LEADERBOARD_COLUMNS, PERFORMANCE_IMPROVEMENT, MetricsIndex
+from nakamoto_explorer.settings import (ACTION_MARKERS_MODE, ACTION_SHAPES_MAX, LEADERBOARD_PAGE_SIZE,
+                                        SIMULATION_TABLE_PAGE_SIZE, WEBGL_ROWS_THRESHOLD)
+from nakamoto_explorer.table_queries import get_page_positions
+
+# Layout properties that differ between the figures of `render_simulation_figure`.
+FIGURE_PATCHED_LAYOUT_KEYS = ['title', 'hovermode', 'uirevision', 'shapes', 'xaxis', 'yaxis2']
 
 
 def render_dict(dictionary: dict, indent: int = 4, format_zeros: bool = True,
@@ -69,6 +80,7 @@ def render_sub_metrics_tabs(metrics: dict) -> Tabs:
         )
 
 
+@timed()
 def render_metrics(metrics: dict) -> html.Div:
     """ Render Nakamoto metrics into a Tabs section. """
     no_rules, simulation, improvement = itemgetter(
@@ -143,9 +155,97 @@ def render_metrics(metrics: dict) -> html.Div:
         )
 
 
-def render_simulation_line_graphs(df: DataFrame) -> html.Div:
-    """ Render a Nakamoto line-plot of price-list + performance data. """
+@timed()
+def render_simulation(data_element: Mapping, pyramid: Optional[DownsamplingPyramid] = None) -> dict:
+    """
+    Render the components of a simulation data element.
+    :param pyramid: downsampling pyramid of the simulation, for long simulations. If given,
+        only its coarsest level is drawn, and finer ones are requested when zooming.
+    :return: a dictionary with the simulation 'table', the 'figure' of its line graphs,
+        its 'metrics' and the children of the `rule-sets` Div.
+    """
+    return {
+        'table': render_simulation_df(data_element['simulation_df']),
+        'figure': render_simulation_figure(data_element['simulation_df'],
+                                           pyramid.get_positions() if pyramid is not None else None),
+        'metrics': render_metrics(data_element['metrics']),
+        'rule_sets': [
+            html.Div(
+                className='rule-sets',
+                children=[
+                    render_rule_set(data_element['rule_set_kwargs'])
+                ])]
+    }
+
+
+def render_content(components: dict) -> list:
+    """
+    Render the children of the `content` Div from the components of a simulation (see
+    `render_simulation`). They are kept mounted, and the app callbacks update their properties.
+    """
+    return [
+        html.Div(
+            className='main-table',
+            children=[components['table']],
+        ),
+        html.Div(
+            className='price-list',
+            children=[Graph(id='simulation-graph', figure=components['figure'])]
+        ),
+        html.Div(
+            id='metrics',
+            children=[components['metrics']]
+        )]
+
 
+@timed()
+def get_simulation_payload(components: dict) -> dict:
+    """
+    Get the components of a simulation (see `render_simulation`) that the client navigation
+    needs to show it: the properties updated by `renderSimulation` (see `assets/navigation.js`).
+    """
+    table = components['table']
+    return {
+        'metrics': [components['metrics']],
+        'rule_sets': components['rule_sets'],
+        'figure': components['figure'],
+        'table': {'data': table.data, 'tooltip_data': table.tooltip_data, 'page_count': table.page_count}
+    }
+
+
+@timed()
+def get_figure_patch(figure: go.Figure) -> Patch:
+    """
+    Get the partial update that replaces a figure rendered by `render_simulation_figure`
+    with another one. Its layout template, which is the same for all of them, is not sent.
+    """
+    figure_json = figure.to_plotly_json()
+    patch = Patch()
+    patch['data'] = figure_json['data']
+    for key in FIGURE_PATCHED_LAYOUT_KEYS:
+        if key in figure_json['layout']:
+            patch['layout'][key] = figure_json['layout'][key]
+        else:
+            del patch['layout'][key]
+    return patch
+
+
+@timed()
+def render_simulation_figure(df: DataFrame, positions: Optional[np.ndarray] = None,
+                             x_range: Optional[Tuple[str, str]] = None,
+                             markers_mode: str = ACTION_MARKERS_MODE) -> go.Figure:
+    """
+    Render the figure of the simulation line-plot.
+    :param df: simulation DataFrame.
+    :param positions: positions of the rows drawn in the price and performance lines
+        (see `downsampling.DownsamplingPyramid`). All of them if None.
+    :param x_range: time window shown, or None to show everything.
+    :param markers_mode: how the vertical lines of the actions are drawn. 'shapes' adds a
+        layout shape per action. 'batched' draws all the lines of a color as a single trace,
+        which is much faster with many actions. 'auto' uses 'shapes' only if there are at
+        most ACTION_SHAPES_MAX actions.
+    """
+    name = df.columns.name
     df = df.copy()
     df['datetime'] = df.index
     # Reduce columns to the ones needed
@@ -155,17 +255,27 @@ def render_simulation_line_graphs(df: DataFrame) -> html.Div:
     actions = df['action'].value_counts().index
     discarded_actions = ['init', 'end', 'sale', 'purchase']
     actions = [a for a in actions if a not in discarded_actions]
+    if markers_mode == 'auto':
+        n_markers = df['action'].isin(actions).sum()
+        markers_mode = 'shapes' if n_markers <= ACTION_SHAPES_MAX else 'batched'
+    if markers_mode not in ('shapes', 'batched'):
+        raise ValidationException(f'Unknown {markers_mode = }')
+    lines_df = df if positions is None else df.iloc[positions]
+    # WebGL is much faster with many points, but SVG looks better and works everywhere.
+    scatter = go.Scattergl if lines_df.shape[0] > WEBGL_ROWS_THRESHOLD else go.Scatter
 
     fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=df['datetime'], y=df['base-quote'], mode='lines+markers', name='price',
+    fig.add_trace(scatter(
+        x=lines_df['datetime'], y=lines_df['base-quote'], mode='lines+markers', name='price',
         line={'color': styles.DARK_VIOLET}
     ))
-    fig.add_trace(go.Scatter(
-        x=df['datetime'], y=df['quote_value'], mode='lines+markers', name='performance',
+    fig.add_trace(scatter(
+        x=lines_df['datetime'], y=lines_df['quote_value'], mode='lines+markers', name='performance',
         line={'color': styles.GREEN if improve else styles.BRIGHT_RED}
     ))
 
+    color_datetimes: Dict[str, list] = {}
+    shapes: List[dict] = []
     for action in actions:
 
         if 'failed' in action:
@@ -180,19 +290,37 @@ def render_simulation_line_graphs(df: DataFrame) -> html.Div:
             x=df_action['datetime'], y=[0]*df_action.shape[0], mode='none', name='',
             hovertext=action, hoverinfo='text'
         ))
-        for _, action_row in df_action.iterrows():
-            fig.add_vline(x=action_row['datetime'], line_width=1, line_dash='dash',
-                          line_color=action_color)
+        if markers_mode == 'batched':
+            color_datetimes.setdefault(action_color, []).extend(df_action['datetime'])
+            continue
+        # The shapes are assigned at once: `add_vline` validates all of them on every call.
+        shapes.extend({'type': 'line', 'x0': datetime, 'x1': datetime, 'xref': 'x', 'y0': 0, 'y1': 1,
+                       'yref': 'y domain', 'line': {'color': action_color, 'dash': 'dash', 'width': 1}}
+                      for datetime in df_action['datetime'])
+    if shapes:
+        fig.update_layout(shapes=shapes)
 
-    fig.update_layout(template='plotly_dark+nakamoto',
-                      title=df.columns.name.split('|')[0],
-                      hovermode='x unified')
+    for action_color, datetimes in color_datetimes.items():
+        # One line per datetime from the bottom to the top of the plot, separated by gaps.
+        # They use a hidden y-axis with a fixed [0, 1] range, as `add_vline` does.
+        fig.add_trace(scatter(
+            x=[value for datetime in datetimes for value in (datetime, datetime, None)],
+            y=[value for _ in datetimes for value in (0, 1, None)],
+            mode='lines', yaxis='y2', showlegend=False, hoverinfo='skip',
+            line={'color': action_color, 'width': 1, 'dash': 'dash'}
+        ))
+    if color_datetimes:
+        fig.update_layout(yaxis2={'overlaying': 'y', 'range': [0, 1], 'visible': False,
+                                  'fixedrange': True})
 
-    return \
-        html.Div(
-            className='price-list',
-            children=[Graph(figure=fig)]
-        )
+    fig.update_layout(template='plotly_dark+nakamoto',
+                      title=name.split('|')[0],
+                      hovermode='x unified',
+                      # Keeps the zoom when the figure is replaced with a finer level.
+                      uirevision=name)
+    if x_range is not None:
+        fig.update_layout(xaxis_range=list(x_range))
+    return fig
 
 
 def render_rule(rule: Rule) -> html.Div:
@@ -217,6 +345,7 @@ def render_rule(rule: Rule) -> html.Div:
         )
 
 
+@timed()
 def render_rule_set(rule_set: Dict[str, Set[Rule]], title: str = 'Rule Set') -> html.Div:
     """ Render a Nakamoto rule set. """
     rules, stop_rules = rule_set['rule_set'], rule_set['stop_rules']
@@ -229,13 +358,14 @@ def render_rule_set(rule_set: Dict[str, Set[Rule]], title: str = 'Rule Set') ->
         )
 
 
-def render_simulation_df(df: DataFrame) -> DataTable:
-    """ Render a Nakamoto simulation DataFrame as a Dash DataTable. """
-    simulation_df = df.copy()
-    simulation_df['datetime'] = simulation_df.index
-    simulation_df = simulation_df[['datetime'] + [col for col in simulation_df.columns
-                                                  if col not in ['datetime']]]
-    simulation_df['datetime'] = simulation_df['datetime'].apply(utils.format_datetime_element)
+@timed()
+def render_simulation_df(df: DataFrame, page_size: int = SIMULATION_TABLE_PAGE_SIZE) -> DataTable:
+    """
+    Render a Nakamoto simulation DataFrame as a Dash DataTable. Only its first page is
+    rendered: the paging, sorting and filtering are done by the server (see
+    `render_simulation_table_page`).
+    """
+    positions, page_count = get_page_positions(np.arange(len(df)), 0, page_size)
     conditional_styles = [
         {'if': {'filter_query': '{action} = "sale"'},
          'backgroundColor': styles.DARK_RED},
@@ -245,15 +375,89 @@ def render_simulation_df(df: DataFrame) -> DataTable:
                 'column_id': 'action'},
          'backgroundColor': styles.TABLE_CELL_HIGHLIGHTED}
     ]
-    return render_table(simulation_df, conditional_styles=conditional_styles)
+    return render_table(
+        get_simulation_table_df(df.iloc[positions]), conditional_styles=conditional_styles,
+        table_kwargs={'id': 'simulation-table', 'page_action': 'custom', 'page_current': 0,
+                      'page_size': page_size, 'page_count': page_count, 'sort_action': 'custom',
+                      'sort_mode': 'multi', 'sort_by': [], 'filter_action': 'custom',
+                      'filter_query': ''})
+
+
+@timed()
+def render_simulation_table_page(df: DataFrame, positions: np.ndarray) -> Tuple[List[dict], List[dict]]:
+    """
+    Render some rows of a simulation DataFrame for its DataTable.
+    :param positions: positions of the rows (see `table_queries.query_positions`).
+    :return: a tuple (`data`, `tooltip_data`) of the DataTable.
+    """
+    page_df = get_simulation_table_df(df.iloc[positions])
+    return get_table_records(page_df), get_tooltip_data(page_df)
+
+
+def get_simulation_table_df(df: DataFrame) -> DataFrame:
+    """ Get the columns shown in the DataTable of a simulation DataFrame. """
+    simulation_df = df.copy()
+    simulation_df['datetime'] = [utils.format_datetime_element(datetime) for datetime in simulation_df.index]
+    return simulation_df[['datetime'] + [col for col in simulation_df.columns if col not in ['datetime']]]
+
+
+@timed()
+def render_leaderboard(metrics_index: MetricsIndex, page_size: int = LEADERBOARD_PAGE_SIZE) -> html.Div:
+    """
+    Render the leaderboard of the simulations: a DataTable with their main metrics, sorted
+    by the performance improvement. Only its first page is rendered: the paging, sorting
+    and filtering are done by the server (see `render_leaderboard_page`).
+    """
+    sort_by = [{'column_id': PERFORMANCE_IMPROVEMENT, 'direction': 'desc'}]
+    positions, page_count = get_page_positions(metrics_index.get_positions(sort_by=sort_by), 0, page_size)
+    return html.Div(
+        className='leaderboard',
+        children=[
+            html.Label(['Leaderboard']),
+            render_table(
+                get_leaderboard_df(metrics_index, positions), use_tooltip=False,
+                table_kwargs={'id': 'leaderboard-table', 'page_action': 'custom', 'page_current': 0,
+                              'page_size': page_size, 'page_count': page_count, 'sort_action': 'custom',
+                              'sort_mode': 'multi', 'sort_by': sort_by, 'filter_action': 'custom',
+                              'filter_query': ''})
+        ])
+
+
+@timed()
+def render_leaderboard_page(metrics_index: MetricsIndex, positions: np.ndarray) -> List[dict]:
+    """
+    Render some rows of the leaderboard.
+    :param positions: positions of the rows (see `MetricsIndex.get_positions`).
+    :return: the `data` of its DataTable.
+    """
+    return get_table_records(get_leaderboard_df(metrics_index, positions))
+
+
+def get_leaderboard_df(metrics_index: MetricsIndex, positions: np.ndarray) -> DataFrame:
+    """ Get the columns shown in the leaderboard: the simulation identifiers and LEADERBOARD_COLUMNS. """
+    return metrics_index.df.iloc[positions][LEADERBOARD_COLUMNS].reset_index()
+
+
+def get_table_records(df: DataFrame, n_decimals: int = 8) -> List[dict]:
+    """ Get the `data` of a DataTable. """
+    return df.round(n_decimals).to_dict('records')
+
+
+def get_tooltip_data(df: DataFrame) -> List[dict]:
+    """ Get the `tooltip_data` of a DataTable, with the complete value of every cell. """
+    return [{column: {'value': str(value), 'type': 'markdown'} for column, value in row.items()}
+            for row in df.to_dict('records')]
 
 
 def render_table(df: DataFrame, n_decimals: int = 8, use_tooltip: bool = True,
-                 conditional_styles: List[dict] = None) -> DataTable:
-    """ Render a Dash DataTable using a DataFrame. Watch out: index is ignored. """
+                 conditional_styles: List[dict] = None, table_kwargs: dict = None) -> DataTable:
+    """
+    Render a Dash DataTable using a DataFrame. Watch out: index is ignored.
+    :param table_kwargs: other DataTable properties.
+    """
     data_table_kwargs = {
         'columns': [{'name': i, 'id': i} for i in df.columns],
-        'data': df.round(n_decimals).to_dict('records'),
+        'data': get_table_records(df, n_decimals),
         'fixed_rows': {'headers': True},
         'style_table': styles.table_style,
         'style_header': styles.table_header_style,
@@ -263,15 +467,14 @@ def render_table(df: DataFrame, n_decimals: int = 8, use_tooltip: bool = True,
             {'if': {'state': 'selected'}, **styles.table_select_style},
         ],
         'style_cell': styles.table_cell_style,
+        **(table_kwargs or {}),
     }
     if conditional_styles:
         data_table_kwargs['style_data_conditional'].extend(conditional_styles)
     if use_tooltip:
         data_table_kwargs.update({
             'tooltip_header': {i: i for i in df.columns},
-            'tooltip_data': [{column: {'value': str(value), 'type': 'markdown'}
-                              for column, value in row.items()}
-                             for row in df.to_dict('records')],
+            'tooltip_data': get_tooltip_data(df),
             'tooltip_duration': None,
             # TODO 2022.02.09 These styles are ugly there. But watch out: they are difficult to check.
             'css': [
@@ -1,4 +1,5 @@
 
+from os import cpu_count
 from pathlib import Path
 
 
@@ -9,3 +10,98 @@ def get_project_root() -> str:
 DEBUG_MODE = False
 
 DATA_FOLDER = f'{get_project_root()}/data'
+
+# 'eager' loads every simulation at startup. 'lazy' only scans the data folder names,
+# and loads every simulation the first time it is requested. 'shared' works as 'lazy',
+# but loading from a memory-mapped store shared by all the processes of the host.
+# 'dataset' works as 'lazy', but loading from a partitioned Parquet dataset, which only
+# needs a few files for all the simulations.
+DATA_LOADING_MODE = 'eager'
+# Maximum number of simulations kept in memory by the 'lazy' loading mode. If
+# SIMULATION_CACHE_BY_MEMORY, it is the maximum number of bytes of the simulation DataFrames.
+SIMULATION_CACHE_SIZE = 64
+SIMULATION_CACHE_BY_MEMORY = False
+
+# Workers used by `load_data` to parse the simulation folders. If LOADING_WORKERS > 1,
+# they are run in a pool of threads or processes, depending on LOADING_BACKEND.
+LOADING_WORKERS = 1
+LOADING_BACKEND = 'thread'
+
+# Whether to keep a Parquet copy of every `simulation_df.csv` next to it, which is much
+# faster to load. It is rebuilt when the .csv file changes.
+SIMULATION_PARQUET_CACHE = True
+
+# Folder of the memory-mapped store used by the 'shared' loading mode. It is built from
+# DATA_FOLDER if it does not exist, and rebuilt when the files of DATA_FOLDER change.
+SHARED_STORE_FOLDER = f'{get_project_root()}/shared_store'
+
+# Folder of the partitioned dataset used by the 'dataset' loading mode. It is migrated
+# from DATA_FOLDER if it does not exist, and migrated again when the files of DATA_FOLDER change.
+DATASET_STORE_FOLDER = f'{get_project_root()}/dataset_store'
+
+# Maximum memory of the simulations whose dashboard components are kept rendered, in
+# bytes (the rendered components are proportional to the simulation DataFrame memory).
+# The RENDER_CACHE_WARM_NEIGHBOURS simulations before and after the shown one are
+# rendered in the background, so Prev / Next do not wait for them (0 to disable it).
+RENDER_CACHE_SIZE = 256 * 2 ** 20
+RENDER_CACHE_WARM_NEIGHBOURS = 1
+
+# How the action lines of the simulation graph are drawn: 'shapes' (a layout shape per
+# action), 'batched' (a single trace per color) or 'auto' ('shapes' if there are at most
+# ACTION_SHAPES_MAX actions). Above WEBGL_ROWS_THRESHOLD rows, the lines use WebGL.
+ACTION_MARKERS_MODE = 'auto'
+ACTION_SHAPES_MAX = 100
+WEBGL_ROWS_THRESHOLD = 5000
+
+# Where the Prev / Next navigation runs: 'server' (a callback per click) or 'client' (in
+# the browser, with the NAVIGATION_PREFETCH_NEIGHBOURS simulations before and after the
+# shown one prefetched, so they are shown without waiting for the server).
+NAVIGATION_MODE = 'server'
+NAVIGATION_PREFETCH_NEIGHBOURS = 1
+
+# Maximum number of rows drawn in the price and performance lines. Longer simulations
+# are downsampled, and finer rows are loaded when zooming in.
+DOWNSAMPLING_MAX_POINTS = 2000
+
+# Rows per page of the simulation DataTable. Its pages are sent by the server when they
+# are shown, sorted and filtered there.
+SIMULATION_TABLE_PAGE_SIZE = 100
+
+# Rows per page of the leaderboard, the DataTable that ranks all the simulations by their
+# metrics (see `metrics_index`).
+LEADERBOARD_PAGE_SIZE = 20
+
+# Processes used by `sweep.sweep` to run the simulations of a parameter grid, and number
+# of finished simulations between its progress logs.
+SWEEP_WORKERS = cpu_count() or 1
+SWEEP_PROGRESS_STEP = 100
+
+# Mean number of rows between the rule actions of the simulations generated by
+# `synthetic.generate`.
+SYNTHETIC_ACTION_INTERVAL = 200
+
+# Benchmarks (see `nakamoto_explorer.benchmarks`): folder where their synthetic datasets
+# are written, runs of every stage, and relative increase of a measure allowed before
+# it is reported as a regression against the baseline.
+BENCHMARK_DATA_FOLDER = f'{get_project_root()}/benchmark_data'
+BENCHMARK_REPEATS = 5
+BENCHMARK_TOLERANCE = 0.25
+
+# Instrumentation of the dashboard server (see `instrumentation`): whether to time the
+# renders and callbacks and serve the metrics at /metrics, the bucket upper bounds of its
+# histograms, in seconds and in bytes, and the duration above which a callback request
+# is logged with its stages (None to disable it).
+INSTRUMENTATION_ENABLED = False
+INSTRUMENTATION_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+INSTRUMENTATION_BYTES_BUCKETS = tuple(2 ** exponent for exponent in range(10, 28, 2))
+SLOW_CALLBACK_SECONDS = None
+
+# Whether the dashboard app loads the data in a background thread as soon as its process
+# gets a first request (e.g. a health check). Otherwise, it is loaded by the first request
+# that needs it.
+APP_WARM_UP = True
+
+# Whether `load_data` keeps a JSON index of the parsed YAML files of every price list
+# folder next to them, which is much faster to load than parsing them. A file is only
+# parsed again when it changes.
+YAML_INDEX = True
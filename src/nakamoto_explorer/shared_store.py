@@ -0,0 +1,102 @@
+"""
+Memory-mapped simulation store, to share the data between processes.
+
+Every simulation DataFrame is saved as an uncompressed Arrow IPC file, and the rest of the
+data (metrics, rule sets and historial kwargs) in a single `catalog.json` file.
+When the store is loaded, the DataFrames are memory-mapped: their numeric columns are
+read-only views of the files, so all the processes of a host (e.g. the gunicorn workers
+that serve `app.server`) share one physical copy of the data through the OS page cache,
+instead of keeping a private copy each.
+
+The store is built by the first process that loads it, and rebuilt when the files of the
+data folder change. Build (or rebuild) it beforehand with:
+    python -m nakamoto_explorer.shared_store [--input-path DATA_FOLDER] [--store-folder FOLDER]
+"""
+from argparse import ArgumentParser
+from functools import partial
+from json import dump, load
+from os import getpid
+from pathlib import Path
+from typing import List, Mapping, Optional, Sequence
+
+from nakamoto_explorer.cache import LRUCache
+from nakamoto_explorer.files import (build_store_if_outdated, get_folder_signature, load_arrow, replace_folder,
+                                     save_arrow, save_store_source, store_lock)
+from nakamoto_explorer.input_data import (LazySimulation, load_data, load_rule_set_list,
+                                          rule_set_to_rule_set_list)
+from nakamoto_explorer.settings import DATA_FOLDER, SHARED_STORE_FOLDER, SIMULATION_CACHE_SIZE
+
+CATALOG_FILE = 'catalog.json'
+
+
+def build_shared_store(data: Sequence[Mapping], store_folder: str = SHARED_STORE_FOLDER,
+                       source: Optional[dict] = None):
+    """
+    Build a store from loaded data. The store is written in a temporary folder that
+    replaces `store_folder` once it is complete, so readers never see a partial store.
+    :param data: data elements, as returned by `input_data.load_data`.
+    :param store_folder: output folder.
+    :param source: signature of the data folder (see `files.get_folder_signature`).
+    """
+    temporary_folder = f'{store_folder}.{getpid()}.tmp'
+    Path(temporary_folder).mkdir(parents=True)
+    catalog = {'historial_kwargs': {}, 'simulations': []}
+    for data_element in data:
+        identifier = data_element['identifier']
+        file_name = f"prices_{identifier['price_list']}-rule_set_{identifier['rule_set']}.arrow"
+        save_arrow(data_element['simulation_df'], f'{temporary_folder}/{file_name}')
+        catalog['historial_kwargs'][str(identifier['price_list'])] = data_element['historial_kwargs']
+        catalog['simulations'].append({
+            'identifier': identifier,
+            'file': file_name,
+            'metrics': data_element['metrics'],
+            'rule_set': rule_set_to_rule_set_list(data_element['rule_set_kwargs'])})
+    with open(f'{temporary_folder}/{CATALOG_FILE}', 'w') as file:
+        dump(catalog, file)
+    save_store_source(temporary_folder, source)
+
+    replace_folder(temporary_folder, store_folder)
+
+
+def load_shared_store(store_folder: str = SHARED_STORE_FOLDER, input_path: str = DATA_FOLDER,
+                      cache_size: int = SIMULATION_CACHE_SIZE) -> List[LazySimulation]:
+    """
+    Load a store, building it from `input_path` if it does not exist or the data changed
+    (see `files.build_store_if_outdated`).
+    :param store_folder: folder of the store.
+    :param input_path: data folder used to build the store if it does not exist.
+    :param cache_size: maximum number of simulations kept loaded. Their DataFrames are
+        memory-mapped, so the cache only saves the cost of rebuilding them.
+    :return: a list of LazySimulation, sorted as the list returned by `input_data.load_data`.
+    """
+    build_store_if_outdated(store_folder, input_path, CATALOG_FILE,
+                            lambda source: build_shared_store(load_data(input_path), store_folder, source))
+    with open(f'{store_folder}/{CATALOG_FILE}', 'r') as file:
+        catalog = load(file)
+
+    cache = LRUCache(cache_size)
+    return [LazySimulation(
+        identifier=entry['identifier'],
+        load_function=partial(load_store_simulation, store_folder, entry,
+                              catalog['historial_kwargs'][str(entry['identifier']['price_list'])]),
+        cache=cache,
+        metrics_function=partial(entry.get, 'metrics')) for entry in catalog['simulations']]
+
+
+def load_store_simulation(store_folder: str, entry: dict, historial_kwargs: dict) -> dict:
+    """ Load a data element of the store, memory-mapping its simulation DataFrame. """
+    return {'simulation_df': load_arrow(f"{store_folder}/{entry['file']}", memory_map=True),
+            'metrics': entry['metrics'],
+            'rule_set_kwargs': load_rule_set_list(entry['rule_set']),
+            'historial_kwargs': historial_kwargs,
+            'identifier': entry['identifier']}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Build the memory-mapped simulation store.')
+    parser.add_argument('--input-path', default=DATA_FOLDER)
+    parser.add_argument('--store-folder', default=SHARED_STORE_FOLDER)
+    arguments = parser.parse_args()
+    with store_lock(arguments.store_folder):
+        build_shared_store(load_data(arguments.input_path), arguments.store_folder,
+                           get_folder_signature(arguments.input_path))
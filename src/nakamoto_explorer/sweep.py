@@ -0,0 +1,254 @@
+"""
+Parameter sweep: backtest every combination of a rule parameter grid over some price lists,
+writing the results with the `prices_N/rule_set_M` layout read by `input_data.load_data`.
+
+The grid is a YAML file with the price lists (as `historial_kwargs.yml`) and the rule set
+templates. A template is a rule set list (as `rule_set.yml`) where any parameter can be a
+list of values, and it is expanded to every combination of them:
+    price_lists:
+      - price_list: [1, 2, 3, 2, 1]
+        adjust_inversion: true
+    rule_sets:
+      - - rule_name: MarginSale
+          margin_threshold: [0.1, 0.2, 0.4]
+          hold_percent: [0.5, 0.8]
+        - rule_name: AbsoluteStopLoss
+          threshold: 1
+
+Every simulation folder is written in a temporary folder that replaces the final one once
+it is complete, so a sweep can be interrupted and run again: the complete folders are
+skipped. The rule sets are numbered in the grid expansion order, so the grid must not be
+changed between runs of the same sweep (the folders whose rule set changed are recomputed).
+
+Run a sweep with:
+    python -m nakamoto_explorer.sweep GRID_YAML OUTPUT_FOLDER [--workers N]
+"""
+from argparse import ArgumentParser
+from functools import lru_cache, partial
+from itertools import product
+from logging import INFO, basicConfig, getLogger
+from os import getpid, kill, name as os_name, rename
+from os.path import exists
+from pathlib import Path
+from shutil import rmtree
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from pandas import DataFrame
+
+from nakamoto_explorer.exceptions import NakamotoExplorerException, ValidationException
+from nakamoto_explorer.files import get_folders_inside_folder, load_yaml, save_yaml
+from nakamoto_explorer.input_data import get_executor, load_rule_set_list
+from nakamoto_explorer.nakamoto.backtesting import backtest
+from nakamoto_explorer.nakamoto.metrics import get_metrics, get_no_rules_df
+from nakamoto_explorer.settings import SWEEP_PROGRESS_STEP, SWEEP_WORKERS
+
+logger = getLogger(__name__)
+
+SIMULATION_FILES = ('rule_set.yml', 'simulation_df.csv')
+METRICS_FILE = 'metrics.yml'
+
+T = TypeVar('T')
+
+
+def expand_rule_set_template(rule_set_template: List[dict]) -> List[List[dict]]:
+    """
+    Expand a rule set template into every rule set list it represents: the list-valued
+    parameters are replaced by each combination of their values.
+    """
+    grid_keys = [(rule_position, parameter)
+                 for rule_position, rule_dict in enumerate(rule_set_template)
+                 for parameter, value in rule_dict.items()
+                 if parameter != 'rule_name' and isinstance(value, list)]
+    grid_values = [rule_set_template[rule_position][parameter] for rule_position, parameter in grid_keys]
+    rule_set_lists = []
+    for combination in product(*grid_values):
+        rule_set_list = [dict(rule_dict) for rule_dict in rule_set_template]
+        for (rule_position, parameter), value in zip(grid_keys, combination):
+            rule_set_list[rule_position][parameter] = value
+        rule_set_lists.append(rule_set_list)
+    return rule_set_lists
+
+
+def expand_grid(grid: dict) -> List[List[dict]]:
+    """ Get every rule set list of a grid, validating that all of them can be loaded. """
+    if not grid.get('rule_sets'):
+        raise ValidationException('The grid has no `rule_sets`', grid)
+    rule_set_lists = [rule_set_list for rule_set_template in grid['rule_sets']
+                      for rule_set_list in expand_rule_set_template(rule_set_template)]
+    for rule_set_list in rule_set_lists:
+        load_rule_set_list(rule_set_list)
+    return rule_set_lists
+
+
+def get_sweep_tasks(grid: dict, output_path: str, with_metrics: bool = True
+                    ) -> List[Tuple[str, dict, List[dict]]]:
+    """
+    Get the simulations of a sweep that are not complete yet in `output_path`, writing the
+    `historial_kwargs.yml` of every price list.
+    :param with_metrics: whether the simulations need a `metrics.yml` file to be complete.
+    :return: a list of tasks (simulation folder, historial_kwargs, rule set list).
+    """
+    if not grid.get('price_lists'):
+        raise ValidationException('The grid has no `price_lists`', grid)
+    rule_set_lists = expand_grid(grid)
+    tasks = []
+    for price_list_idx, historial_kwargs in enumerate(grid['price_lists'], start=1):
+        prices_folder = f'{output_path}/prices_{price_list_idx}'
+        Path(prices_folder).mkdir(parents=True, exist_ok=True)
+        remove_temporary_folders(prices_folder)
+        historial_kwargs_path = f'{prices_folder}/historial_kwargs.yml'
+        if not exists(historial_kwargs_path) or load_yaml(historial_kwargs_path) != historial_kwargs:
+            save_yaml(historial_kwargs, historial_kwargs_path)
+        for rule_set_idx, rule_set_list in enumerate(rule_set_lists, start=1):
+            simulation_folder = f'{prices_folder}/rule_set_{rule_set_idx}'
+            if not is_simulation_complete(simulation_folder, rule_set_list, with_metrics):
+                tasks.append((simulation_folder, historial_kwargs, rule_set_list))
+    return tasks
+
+
+def is_simulation_complete(simulation_folder: str, rule_set_list: List[dict],
+                           with_metrics: bool = True) -> bool:
+    """ Whether a simulation folder has already been written with the same rule set. """
+    file_names = (*SIMULATION_FILES, METRICS_FILE) if with_metrics else SIMULATION_FILES
+    return all(exists(f'{simulation_folder}/{file_name}') for file_name in file_names) \
+        and load_yaml(f'{simulation_folder}/rule_set.yml') == rule_set_list
+
+
+def remove_temporary_folders(prices_folder: str):
+    """
+    Remove the temporary folders left by interrupted sweeps. The ones of the processes that
+    are still running (`<simulation folder>.<pid>.tmp`) are kept, as other sweeps over the
+    same output folder may be writing them.
+    """
+    for folder in get_folders_inside_folder(prices_folder):
+        if folder.endswith('.tmp'):
+            pid = get_temporary_folder_pid(folder)
+            if pid is None or pid == getpid() or not is_process_running(pid):
+                rmtree(f'{prices_folder}/{folder}')
+
+
+def get_temporary_folder_pid(folder: str) -> Optional[int]:
+    """ Get the pid of the process that writes a temporary folder, or None if it has none. """
+    try:
+        return int(folder.rsplit('.', 2)[-2])
+    except (IndexError, ValueError):
+        return None
+
+
+def is_process_running(pid: int) -> bool:
+    """ Whether a process of this machine is running. """
+    if os_name == 'nt':
+        # `kill` would terminate it, so every process is taken as running.
+        return True
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # It is running as another user.
+    return True
+
+
+def get_cached_no_rules_df(historial_kwargs: dict) -> DataFrame:
+    """ Get the simulation DataFrame without rules of a price list, computing it once per process. """
+    return _get_cached_no_rules_df(tuple(historial_kwargs['price_list']),
+                                   historial_kwargs.get('adjust_inversion', True))
+
+
+@lru_cache(maxsize=16)
+def _get_cached_no_rules_df(price_list: Tuple[float, ...], adjust_inversion: bool) -> DataFrame:
+    return get_no_rules_df({'price_list': list(price_list), 'adjust_inversion': adjust_inversion})
+
+
+def run_simulation(simulation_folder: str, historial_kwargs: dict, rule_set_list: List[dict],
+                   with_metrics: bool = True):
+    """
+    Backtest a rule set over a price list, and write its simulation folder.
+    :param simulation_folder: output `prices_N/rule_set_M` folder. It is replaced if it exists.
+    :param historial_kwargs: price list and backtest parameters, as in `historial_kwargs.yml`.
+    :param rule_set_list: rule set, as in `rule_set.yml`.
+    :param with_metrics: whether to write the `metrics.yml` file.
+    """
+    # The rule sets of a sweep run over the same price lists, so they share their masks.
+    simulation_df = backtest(historial_kwargs['price_list'], load_rule_set_list(rule_set_list),
+                             adjust_inversion=historial_kwargs.get('adjust_inversion', True),
+                             use_mask_cache=True)
+    temporary_folder = f'{simulation_folder}.{getpid()}.tmp'
+    Path(temporary_folder).mkdir(parents=True)
+    save_yaml(rule_set_list, f'{temporary_folder}/rule_set.yml')
+    simulation_df.to_csv(f'{temporary_folder}/simulation_df.csv')
+    if with_metrics:
+        metrics = get_metrics(simulation_df, get_cached_no_rules_df(historial_kwargs))
+        save_yaml(metrics, f'{temporary_folder}/{METRICS_FILE}')
+    if exists(simulation_folder):
+        rmtree(simulation_folder)
+    rename(temporary_folder, simulation_folder)
+
+
+def try_run_simulation(task: Tuple[str, dict, List[dict]], with_metrics: bool = True
+                       ) -> Tuple[str, Optional[str]]:
+    """ Run a sweep task, returning (simulation folder, failure message or None). """
+    simulation_folder, historial_kwargs, rule_set_list = task
+    try:
+        run_simulation(simulation_folder, historial_kwargs, rule_set_list, with_metrics)
+        return simulation_folder, None
+    except (Exception, NakamotoExplorerException) as error:
+        return simulation_folder, f'Simulation {simulation_folder} failed: {error}'
+
+
+def sweep(grid_path: str, output_path: str, n_workers: int = SWEEP_WORKERS,
+          with_metrics: bool = True, progress_step: int = SWEEP_PROGRESS_STEP) -> Dict[str, int]:
+    """
+    Run a parameter sweep, skipping the simulations already complete in `output_path`.
+    :param grid_path: YAML file with the parameter grid (see the module docstring).
+    :param output_path: data folder where the simulations are written.
+    :param n_workers: number of processes that run the simulations. If it is 1, they
+        are run sequentially in the current process.
+    :param with_metrics: whether to write the `metrics.yml` files. Without them, the
+        output can not be loaded by `input_data.load_data`.
+    :param progress_step: number of finished simulations between progress logs.
+    :return: a dictionary with the number of 'done', 'skipped' and 'failed' simulations.
+    """
+    grid = load_yaml(grid_path)
+    tasks = get_sweep_tasks(grid, output_path, with_metrics=with_metrics)
+    n_simulations = len(grid['price_lists']) * len(expand_grid(grid))
+    logger.info(f'Sweep of {n_simulations} simulations: {n_simulations - len(tasks)} already '
+                f'complete, {len(tasks)} to run with {n_workers} workers')
+
+    summary = run_tasks(tasks, partial(try_run_simulation, with_metrics=with_metrics), n_workers, progress_step)
+    return {'done': summary['done'], 'skipped': n_simulations - len(tasks), 'failed': summary['failed']}
+
+
+def run_tasks(tasks: Sequence[T], try_run_task: Callable[[T], Tuple[str, Optional[str]]],
+              n_workers: int = SWEEP_WORKERS, progress_step: int = SWEEP_PROGRESS_STEP) -> Dict[str, int]:
+    """
+    Run some tasks in a process pool, logging their progress and failures.
+    :param try_run_task: picklable function that runs a task, returning (task name,
+        failure message or None). It must not raise exceptions.
+    :return: a dictionary with the number of 'done' and 'failed' tasks.
+    """
+    summary = {'done': 0, 'failed': 0}
+    with get_executor(n_workers, backend='process') as executor:
+        chunk_size = max(1, len(tasks) // (16 * max(n_workers, 1)))
+        results = executor.map(try_run_task, tasks, chunksize=chunk_size)
+        for n_finished, (_, message) in enumerate(results, start=1):
+            if message is None:
+                summary['done'] += 1
+            else:
+                summary['failed'] += 1
+                logger.warning(message)
+            if n_finished % progress_step == 0 or n_finished == len(tasks):
+                logger.info(f'Progress: {n_finished} / {len(tasks)} ({summary["failed"]} failed)')
+    return summary
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Backtest every combination of a rule parameter grid.')
+    parser.add_argument('grid_path')
+    parser.add_argument('output_path')
+    parser.add_argument('--workers', type=int, default=SWEEP_WORKERS)
+    parser.add_argument('--no-metrics', action='store_true', help='do not write metrics.yml files')
+    arguments = parser.parse_args()
+    basicConfig(level=INFO)
+    sweep(arguments.grid_path, arguments.output_path, n_workers=arguments.workers,
+          with_metrics=not arguments.no_metrics)
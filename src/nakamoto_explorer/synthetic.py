@@ -0,0 +1,190 @@
+"""
+Synthetic data generator: writes a data folder with the `prices_N/rule_set_M` layout read by
+`input_data.load_data`, of any size, to test the loading, the renders and the dashboard at scale.
+
+Every price list is a geometric random walk with its own initial price and volatility, and
+its rule sets are random margin rules whose thresholds are scaled to that volatility, so they
+act about every `action_interval` rows. The simulations are backtested, so their actions,
+balances and `metrics.yml` are consistent.
+
+Everything is generated from a seed: the same parameters always produce the same data, no
+matter the number of workers. The generation can be interrupted and run again, skipping the
+simulations already written:
+    python -m nakamoto_explorer.synthetic OUTPUT_FOLDER --price-lists 10 --rule-sets 100 \\
+        --rows 100000 [--seed 0] [--action-interval 200] [--workers N] [--parquet-cache]
+"""
+from argparse import ArgumentParser
+from functools import lru_cache, partial
+from logging import INFO, basicConfig, getLogger
+from os.path import exists
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from nakamoto_explorer.exceptions import NakamotoExplorerException, ValidationException
+from nakamoto_explorer.files import load_yaml, save_yaml
+from nakamoto_explorer.input_data import load_simulation_csv
+from nakamoto_explorer.settings import SWEEP_PROGRESS_STEP, SWEEP_WORKERS, SYNTHETIC_ACTION_INTERVAL
+from nakamoto_explorer.sweep import is_simulation_complete, remove_temporary_folders, run_simulation, run_tasks
+
+logger = getLogger(__name__)
+
+MANIFEST_FILE = 'synthetic.yml'
+# Ranges of the random price list parameters (sampled log-uniformly).
+INITIAL_PRICE_RANGE = (1., 50000.)
+VOLATILITY_RANGE = (0.0005, 0.005)
+# Probability of a rule set to have an AbsoluteStopLoss, and its threshold range relative
+# to the initial price.
+STOP_LOSS_PROBABILITY = 0.2
+STOP_LOSS_RANGE = (0.3, 0.7)
+
+
+def get_log_uniform(rng: np.random.Generator, value_range: Tuple[float, float]) -> float:
+    return float(np.exp(rng.uniform(np.log(value_range[0]), np.log(value_range[1]))))
+
+
+def get_random_walk_prices(n_rows: int, seed: Union[int, Sequence[int]] = 0, initial_price: float = 100.,
+                           volatility: float = 0.002) -> List[float]:
+    """ Get a geometric random walk price list, reproducible from its seed (see `numpy.random.default_rng`). """
+    returns = np.random.default_rng(seed).normal(0, volatility, n_rows - 1)
+    prices = initial_price * np.exp(np.concatenate([[0.], np.cumsum(returns)]))
+    return np.round(prices, 6).tolist()
+
+
+def get_price_list_parameters(seed: int, price_list_idx: int) -> Dict[str, float]:
+    """ Get the random initial price and volatility of a price list. """
+    rng = np.random.default_rng([seed, price_list_idx])
+    return {'initial_price': round(get_log_uniform(rng, INITIAL_PRICE_RANGE), 2),
+            'volatility': round(get_log_uniform(rng, VOLATILITY_RANGE), 6)}
+
+
+@lru_cache(maxsize=4)
+def get_historial_kwargs(seed: int, price_list_idx: int, n_rows: int) -> dict:
+    """ Get the `historial_kwargs.yml` of a price list. It is cached, since all its simulations need it. """
+    parameters = get_price_list_parameters(seed, price_list_idx)
+    return {'price_list': get_random_walk_prices(n_rows, seed=[seed, price_list_idx, 0], **parameters),
+            'adjust_inversion': True}
+
+
+def get_random_rule_set_list(seed: int, price_list_idx: int, rule_set_idx: int,
+                             action_interval: float = SYNTHETIC_ACTION_INTERVAL) -> List[dict]:
+    """
+    Get a random rule set list (as `rule_set.yml`) for a price list. A random walk needs
+    about (margin / volatility) ** 2 rows to move a margin, so the margins are scaled to
+    act about every `action_interval` rows.
+    """
+    parameters = get_price_list_parameters(seed, price_list_idx)
+    rng = np.random.default_rng([seed, price_list_idx, rule_set_idx])
+    rule_set_list = [
+        {'rule_name': rule_name,
+         'margin_threshold': round(parameters['volatility'] * float(np.sqrt(action_interval * rng.uniform(0.5, 2))), 6),
+         'hold_percent': round(float(rng.uniform(0.2, 0.8)), 2)}
+        for rule_name in ('MarginSale', 'MarginPurchase')]
+    if rng.uniform() < STOP_LOSS_PROBABILITY:
+        rule_set_list.append({'rule_name': 'AbsoluteStopLoss',
+                              'threshold': round(parameters['initial_price'] * float(rng.uniform(*STOP_LOSS_RANGE)), 2)})
+    return rule_set_list
+
+
+def check_manifest(output_path: str, manifest: dict):
+    """
+    Write the generation parameters of a data folder, or check that they are the same as
+    the ones of the data already generated in it.
+    """
+    manifest_path = f'{output_path}/{MANIFEST_FILE}'
+    if exists(manifest_path):
+        existing_manifest = load_yaml(manifest_path)
+        if existing_manifest != manifest:
+            raise ValidationException(f'{output_path} was generated with other parameters: '
+                                      f'{existing_manifest}', manifest)
+    else:
+        Path(output_path).mkdir(parents=True, exist_ok=True)
+        save_yaml(manifest, manifest_path)
+
+
+def get_synthetic_tasks(output_path: str, n_price_lists: int, n_rule_sets: int, n_rows: int,
+                        seed: int = 0, action_interval: float = SYNTHETIC_ACTION_INTERVAL
+                        ) -> List[Tuple[str, Tuple[int, int, int], List[dict]]]:
+    """
+    Get the simulations of a synthetic data folder that are not complete yet, writing the
+    `historial_kwargs.yml` of every price list.
+    :return: a list of tasks (simulation folder, (seed, price list index, rows), rule set list).
+        The price lists are generated again from their seed by the workers, instead of
+        sending them with every task.
+    """
+    # Every simulation only depends on these and its indexes, so a data folder can be extended
+    # with more price lists or rule sets.
+    check_manifest(output_path, {'n_rows': n_rows, 'seed': seed, 'action_interval': action_interval})
+    tasks = []
+    for price_list_idx in range(1, n_price_lists + 1):
+        prices_folder = f'{output_path}/prices_{price_list_idx}'
+        Path(prices_folder).mkdir(parents=True, exist_ok=True)
+        remove_temporary_folders(prices_folder)
+        if not exists(f'{prices_folder}/historial_kwargs.yml'):
+            save_yaml(get_historial_kwargs(seed, price_list_idx, n_rows), f'{prices_folder}/historial_kwargs.yml')
+        for rule_set_idx in range(1, n_rule_sets + 1):
+            simulation_folder = f'{prices_folder}/rule_set_{rule_set_idx}'
+            rule_set_list = get_random_rule_set_list(seed, price_list_idx, rule_set_idx, action_interval)
+            if not is_simulation_complete(simulation_folder, rule_set_list):
+                tasks.append((simulation_folder, (seed, price_list_idx, n_rows), rule_set_list))
+    return tasks
+
+
+def try_generate_simulation(task: Tuple[str, Tuple[int, int, int], List[dict]], parquet_cache: bool = False
+                            ) -> Tuple[str, Optional[str]]:
+    """ Backtest and write a synthetic simulation, returning (simulation folder, failure message or None). """
+    simulation_folder, price_list_key, rule_set_list = task
+    try:
+        run_simulation(simulation_folder, get_historial_kwargs(*price_list_key), rule_set_list)
+        if parquet_cache:
+            load_simulation_csv(f'{simulation_folder}/simulation_df.csv', use_cache=True)
+        return simulation_folder, None
+    except (Exception, NakamotoExplorerException) as error:
+        return simulation_folder, f'Synthetic simulation {simulation_folder} failed: {error}'
+
+
+def generate(output_path: str, n_price_lists: int, n_rule_sets: int, n_rows: int, seed: int = 0,
+             action_interval: float = SYNTHETIC_ACTION_INTERVAL, n_workers: int = SWEEP_WORKERS,
+             parquet_cache: bool = False, progress_step: int = SWEEP_PROGRESS_STEP) -> Dict[str, int]:
+    """
+    Generate a synthetic data folder, skipping the simulations already written in it.
+    :param output_path: data folder where the simulations are written.
+    :param n_price_lists: number of price lists.
+    :param n_rule_sets: number of rule sets of every price list.
+    :param n_rows: number of prices of every price list.
+    :param seed: seed that all the random values are generated from.
+    :param action_interval: mean number of rows between the rule actions.
+    :param n_workers: number of processes that generate the simulations.
+    :param parquet_cache: whether to write the Parquet sidecar of every simulation too, so
+        their first load does not parse the .csv files.
+    :param progress_step: number of finished simulations between progress logs.
+    :return: a dictionary with the number of 'done', 'skipped' and 'failed' simulations.
+    """
+    tasks = get_synthetic_tasks(output_path, n_price_lists, n_rule_sets, n_rows, seed, action_interval)
+    n_simulations = n_price_lists * n_rule_sets
+    logger.info(f'Synthetic data of {n_simulations} simulations of {n_rows} rows: '
+                f'{n_simulations - len(tasks)} already complete, {len(tasks)} to generate '
+                f'with {n_workers} workers')
+    summary = run_tasks(tasks, partial(try_generate_simulation, parquet_cache=parquet_cache),
+                        n_workers, progress_step)
+    return {'done': summary['done'], 'skipped': n_simulations - len(tasks), 'failed': summary['failed']}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Generate a synthetic data folder.')
+    parser.add_argument('output_path')
+    parser.add_argument('--price-lists', type=int, required=True)
+    parser.add_argument('--rule-sets', type=int, required=True, help='rule sets per price list')
+    parser.add_argument('--rows', type=int, required=True, help='prices per price list')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--action-interval', type=float, default=SYNTHETIC_ACTION_INTERVAL,
+                        help='mean number of rows between rule actions')
+    parser.add_argument('--workers', type=int, default=SWEEP_WORKERS)
+    parser.add_argument('--parquet-cache', action='store_true',
+                        help='write the Parquet sidecar of every simulation too')
+    arguments = parser.parse_args()
+    basicConfig(level=INFO)
+    generate(arguments.output_path, arguments.price_lists, arguments.rule_sets, arguments.rows,
+             seed=arguments.seed, action_interval=arguments.action_interval, n_workers=arguments.workers,
+             parquet_cache=arguments.parquet_cache)
@@ -0,0 +1,117 @@
+"""
+Server-side paging, sorting and filtering of the simulation DataTable: the table only
+receives the rows of its visible page, so its payload is bounded regardless of the
+simulation length.
+
+The queries are the ones sent by a DataTable with `page_action`, `sort_action` and
+`filter_action` set to 'custom': `sort_by` is a list of {'column_id', 'direction'}, and
+`filter_query` is a string such as `{action} contains Sale && {quote_free} > 10`.
+"""
+from operator import eq, ge, gt, le, lt, ne
+import re
+from typing import List, Optional, Tuple
+
+import numpy as np
+from pandas import DataFrame, Series, Timestamp
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+from nakamoto_explorer.exceptions import ValidationException
+from nakamoto_explorer.instrumentation import timed
+
+DATETIME_COLUMN = 'datetime'
+# DataTable filter operators by their symbols. They may have an `s` (case sensitive) or
+# `i` (case insensitive) prefix, which is ignored.
+FILTER_OPERATORS = {'>=': 'ge', '<=': 'le', '<': 'lt', '>': 'gt', '!=': 'ne', '=': 'eq',
+                    'ge': 'ge', 'le': 'le', 'lt': 'lt', 'gt': 'gt', 'ne': 'ne', 'eq': 'eq',
+                    'contains': 'contains', 'datestartswith': 'datestartswith'}
+FILTER_PART_PATTERN = re.compile(r'^\s*\{(?P<column>[^}]*)\}\s*(?P<operator>[^\s\'"`]+)\s*(?P<value>.*?)\s*$')
+COMPARISONS = {'eq': eq, 'ne': ne, 'lt': lt, 'le': le, 'gt': gt, 'ge': ge}
+
+
+@timed('table_query')
+def query_positions(df: DataFrame, sort_by: Optional[List[dict]] = None,
+                    filter_query: Optional[str] = None) -> np.ndarray:
+    """
+    Get the positions of the rows of a simulation DataFrame that match a DataTable query,
+    in the order they are shown.
+    :param df: simulation DataFrame. Its index is the `datetime` column of the table.
+    :param sort_by: DataTable `sort_by` property.
+    :param filter_query: DataTable `filter_query` property.
+    """
+    table = df.reset_index(drop=True)
+    table[DATETIME_COLUMN] = df.index
+    mask = np.ones(len(table), dtype=bool)
+    for column, operator, value in split_filter_query(filter_query):
+        mask &= get_filter_mask(table, column, operator, value)
+    positions = np.flatnonzero(mask)
+    if not sort_by:
+        return positions
+    for sort_column in sort_by:
+        if sort_column['column_id'] not in table.columns:
+            raise ValidationException(f'Unknown sort column {sort_column["column_id"]}', sort_by)
+    return table.iloc[positions].sort_values(
+        [sort_column['column_id'] for sort_column in sort_by],
+        ascending=[sort_column['direction'] == 'asc' for sort_column in sort_by],
+        kind='mergesort').index.to_numpy()
+
+
+def get_page_positions(positions: np.ndarray, page_current: Optional[int], page_size: int
+                       ) -> Tuple[np.ndarray, int]:
+    """
+    Get the positions of the rows of a DataTable page.
+    :return: a tuple (positions of the page, number of pages).
+    """
+    page_count = max(1, -(-len(positions) // page_size))
+    page_current = min(max(page_current or 0, 0), page_count - 1)
+    return positions[page_current * page_size:(page_current + 1) * page_size], page_count
+
+
+def split_filter_query(filter_query: Optional[str]) -> List[Tuple[str, str, object]]:
+    """ Split a DataTable `filter_query` into its conditions (see `split_filter_part`). """
+    return [split_filter_part(filter_part) for filter_part in (filter_query or '').split(' && ')
+            if filter_part.strip()]
+
+
+def split_filter_part(filter_part: str) -> Tuple[str, str, object]:
+    """
+    Split a condition of a DataTable `filter_query`.
+    :return: a tuple (column, operator, value), with the word form of the operator.
+    """
+    match = FILTER_PART_PATTERN.match(filter_part)
+    operator = match and match['operator']
+    if operator and operator not in FILTER_OPERATORS and operator[0] in ('s', 'i'):
+        operator = operator[1:]
+    if operator not in FILTER_OPERATORS:
+        raise ValidationException(f'Invalid filter {filter_part!r}')
+    value = match['value']
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in ('"', "'", '`'):
+        value = value[1:-1].replace('\\' + value[0], value[0])
+    else:
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    return match['column'], FILTER_OPERATORS[operator], value
+
+
+def get_filter_mask(table: DataFrame, column: str, operator: str, value: object) -> np.ndarray:
+    """ Get the rows of a table that match a filter condition (see `split_filter_part`). """
+    if column not in table.columns:
+        raise ValidationException(f'Unknown filter column {column}')
+    values: Series = table[column]
+    if operator in ('contains', 'datestartswith'):
+        strings = values.dt.strftime('%Y-%m-%d %H:%M:%S') if column == DATETIME_COLUMN \
+            else values.astype(str)
+        if operator == 'contains':
+            return strings.str.contains(str(value), regex=False).to_numpy()
+        return strings.str.startswith(str(value)).to_numpy()
+    try:
+        if column == DATETIME_COLUMN:
+            value = Timestamp(str(value))
+        elif is_bool_dtype(values) and str(value).lower() in ('true', 'false'):
+            value = str(value).lower() == 'true'
+        elif not is_numeric_dtype(values):
+            value = str(value)
+        return COMPARISONS[operator](values, value).fillna(False).to_numpy(dtype=bool)
+    except (TypeError, ValueError) as error:
+        raise ValidationException(f'Column {column} can not be compared with {value!r}') from error